@@ -10,9 +10,18 @@ import os
 from dotenv import load_dotenv
 import bcrypt
 import time
+import uuid
 from contextlib import contextmanager
 from typing import List, Dict, Tuple
-from db_wrapper import DatabaseWrapper
+from db_wrapper import DatabaseWrapper, SUMMARY_COLUMNS
+from db_instrumentation import start_rerun, process_stats
+from energy_snapshot import get_energy_snapshot
+from filter_spec import FilterSpec
+from count_cube import get_count_cube
+from facet_engine import FACETS, get_facet_engine
+from study_matcher import MATCH_COLUMNS, CONFIDENCE_ORDER
+from match_jobs import start_match_job, get_match_job, discard_match_job
+from import_reader import ImportSheet, IMPORT_FIELDS, detect_study_column, import_column_role, import_columns
 from location_map import render_location_map
 from sanitize_metadata_text import sanitize_metadata_text
 from color_schemes import (
@@ -44,9 +53,18 @@ st.markdown("""
 
 """, unsafe_allow_html=True)
 
-# Initialize database wrapper in session state
+@st.cache_resource
+def get_database():
+    """One DatabaseWrapper shared by every session in this server process"""
+    return DatabaseWrapper()
+
+# Point this session at the shared database wrapper
 if 'db' not in st.session_state:
-    st.session_state.db = DatabaseWrapper()
+    st.session_state.db = get_database()
+
+# Database calls made by this rerun; the previous rerun's complete set is kept for the admin summary
+st.session_state.db_last_rerun_calls = st.session_state.get('db_rerun_calls')
+st.session_state.db_rerun_calls = start_rerun()
 
 # Initialize session state variables
 if "current_tab" not in st.session_state:
@@ -85,7 +103,7 @@ def check_database_health():
     try:
         # For Supabase, we'll do a simple query to check connection
         if st.session_state.db.use_supabase:
-            result = st.session_state.db.get_energy_data({'status': 'approved'}, limit=1)
+            result = st.session_state.db.get_energy_data({'status': 'approved'}, limit=1, columns=['id'])
             st.sidebar.success(f"✅ Supabase connected: {len(result)} records accessible")
             return True
         else:
@@ -119,32 +137,14 @@ def check_button_clicks():
 
 def query_approved_criteria():
     """Get criteria from non-rejected records (includes NULL, approved, pending)"""
-    all_records = st.session_state.db.get_energy_data(limit=5000)
-    
-    # Filter out rejected records
-    valid_records = [r for r in all_records if r.get('status') != 'rejected']
-    
-    # Get unique criteria
-    criteria = set()
-    for record in valid_records:
-        if record.get('criteria'):
-            criteria.add(record['criteria'])
-    
+    snapshot = get_energy_snapshot(st.session_state.db)
+    criteria = snapshot.value_counts('criteria', snapshot.valid_mask)
     return [(c,) for c in sorted(criteria)]
 
 def query_approved_energy_outputs():
     """Get energy outputs from non-rejected records (includes NULL, approved, pending)"""
-    all_records = st.session_state.db.get_energy_data(limit=5000)
-    
-    # Filter out rejected records
-    valid_records = [r for r in all_records if r.get('status') != 'rejected']
-    
-    # Get unique energy outputs
-    outputs = set()
-    for record in valid_records:
-        if record.get('energy_method'):
-            outputs.add(record['energy_method'])
-    
+    snapshot = get_energy_snapshot(st.session_state.db)
+    outputs = snapshot.value_counts('energy_method', snapshot.valid_mask)
     return [(o,) for o in sorted(outputs)]
 
 def contribute():
@@ -358,6 +358,13 @@ def contribute():
                 time.sleep(2)
                 st.rerun()
 
+def new_import_session_id():
+    """
+    Id of a new import session. Match jobs are registered per id for the whole server
+    process, so it must be unique across sessions, not just per second.
+    """
+    return f"import_{uuid.uuid4().hex}"
+
 def admin_import_and_match_studies_simple(uploaded_file):
     """
     Simplified study matching - ONLY matches study titles against paragraph content
@@ -365,7 +372,7 @@ def admin_import_and_match_studies_simple(uploaded_file):
     """
     # Generate a unique session ID for this import
     if "current_import_session" not in st.session_state:
-        st.session_state.current_import_session = f"import_{int(time.time())}"
+        st.session_state.current_import_session = new_import_session_id()
     
     session_id = st.session_state.current_import_session
     
@@ -376,124 +383,40 @@ def admin_import_and_match_studies_simple(uploaded_file):
         display_admin_matching_review_fixed(
             st.session_state[f"matched_records_{session_id}"], 
             st.session_state[f"unmatched_studies_{session_id}"], 
-            st.session_state.get(f"excel_df_{session_id}")
+            st.session_state.get(f"excel_df_{session_id}"),
+            session_id
         )
         return st.session_state[f"matched_records_{session_id}"], st.session_state[f"unmatched_studies_{session_id}"]
     
+    # A matching job for this session may still be running from an earlier rerun
+    if get_match_job(session_id) is not None:
+        if follow_match_job(session_id):
+            st.rerun()
+        return [], []
+    if st.session_state.get(f"matching_cancelled_{session_id}"):
+        st.info("⏹️ Matching was cancelled. Upload a new file to start over.")
+        return [], []
+    
     try:
-        # Read Excel file
-        df = pd.read_excel(uploaded_file, sheet_name=0)
-        
-        # Store the dataframe in session state
-        st.session_state[f"excel_df_{session_id}"] = df
+        sheet = ImportSheet(uploaded_file)
         
         # AUTOMATICALLY DETECT study column
-        study_column = None
-        for col in df.columns:
-            col_lower = str(col).lower()
-            if any(keyword in col_lower for keyword in ['study', 'title', 'paper', 'reference', 'citation']):
-                study_column = col
-                break
-        
-        if not study_column:
-            study_column = df.columns[0]
+        study_column = detect_study_column(sheet.columns)
+        if study_column is None:
+            study_column = sheet.columns[0]
             st.warning(f"⚠️ No obvious study column found. Using first column: '{study_column}'")
         
-        st.session_state[f"study_column_{session_id}"] = study_column
+        df, study_names = read_import_rows(sheet, study_column)
         
-        # Get study names
-        study_names = df[study_column].dropna().unique()
-        
-        matched_records = []
-        unmatched_studies = []
+        # Store the dataframe in session state
+        st.session_state[f"excel_df_{session_id}"] = df
+        st.session_state[f"study_column_{session_id}"] = study_column
         
         st.info(f"🔍 Matching {len(study_names)} studies in database using title matching...")
         
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        
-        for i, study_name in enumerate(study_names):
-            if pd.isna(study_name) or not study_name:
-                continue
-                
-            # Clean and normalize the study name
-            clean_study = preprocess_study_name(study_name)
-            
-            status_text.text(f"Searching: {clean_study[:50]}...")
-            
-            # Search in database using wrapper
-            search_results = st.session_state.db.search_energy_data(clean_study, limit=100)
-            
-            matches = []
-            for record in search_results:
-                # Check if the study name appears in the paragraph
-                if clean_study.lower() in record.get('paragraph', '').lower():
-                    matches.append({
-                        'record_id': record['id'],
-                        'paragraph': record['paragraph'],
-                        'criteria': record['criteria'],
-                        'energy_method': record['energy_method'],
-                        'direction': record['direction'],
-                        'scale': record.get('scale'),
-                        'climate': record.get('climate'),
-                        'location': record.get('location'),
-                        'confidence': 'exact_match',
-                        'match_position': record['paragraph'].lower().find(clean_study.lower()),
-                        'match_percentage': 100,
-                        'matching_text': clean_study
-                    })
-            
-            if matches:
-                for match_data in matches:
-                    matched_records.append({
-                        'excel_study': study_name,
-                        'excel_study_normalized': clean_study,
-                        'db_record_id': match_data['record_id'],
-                        'matching_paragraph': match_data['paragraph'],
-                        'criteria': match_data['criteria'],
-                        'energy_method': match_data['energy_method'],
-                        'direction': match_data['direction'],
-                        'scale': match_data['scale'],
-                        'climate': match_data['climate'],
-                        'location': match_data['location'],
-                        'confidence': match_data['confidence'],
-                        'match_position': match_data['match_position'],
-                        'match_percentage': match_data['match_percentage'],
-                        'matching_text': match_data['matching_text']
-                    })
-            else:
-                unmatched_studies.append({
-                    'study_name': study_name,
-                    'normalized_name': clean_study,
-                    'reason': 'No match found in paragraph field'
-                })
-            
-            progress_bar.progress((i + 1) / len(study_names))
-        
-        progress_bar.empty()
-        status_text.empty()
-        
-        # Sort matches by confidence
-        confidence_order = {
-            'exact_match': 0,
-            'strong_match': 1,
-            'good_match': 2,
-            'partial_match': 3,
-            'fuzzy_match': 4
-        }
-        
-        matched_records.sort(key=lambda x: (
-            confidence_order.get(x['confidence'], 999),
-            -x.get('match_percentage', 0)
-        ))
-        
-        # Store results
-        st.session_state[f"matched_records_{session_id}"] = matched_records
-        st.session_state[f"unmatched_studies_{session_id}"] = unmatched_studies
-        
-        display_admin_matching_review_fixed(matched_records, unmatched_studies, df)
-        
-        return matched_records, unmatched_studies
+        start_study_matching(study_names, session_id)
+        follow_match_job(session_id)
+        return [], []
         
     except Exception as e:
         st.error(f"Error during import: {e}")
@@ -522,23 +445,19 @@ def import_location_climate_data_unique():
     
     if uploaded_file is not None:
         try:
-            df = pd.read_excel(uploaded_file, sheet_name=0)
+            # Only the header and the first rows are parsed here; the rest is read on import
+            sheet = ImportSheet(uploaded_file)
             
             st.write("**Preview of data to import:**")
-            st.dataframe(df.head(10))
+            st.dataframe(sheet.preview)
             
-            st.write(f"**Columns found in file:** {list(df.columns)}")
+            st.write(f"**Columns found in file:** {sheet.columns}")
             
             # AUTOMATICALLY DETECT STUDY COLUMN
-            study_column = None
-            for col in df.columns:
-                col_lower = str(col).lower()
-                if any(keyword in col_lower for keyword in ['study', 'title', 'paper', 'reference', 'citation']):
-                    study_column = col
-                    break
+            study_column = detect_study_column(sheet.columns)
             
             if study_column is None:
-                study_column = df.columns[0]
+                study_column = sheet.columns[0]
                 st.warning(f"⚠️ No obvious study title column found. Using first column: '{study_column}'")
             else:
                 st.success(f"✅ Automatically detected study column: '{study_column}'")
@@ -550,27 +469,33 @@ def import_location_climate_data_unique():
             with col2:
                 if st.button("🔍 FIND AND MATCH STUDIES", type="primary", use_container_width=True, key="start_matching_button"):
                     
-                    with st.spinner("Matching studies against database..."):
-                        if "current_import_session" in st.session_state:
-                            old_session = st.session_state.current_import_session
-                            keys_to_delete = [k for k in st.session_state.keys() if old_session in k]
-                            for key in keys_to_delete:
-                                del st.session_state[key]
-                        
-                        session_id = f"import_{int(time.time())}"
-                        st.session_state.current_import_session = session_id
-                        st.session_state[f"excel_df_{session_id}"] = df
-                        st.session_state[f"study_column_{session_id}"] = study_column
-                        
-                        matched_records, unmatched_studies = perform_study_matching(df, study_column)
-                        
-                        st.session_state[f"matched_records_{session_id}"] = matched_records
-                        st.session_state[f"unmatched_studies_{session_id}"] = unmatched_studies
-                        
-                        st.success(f"✅ Found {len(matched_records)} matches and {len(unmatched_studies)} unmatched studies")
-                        st.rerun()
+                    if "current_import_session" in st.session_state:
+                        old_session = st.session_state.current_import_session
+                        discard_match_job(old_session)
+                        keys_to_delete = [k for k in st.session_state.keys() if old_session in k]
+                        for key in keys_to_delete:
+                            del st.session_state[key]
+                    
+                    session_id = new_import_session_id()
+                    st.session_state.current_import_session = session_id
+                    df, study_names = read_import_rows(sheet, study_column)
+                    st.session_state[f"excel_df_{session_id}"] = df
+                    st.session_state[f"study_column_{session_id}"] = study_column
+                    
+                    start_study_matching(
+                        study_names, session_id,
+                        'No exact or fuzzy match found in paragraph field'
+                    )
+                    st.rerun()
             
             current_session = st.session_state.get("current_import_session")
+            if current_session and get_match_job(current_session) is not None:
+                # Reattach to the running job; its results land in session state when it ends
+                if follow_match_job(current_session):
+                    matched_records = st.session_state[f"matched_records_{current_session}"]
+                    unmatched_studies = st.session_state[f"unmatched_studies_{current_session}"]
+                    st.success(f"✅ Found {len(matched_records)} matches and {len(unmatched_studies)} unmatched studies")
+            
             if current_session:
                 matched_records = st.session_state.get(f"matched_records_{current_session}")
                 unmatched_studies = st.session_state.get(f"unmatched_studies_{current_session}")
@@ -584,66 +509,77 @@ def import_location_climate_data_unique():
             import traceback
             st.error(f"Detailed error: {traceback.format_exc()}")
 
-def perform_study_matching(df, study_column):
-    """Perform the actual matching and return results - EXACT MATCHES ONLY"""
-    study_names = df[study_column].dropna().unique()
-    
-    matched_records = []
-    unmatched_studies = []
+def read_import_rows(sheet, study_column):
+    """
+    Stream the import sheet in batches, keeping only the study and metadata columns.
+    Returns (projected DataFrame, distinct study names in sheet order).
+    """
+    batches = []
+    study_names = {}
+    for batch in sheet.iter_batches(import_columns(sheet.columns, study_column)):
+        batches.append(batch)
+        study_names.update(dict.fromkeys(batch[study_column].dropna()))
+    df = pd.concat(batches, ignore_index=True) if batches else sheet.preview.iloc[0:0]
+    return df, list(study_names)
+
+# Seconds between reruns while a matching job is running
+MATCH_POLL_INTERVAL = 1.0
+
+def start_study_matching(study_names, session_id, unmatched_reason='No match found in paragraph field'):
+    """
+    Start matching study titles against every non-rejected paragraph in a background process pool.
+    Each worker gets the paragraphs once; the Aho-Corasick exact pass splits the paragraphs among
+    the workers (every title in one pass), then the MinHash/LSH fuzzy tiers run over chunks of the
+    titles left without an exact match. follow_match_job shows progress and collects the results.
+    """
+    studies = [
+        (study_name, preprocess_study_name(study_name))
+        for study_name in study_names
+        if not pd.isna(study_name) and study_name
+    ]
+    db = st.session_state.db
+    return start_match_job(
+        session_id,
+        studies,
+        lambda: db.iter_energy_data(columns=MATCH_COLUMNS, exclude_rejected=True, prefetch=True),
+        unmatched_reason
+    )
+
+def follow_match_job(session_id):
+    """
+    Show the import session's matching progress with a cancel button, rerunning until the job ends.
+    Stores the results under the session's matched_records/unmatched_studies keys and returns
+    True once they are there.
+    """
+    job = get_match_job(session_id)
+    if job is None:
+        return False
     
-    for study_name in study_names:
-        if pd.isna(study_name) or not study_name:
-            continue
-            
-        clean_study = preprocess_study_name(study_name)
-        
-        # Search in database
-        search_results = st.session_state.db.search_energy_data(clean_study, limit=100)
-        
-        matches = []
-        for record in search_results:
-            if clean_study.lower() in record.get('paragraph', '').lower():
-                matches.append({
-                    'record_id': record['id'],
-                    'paragraph': record['paragraph'],
-                    'criteria': record['criteria'],
-                    'energy_method': record['energy_method'],
-                    'direction': record['direction'],
-                    'scale': record.get('scale'),
-                    'climate': record.get('climate'),
-                    'location': record.get('location'),
-                    'confidence': 'exact_match',
-                    'match_position': record['paragraph'].lower().find(clean_study.lower()),
-                    'match_percentage': 100,
-                    'matching_text': clean_study
-                })
-        
-        if matches:
-            for match_data in matches:
-                matched_records.append({
-                    'excel_study': study_name,
-                    'excel_study_normalized': clean_study,
-                    'db_record_id': match_data['record_id'],
-                    'matching_paragraph': match_data['paragraph'],
-                    'criteria': match_data['criteria'],
-                    'energy_method': match_data['energy_method'],
-                    'direction': match_data['direction'],
-                    'scale': match_data['scale'],
-                    'climate': match_data['climate'],
-                    'location': match_data['location'],
-                    'confidence': match_data['confidence'],
-                    'match_position': match_data['match_position'],
-                    'match_percentage': 100,
-                    'matching_text': match_data['matching_text']
-                })
-        else:
-            unmatched_studies.append({
-                'study_name': study_name,
-                'normalized_name': clean_study,
-                'reason': 'No exact match found in paragraph field'
-            })
+    if job.status == 'done':
+        st.session_state[f"matched_records_{session_id}"] = job.matched_records
+        st.session_state[f"unmatched_studies_{session_id}"] = job.unmatched_studies
+        discard_match_job(session_id)
+        return True
+    if job.status == 'cancelled':
+        discard_match_job(session_id)
+        st.session_state[f"matching_cancelled_{session_id}"] = True
+        st.warning("⏹️ Matching cancelled.")
+        return False
+    if job.status == 'failed':
+        discard_match_job(session_id)
+        st.error(f"❌ Matching failed: {job.error}")
+        return False
     
-    return matched_records, unmatched_studies
+    done, total, found = job.progress()
+    total_studies = len(job.studies)
+    if job.status == 'loading':
+        st.progress(0.0, text="Loading paragraphs...")
+    else:
+        st.progress(done / total if total else 1.0, text=f"Matching {total_studies} studies ({found} matches so far)")
+    if st.button("⏹️ Cancel matching", key=f"cancel_matching_{session_id}"):
+        job.cancel()
+    time.sleep(MATCH_POLL_INTERVAL)
+    st.rerun()
 
 def display_admin_matching_review_fixed(matched_records, unmatched_studies, excel_df, session_id):
     """Display the matching review interface"""
@@ -673,17 +609,26 @@ def display_admin_matching_review_fixed(matched_records, unmatched_studies, exce
     
     st.markdown("---")
     
-    # FILTER TO EXACT MATCHES ONLY
-    exact_matches = [m for m in matched_records if m['confidence'] == 'exact_match']
-    other_matches = [m for m in matched_records if m['confidence'] != 'exact_match']
+    # FILTER BY MATCH QUALITY (fuzzy tiers start unselected for import)
+    tiers_found = sorted({m['confidence'] for m in matched_records}, key=lambda tier: CONFIDENCE_ORDER.get(tier, 999))
+    quality_filter = st.multiselect(
+        "Match quality to review",
+        tiers_found,
+        default=[tier for tier in tiers_found if tier in st.session_state.selected_quality_filter],
+        key=f"quality_filter_{session_id}"
+    )
+    review_matches = [m for m in matched_records if m['confidence'] in quality_filter]
+    hidden_matches = len(matched_records) - len(review_matches)
     
     st.write("**Match Results:**")
-    st.write(f"🟢 Exact Matches: {len(exact_matches)}")
-    if other_matches:
-        st.warning(f"⚠️ {len(other_matches)} non-exact matches (strong/good) are not shown - only exact matches can be imported")
-    
-    if not exact_matches:
-        st.error("❌ No exact matches found. Please check your study titles and try again.")
+    for tier in tiers_found:
+        tier_count = sum(1 for m in matched_records if m['confidence'] == tier)
+        st.write(f"{'🟢' if tier == 'exact_match' else '🟡'} {tier.replace('_', ' ').title()}: {tier_count}")
+    if hidden_matches:
+        st.warning(f"⚠️ {hidden_matches} matches outside the selected quality tiers are not shown")
+    
+    if not review_matches:
+        st.error("❌ No matches found. Please check your study titles and try again.")
         if unmatched_studies:
             with st.expander("📋 View Unmatched Studies", expanded=False):
                 for i, unmatched in enumerate(unmatched_studies[:20]):
@@ -691,7 +636,7 @@ def display_admin_matching_review_fixed(matched_records, unmatched_studies, exce
         return
     
     select_all = st.checkbox(
-        f"Select All {len(exact_matches)} Exact Matches", 
+        f"Select All {len(review_matches)} Matches", 
         key=f"select_all_{session_id}",
         value=st.session_state[select_all_key]
     )
@@ -699,7 +644,7 @@ def display_admin_matching_review_fixed(matched_records, unmatched_studies, exce
     if select_all != st.session_state[select_all_key]:
         st.session_state[select_all_key] = select_all
         confirmations = st.session_state[confirmations_key]
-        for match in exact_matches:
+        for match in review_matches:
             match_id = f"match_{match['db_record_id']}_{session_id}"
             confirmations[match_id] = select_all
         st.session_state[confirmations_key] = confirmations
@@ -708,18 +653,18 @@ def display_admin_matching_review_fixed(matched_records, unmatched_studies, exce
     st.markdown("---")
     col1, col2 = st.columns([3, 1])
     with col1:
-        if st.button("IMPORT SELECTED EXACT MATCHES", type="primary", use_container_width=True, key=f"import_main_{session_id}"):
+        if st.button("IMPORT SELECTED MATCHES", type="primary", use_container_width=True, key=f"import_main_{session_id}"):
             confirmed_matches = []
             confirmations = st.session_state[confirmations_key]
             
-            for match in exact_matches:
+            for match in review_matches:
                 match_id = f"match_{match['db_record_id']}_{session_id}"
                 if confirmations.get(match_id, False):
                     confirmed_matches.append(match)
             
             if confirmed_matches:
                 if excel_df is not None:
-                    with st.spinner(f"Importing {len(confirmed_matches)} exact matches..."):
+                    with st.spinner(f"Importing {len(confirmed_matches)} matches..."):
                         updated_count = process_confirmed_matches(confirmed_matches, excel_df)
                         if updated_count > 0:
                             st.success(f"✅ Successfully updated {updated_count} records!")
@@ -729,15 +674,15 @@ def display_admin_matching_review_fixed(matched_records, unmatched_studies, exce
                 else:
                     st.error("❌ Excel data not available.")
             else:
-                st.warning("⚠️ No exact matches selected.")
+                st.warning("⚠️ No matches selected.")
     with col2:
-        st.info(f"📊 {len(exact_matches)} exact matches available")
+        st.info(f"📊 {len(review_matches)} matches available")
     
     st.markdown("---")
     
-    # Pagination for exact matches
+    # Pagination for reviewed matches
     MATCHES_PER_PAGE = 10
-    total_pages = (len(exact_matches) + MATCHES_PER_PAGE - 1) // MATCHES_PER_PAGE
+    total_pages = (len(review_matches) + MATCHES_PER_PAGE - 1) // MATCHES_PER_PAGE
     
     if total_pages > 1:
         col_prev, col_page, col_next = st.columns([1, 2, 1])
@@ -753,22 +698,23 @@ def display_admin_matching_review_fixed(matched_records, unmatched_studies, exce
                 st.rerun()
     
     start_idx = st.session_state[page_key] * MATCHES_PER_PAGE
-    end_idx = min(start_idx + MATCHES_PER_PAGE, len(exact_matches))
-    current_page_matches = exact_matches[start_idx:end_idx]
+    end_idx = min(start_idx + MATCHES_PER_PAGE, len(review_matches))
+    current_page_matches = review_matches[start_idx:end_idx]
     
     confirmations = st.session_state[confirmations_key]
     
     for i, match in enumerate(current_page_matches):
         match_id = f"match_{match['db_record_id']}_{session_id}"
         
+        is_exact = match['confidence'] == 'exact_match'
         if match_id not in confirmations:
-            confirmations[match_id] = True
+            confirmations[match_id] = is_exact
             st.session_state[confirmations_key] = confirmations
         
         paragraph_preview = match['matching_paragraph'][:80] + "..." if len(match['matching_paragraph']) > 80 else match['matching_paragraph']
         
         with st.expander(
-            f"🟢 ID: {match['db_record_id']} | {match['excel_study'][:60]}... | 📄 {paragraph_preview}", 
+            f"{'🟢' if is_exact else '🟡'} ID: {match['db_record_id']} | {match['excel_study'][:60]}... | 📄 {paragraph_preview}", 
             expanded=False
         ):
             col_check, col_study, col_para = st.columns([1, 2, 2])
@@ -776,7 +722,7 @@ def display_admin_matching_review_fixed(matched_records, unmatched_studies, exce
             with col_check:
                 confirmed = st.checkbox(
                     "✅ Import",
-                    value=confirmations.get(match_id, True),
+                    value=confirmations.get(match_id, is_exact),
                     key=f"chk_{match_id}"
                 )
                 if confirmed != confirmations.get(match_id, False):
@@ -784,7 +730,10 @@ def display_admin_matching_review_fixed(matched_records, unmatched_studies, exce
                     st.session_state[confirmations_key] = confirmations
                 
                 st.markdown(f"**Record:** `{match['db_record_id']}`")
-                st.markdown(f"**Confidence:** Exact")
+                if is_exact:
+                    st.markdown("**Confidence:** Exact")
+                else:
+                    st.markdown(f"**Confidence:** {match['confidence'].replace('_', ' ').title()} ({match['match_percentage']}%)")
             
             with col_study:
                 st.markdown("**📥 Imported Study:**")
@@ -817,19 +766,19 @@ def display_admin_matching_review_fixed(matched_records, unmatched_studies, exce
         
         st.markdown("---")
     
-    if len(exact_matches) > MATCHES_PER_PAGE:
+    if len(review_matches) > MATCHES_PER_PAGE:
         st.markdown("---")
-        if st.button("🚀 IMPORT SELECTED EXACT MATCHES", type="primary", use_container_width=True, key=f"import_bottom_{session_id}"):
+        if st.button("🚀 IMPORT SELECTED MATCHES", type="primary", use_container_width=True, key=f"import_bottom_{session_id}"):
             confirmed_matches = []
             confirmations = st.session_state[confirmations_key]
             
-            for match in exact_matches:
+            for match in review_matches:
                 match_id = f"match_{match['db_record_id']}_{session_id}"
                 if confirmations.get(match_id, False):
                     confirmed_matches.append(match)
             
-            if confirmed_matches and excel_df:
-                with st.spinner(f"Importing {len(confirmed_matches)} exact matches..."):
+            if confirmed_matches and excel_df is not None:
+                with st.spinner(f"Importing {len(confirmed_matches)} matches..."):
                     updated_count = process_confirmed_matches(confirmed_matches, excel_df)
                     if updated_count > 0:
                         st.success(f"✅ Successfully updated {updated_count} records!")
@@ -837,7 +786,7 @@ def display_admin_matching_review_fixed(matched_records, unmatched_studies, exce
                         time.sleep(2)
                         st.rerun()
             else:
-                st.warning("⚠️ No exact matches selected.")
+                st.warning("⚠️ No matches selected.")
     
     if unmatched_studies:
         st.markdown("---")
@@ -871,7 +820,7 @@ def reset_location_climate_scale_data():
     """Clear all imported data and reset to defaults"""
     try:
         # Get all records
-        records = st.session_state.db.get_energy_data()
+        records = list(st.session_state.db.iter_energy_data(columns=['id']))
         
         updated_count = 0
         for record in records:
@@ -886,6 +835,7 @@ def reset_location_climate_scale_data():
             st.session_state.db.update_record('energy_data', record['id'], update_data)
             updated_count += 1
         
+        st.session_state.db.analyze()
         st.success(f"✅ All imported data cleared and reset! {updated_count} records updated.")
         
     except Exception as e:
@@ -897,7 +847,7 @@ def reset_location_climate_scale_data():
 def query_dominant_climate_options():
     """Get ONLY valid Köppen climate classifications with descriptions and color glyphs"""
     # Get all non-rejected records
-    all_records = st.session_state.db.get_energy_data(limit=5000)
+    all_records = get_energy_snapshot(st.session_state.db).records
     valid_records = [r for r in all_records if r.get('status') != 'rejected']
     
     # Get distinct climate values from valid records
@@ -1069,10 +1019,16 @@ def review_missing_data():
     
     if st.session_state.get("missing_data_search", False):
         with st.spinner("Analyzing database..."):
-            # Get all non rejected records
-            all_records = st.session_state.db.get_non_rejected_records(limit=5000)
+            # Only non-rejected records missing scale, climate or location come back;
+            # the loop below just labels which fields are missing
+            placeholders = ('Awaiting data', 'Not Specified')
+            missing_spec = FilterSpec().any_of(
+                FilterSpec().missing('scale', placeholders),
+                FilterSpec().missing('climate', placeholders),
+                FilterSpec().missing('location'),
+            )
+            all_records = st.session_state.db.iter_energy_data(filters=missing_spec, exclude_rejected=True)
             
-            # Filter records with missing data
             records_with_missing = []
             for record in all_records:
                 missing = []
@@ -1258,80 +1214,72 @@ def convert_urls_to_links(text):
     
     return text
 
+def prepare_import_rows(excel_df):
+    """
+    Resolve the sheet's column roles once and extract every field column-wise.
+    Returns {normalized study title: update dict} from the first row of each title,
+    or None if the sheet has no study/title column.
+    """
+    study_column = next(
+        (col for col in excel_df.columns if 'study' in str(col).lower() or 'title' in str(col).lower()), None
+    )
+    if study_column is None:
+        return None
+    
+    # The last column of a role wins, as when rows were scanned column by column
+    role_columns = {}
+    for col in excel_df.columns:
+        role = import_column_role(col)
+        if role:
+            role_columns[role] = col
+    
+    fields = {}
+    for field in IMPORT_FIELDS:
+        col = role_columns.get(field)
+        if col is None:
+            fields[field] = pd.Series('', index=excel_df.index)
+        else:
+            values = excel_df[col]
+            fields[field] = values.map(str).where(values.notna(), '')
+    fields['climate'] = extract_climate_codes(fields['climate'])
+    
+    titles = excel_df[study_column]
+    table = pd.DataFrame(fields)[titles.notna()]
+    table.index = titles[titles.notna()].map(preprocess_study_name)
+    table = table[~table.index.duplicated(keep='first')]
+    return table.to_dict('index')
+
 def process_confirmed_matches(confirmed_matches, excel_df):
     """Process the user-confirmed matches with all data fields"""
     if excel_df is None:
         st.error("❌ No Excel data available for import.")
         return 0
     
-    updated_count = 0
+    import_rows = prepare_import_rows(excel_df)
+    if import_rows is None:
+        st.error("❌ No study column found in Excel file.")
+        return 0
+    
+    pending_updates = []
     not_found_in_excel = []
     
     for match in confirmed_matches:
-        record_id = match['db_record_id']
-        excel_study = match['excel_study']
-        
-        study_column = None
-        for col in excel_df.columns:
-            if 'study' in col.lower() or 'title' in col.lower():
-                study_column = col
-                break
-        
-        if study_column is None:
-            st.error("❌ No study column found in Excel file.")
-            return 0
-        
-        excel_match = None
-        for idx, row in excel_df.iterrows():
-            excel_study_name = str(row[study_column]).strip()
-            if excel_study_name == excel_study:
-                excel_match = row
-                break
-        
-        if excel_match is not None:
-            location = ''
-            climate_text = ''
-            scale = ''
-            building_use = ''
-            approach = ''
-            sample_size = ''
-            
-            for col in excel_match.index:
-                col_lower = str(col).lower()
-                if 'location' in col_lower or 'site' in col_lower or 'region' in col_lower:
-                    location = str(excel_match[col]) if pd.notna(excel_match[col]) else ''
-                elif 'climate' in col_lower:
-                    climate_text = str(excel_match[col]) if pd.notna(excel_match[col]) else ''
-                elif 'scale' in col_lower:
-                    scale = str(excel_match[col]) if pd.notna(excel_match[col]) else ''
-                elif 'building' in col_lower and ('use' in col_lower or 'type' in col_lower):
-                    building_use = str(excel_match[col]) if pd.notna(excel_match[col]) else ''
-                elif 'approach' in col_lower or 'method' in col_lower:
-                    approach = str(excel_match[col]) if pd.notna(excel_match[col]) else ''
-                elif 'sample' in col_lower or 'n' == col_lower:
-                    sample_size = str(excel_match[col]) if pd.notna(excel_match[col]) else ''
-            
-            climate_code = extract_just_climate_code(climate_text)
-            
-            update_data = {
-                'location': location,
-                'climate': climate_code if climate_code else '',
-                'scale': scale,
-                'building_use': building_use,
-                'approach': approach,
-                'sample_size': sample_size
-            }
-            
-            st.session_state.db.update_record('energy_data', record_id, update_data)
-            updated_count += 1
-            
+        update_data = import_rows.get(preprocess_study_name(match['excel_study']))
+        if update_data is not None:
+            pending_updates.append((match['db_record_id'], dict(update_data)))
         else:
-            not_found_in_excel.append(excel_study)
+            not_found_in_excel.append(match['excel_study'])
     
     if not_found_in_excel:
         st.warning(f"⚠️ {len(not_found_in_excel)} studies not found in Excel file")
     
-    return updated_count
+    result = st.session_state.db.update_records_bulk('energy_data', pending_updates)
+    if result['failed']:
+        st.error(f"❌ {len(result['failed'])} records could not be updated")
+        for record_id, error in result['failed'][:10]:
+            st.write(f"- Record {record_id}: {error}")
+    
+    return len(result['updated'])
 
 def extract_just_climate_code(climate_text):
     """Extract ONLY the climate code from climate text"""
@@ -1353,6 +1301,13 @@ def extract_just_climate_code(climate_text):
     
     return None
 
+def extract_climate_codes(climate_texts):
+    """extract_just_climate_code over a whole Series of text, with '' where there is no code"""
+    texts = climate_texts.fillna('').astype(str).str.strip()
+    piped = texts.str.contains('|', regex=False)
+    texts = texts.where(~piped, texts.str.split('|').str[1].str.strip())
+    return texts.str.extract(r'([A-Z][A-Za-z]{1,2})', expand=False).fillna('')
+
 def display_unified_edit_form(record_id, record_data=None, is_pending=False, clear_edit_callback=None, from_missing_data=False):
     """Unified edit form for all admin editing interfaces"""
     
@@ -1642,7 +1597,10 @@ def manage_scale_climate_data():
         
         with st.spinner("Searching records..."):
             # Use the wrapper's search method
-            results = st.session_state.db.search_energy_data(search_query, limit=200)
+            results = st.session_state.db.search_energy_data(
+                search_query, limit=200,
+                columns=['id', 'criteria', 'energy_method', 'direction', 'location', 'climate']
+            )
             st.session_state.admin_edit_search_results = results
     
     # Clear search button
@@ -1893,7 +1851,7 @@ def review_pending_data():
     st.markdown("---")
     
     # Show statistics
-    all_records = st.session_state.db.get_energy_data(limit=5000)
+    all_records = get_energy_snapshot(st.session_state.db).records
     pending_count = len([r for r in all_records if r.get('status') == 'pending'])
     approved_count = len([r for r in all_records if r.get('status') == 'approved'])
     rejected_count = len([r for r in all_records if r.get('status') == 'rejected'])
@@ -1908,8 +1866,7 @@ def user_dashboard():
     st.subheader("Review Your Submissions")
 
     # Fetch all records created by the current user
-    all_records = st.session_state.db.get_energy_data(limit=1000)
-    records = [r for r in all_records if r.get('user') == st.session_state.current_user]
+    records = list(st.session_state.db.iter_energy_data(filters={'user': st.session_state.current_user}))
 
     if not records:
         st.write("No records found.")
@@ -2151,6 +2108,29 @@ def render_enhanced_papers_tab():
         with view_tab4:
             render_frequency_analysis(st.session_state.db)
 
+def get_result_paragraphs(records):
+    """
+    Get paragraph text for displayed result cards, cached for the session by study:
+    records sharing a study_key share their text, so it is fetched once per study
+    """
+    if 'result_paragraphs' not in st.session_state:
+        st.session_state.result_paragraphs = {}
+    cache = st.session_state.result_paragraphs
+    
+    def cache_key(record):
+        return record.get('study_key') or record['id']
+    
+    missing = {}  # cache key -> id of one record to fetch it through
+    for record in records:
+        key = cache_key(record)
+        if key not in cache:
+            missing.setdefault(key, record['id'])
+    if missing:
+        paragraphs = st.session_state.db.get_paragraphs(list(missing.values()))
+        cache.update((key, paragraphs.get(record_id)) for key, record_id in missing.items())
+    
+    return {record['id']: cache.get(cache_key(record)) for record in records}
+
 def render_papers_tab():
     """Render the Studies tab with search functionality"""
     st.title("Research Studies Database")
@@ -2231,8 +2211,10 @@ def render_papers_tab():
         
         with st.spinner(f"Searching for '{search_query}'..."):
             # Use the wrapper's search method which handles ID search correctly
-            results = st.session_state.db.search_energy_data(search_query, limit=500)
+            # Paragraph text is loaded per page, see get_result_paragraphs
+            results = st.session_state.db.search_energy_data(search_query, limit=500, columns=SUMMARY_COLUMNS)
             st.session_state.papers_current_results = results
+            st.session_state.result_paragraphs = {}
             st.session_state.papers_current_page = 0
             st.rerun()
     
@@ -2269,10 +2251,11 @@ def render_papers_tab():
         col_header, col_clear = st.columns([4, 1])
         
         with col_header:
+            study_count = len({record.get('study_key') or record['id'] for record in results})
             if len(results) == 1:
                 st.success(f"Found {len(results)} study matching '{search_query}'")
             elif len(results) > 1:
-                st.success(f"Found {len(results)} studies matching '{search_query}'")
+                st.success(f"Found {len(results)} records from {study_count} studies matching '{search_query}'")
             else:
                 st.warning(f"No results found for '{search_query}'")
         
@@ -2318,9 +2301,11 @@ def render_papers_tab():
             st.markdown(f"<div style='text-align: right; color: #666; font-size: 0.9em;'>Showing {start_idx + 1}-{end_idx} of {len(results)} records • Sorted by {sort_order} {direction_indicator}</div>", 
                       unsafe_allow_html=True)
             
+            page_paragraphs = get_result_paragraphs(page_results)
+            
             for record in page_results:
                 record_id = record['id']
-                paragraph = record.get('paragraph', '')
+                paragraph = page_paragraphs.get(record_id) or ''
                 criteria = record.get('criteria', '')
                 energy_method = record.get('energy_method', '')
                 direction = record.get('direction', '')
@@ -2452,7 +2437,7 @@ def render_papers_tab():
 
 def query_dynamic_scale_options():
     """Get unique scale values from non-rejected records"""
-    all_records = st.session_state.db.get_energy_data(limit=5000)
+    all_records = get_energy_snapshot(st.session_state.db).records
     
     # Filter out rejected records
     valid_records = [r for r in all_records if r.get('status') != 'rejected']
@@ -2594,6 +2579,17 @@ def render_login_signup_forms():
                     
                     else:
                         st.error(f"❌ **Sign up failed.**\n\n{result['error']}")
+def render_db_call_summary():
+    """Database calls of the previous rerun and of this server process, slowest first"""
+    last_rerun = st.session_state.get('db_last_rerun_calls')
+    process = process_stats()
+    with st.sidebar.expander("Database calls"):
+        if last_rerun is not None:
+            st.caption(f"Last rerun: {last_rerun.total_calls()} calls, {last_rerun.total_wall_ms():.0f} ms")
+            st.dataframe(pd.DataFrame(last_rerun.summary(top=10)), hide_index=True)
+        st.caption(f"Since server start: {process.total_calls()} calls, {process.total_wall_ms() / 1000:.1f} s")
+        st.dataframe(pd.DataFrame(process.summary(top=10)), hide_index=True)
+
 def render_admin_sidebar():
     """Render admin-specific sidebar"""
     st.sidebar.header("Admin Dashboard")
@@ -2608,6 +2604,23 @@ def render_admin_sidebar():
     # Add persistent user info
     st.sidebar.divider()
     st.sidebar.info(f" **Logged in as:** {st.session_state.current_user} (Admin)")
+    
+    render_db_call_summary()
+    
+    cache = st.session_state.db.cache_stats()
+    st.sidebar.caption(
+        f"Query cache: {cache['hit_rate']:.0%} hit rate "
+        f"({cache['hits']} hits, {cache['misses']} misses, {cache['entries']} entries)"
+    )
+    
+    mirror = st.session_state.db.mirror_status()
+    if mirror is not None:
+        age = "never synced" if mirror['age'] is None else f"synced {mirror['age']:.0f}s ago"
+        st.sidebar.caption(f"Local read mirror: {age}")
+        if st.sidebar.button("🔄 Resync mirror", key="admin_resync_mirror_btn"):
+            with st.spinner("Reloading energy data from Supabase..."):
+                st.session_state.db.resync_mirror()
+            st.rerun()
 
     # ✅ Add unique key
     if st.sidebar.button("logout", key="admin_logout_btn"):
@@ -2659,160 +2672,65 @@ def render_spatialbuild_tab(enable_editing=False):
     
     render_unified_search_interface(enable_editing=enable_editing)
 
-def query_energy_method_counts(selected_criteria):
+def query_energy_method_counts(selected_criteria, cube=None):
     """Get energy methods with counts for specific criteria (including NULL status)"""
-    all_records = st.session_state.db.get_energy_data(limit=5000)
-    
-    # Filter for this criteria and exclude rejected
-    records = []
-    for record in all_records:
-        if record.get('criteria') == selected_criteria and record.get('status') != 'rejected':
-            records.append(record)
-    
-    counts = {}
-    for record in records:
-        method = record.get('energy_method')
-        if method:
-            counts[method] = counts.get(method, 0) + 1
+    if cube is None:
+        cube = get_count_cube(st.session_state.db)
+    counts = cube.counts_by('energy_method', criteria=selected_criteria)
     
     return [(method, count) for method, count in sorted(counts.items())]
 
-def query_direction_counts(selected_criteria, selected_method):
+def query_direction_counts(selected_criteria, selected_method, cube=None):
     """Get direction counts for specific criteria and method (including NULL status)"""
-    all_records = st.session_state.db.get_energy_data(limit=5000)
-    
-    # Filter for criteria and method, exclude rejected
-    records = []
-    for record in all_records:
-        if (record.get('criteria') == selected_criteria and 
-            record.get('energy_method') == selected_method and
-            record.get('status') != 'rejected'):
-            records.append(record)
+    if cube is None:
+        cube = get_count_cube(st.session_state.db)
+    direction_counts = cube.counts_by(
+        'direction', criteria=selected_criteria, energy_method=selected_method
+    )
     
     # Initialize counts with zeros
     counts = {'Increase': 0, 'Decrease': 0}
-    
-    # Count directions
-    for record in records:
-        direction = record.get('direction')
-        if direction in counts:
-            counts[direction] += 1
+    for direction in counts:
+        counts[direction] = direction_counts.get(direction, 0)
     
     return counts
 
-def query_paragraphs(selected_criteria, selected_method, selected_direction, selected_scales=None, selected_climates=None):
+def query_paragraphs(selected_criteria, selected_method, selected_direction, selected_scales=None, selected_climates=None,
+                     engine=None):
     """Query paragraphs with filters - returns list of (id, paragraph) tuples"""
-    all_records = st.session_state.db.get_energy_data(limit=5000)
-    
-    # Start with all records
-    records = all_records
-    
-    # Apply status filter (exclude rejected)
-    records = [r for r in records if r.get('status') != 'rejected']
-    
-    # Apply criteria filter
-    if selected_criteria and selected_criteria != "Select a determinant":
-        records = [r for r in records if r.get('criteria') == selected_criteria]
-    
-    # Apply method filter
-    if selected_method and selected_method != "Select an output":
-        records = [r for r in records if r.get('energy_method') == selected_method]
-    
-    # Apply direction filter
-    if selected_direction:
-        clean_direction = selected_direction.split(" [")[0] if " [" in selected_direction else selected_direction
-        records = [r for r in records if r.get('direction') == clean_direction]
-    
-    # Apply scale filter
-    if selected_scales and selected_scales != ["All"] and selected_scales:
-        records = [r for r in records if r.get('scale') in selected_scales]
-    
-    # Apply climate filter
-    if selected_climates and selected_climates != ["All"] and selected_climates:
-        selected_upper = [c.upper() for c in selected_climates]
-        records = [r for r in records if r.get('climate') and r.get('climate').upper() in selected_upper]
+    if engine is None:
+        engine = get_facet_engine(st.session_state.db)
+    mask = engine.filtered_mask(
+        selected_criteria, selected_method, selected_direction,
+        {'scale': selected_scales, 'climate': selected_climates}
+    )
     
     # Return list of (id, paragraph) for valid paragraphs
     results = []
-    for r in records:
+    for r in engine.snapshot.rows(mask):
         paragraph = r.get('paragraph')
         if paragraph and paragraph not in ['0', '0.0', '', None]:
             results.append((r['id'], paragraph))
     
     return results
 
-def query_scale_options_with_counts(criteria=None, energy_method=None, direction=None, selected_climates=None, selected_locations=None):
-    """Get scale options with counts filtered by current search criteria"""
-    # Get all records
-    all_records = st.session_state.db.get_energy_data(limit=5000)
-    
-    # Filter out rejected records (keep NULL, approved, pending)
-    records = [r for r in all_records if r.get('status') != 'rejected']
-    
-    # Apply criteria filter
-    if criteria and criteria != "Select a determinant":
-        records = [r for r in records if r.get('criteria') == criteria]
-    
-    # Apply energy method filter
-    if energy_method and energy_method != "Select an output":
-        records = [r for r in records if r.get('energy_method') == energy_method]
-    
-    # Apply direction filter
-    if direction and direction not in ["Select a direction", None]:
-        clean_direction = direction.split(" [")[0] if " [" in direction else direction
-        records = [r for r in records if r.get('direction') == clean_direction]
-    
-    # Apply climate filter
-    if selected_climates and selected_climates != ["All"]:
-        selected_upper = [c.upper() for c in selected_climates]
-        records = [r for r in records if r.get('climate') and r.get('climate').upper() in selected_upper]
-    
-    # Apply location filter
-    if selected_locations and selected_locations != ["All"]:
-        records = [r for r in records if r.get('location') in selected_locations]
-    
-    # Count scales
-    scale_counts = {}
-    for record in records:
-        scale = record.get('scale')
-        if scale and scale not in ['Awaiting data', '']:
-            scale_counts[scale] = scale_counts.get(scale, 0) + 1
-    
-    return [(scale, count) for scale, count in sorted(scale_counts.items())]
+def query_facet_options_with_counts(criteria=None, energy_method=None, direction=None, selections=None, engine=None):
+    """
+    Get (value, count) options for every facet filtered by current search criteria.
+    selections maps facet name (scale, climate, location, building_use, approach)
+    to the selected values; each facet is counted under the other selections only.
+    Pass the render's engine so the options and the results come from one snapshot.
+    """
+    if engine is None:
+        engine = get_facet_engine(st.session_state.db)
+    facet_counts = engine.facet_counts(
+        criteria, energy_method, direction, selections
+    )
+    return {facet: sorted(counts.items()) for facet, counts in facet_counts.items()}
 
 
-def query_climate_options_with_counts(criteria=None, energy_method=None, direction=None, selected_scales=None):
-    """Get climate options with counts filtered by current search criteria"""
-    # Get all records
-    all_records = st.session_state.db.get_energy_data(limit=5000)
-    
-    # Filter out rejected records (keep NULL, approved, pending)
-    records = [r for r in all_records if r.get('status') != 'rejected']
-    
-    # Apply criteria filter
-    if criteria and criteria != "Select a determinant":
-        records = [r for r in records if r.get('criteria') == criteria]
-    
-    # Apply energy method filter
-    if energy_method and energy_method != "Select an output":
-        records = [r for r in records if r.get('energy_method') == energy_method]
-    
-    # Apply direction filter
-    if direction and direction not in ["Select a direction", None]:
-        clean_direction = direction.split(" [")[0] if " [" in direction else direction
-        records = [r for r in records if r.get('direction') == clean_direction]
-    
-    # Apply scale filter
-    if selected_scales and selected_scales != ["All"]:
-        records = [r for r in records if r.get('scale') in selected_scales]
-    
-    # Count climates
-    climate_counts = {}
-    for record in records:
-        climate = record.get('climate')
-        if climate and climate not in ['Awaiting data', '']:
-            climate_counts[climate] = climate_counts.get(climate, 0) + 1
-    
+def format_climate_options_with_counts(climate_options_with_counts):
+    """Format (climate, count) pairs as (label, color, count) using the Köppen descriptions"""
     # Get formatted climate options
     climate_options_raw = query_dominant_climate_options()
     
@@ -2826,7 +2744,6 @@ def query_climate_options_with_counts(criteria=None, energy_method=None, directi
             formatted, color = item
             # Try to extract code from formatted string
             # Format is typically "🟦 Csa - Description" or "Csa - Description"
-            import re
             code_match = re.search(r'([A-Z][A-Za-z]{1,2})', formatted)
             if code_match:
                 code = code_match.group(1)
@@ -2836,7 +2753,7 @@ def query_climate_options_with_counts(criteria=None, energy_method=None, directi
                 climate_format_lookup[formatted] = (formatted, color)
     
     result = []
-    for climate, count in climate_counts.items():
+    for climate, count in climate_options_with_counts:
         # Try to find matching format
         found = False
         for code, (formatted, color) in climate_format_lookup.items():
@@ -2851,160 +2768,19 @@ def query_climate_options_with_counts(criteria=None, energy_method=None, directi
     
     return sorted(result, key=lambda x: x[0])
 
-
-def query_location_options_with_counts(criteria=None, energy_method=None, direction=None, selected_scales=None, selected_climates=None):
-    """Get location options with counts filtered by current search criteria"""
-    # Get all records
-    all_records = st.session_state.db.get_energy_data(limit=5000)
-    
-    # Filter out rejected records (keep NULL, approved, pending)
-    records = [r for r in all_records if r.get('status') != 'rejected']
-    
-    # Apply criteria filter
-    if criteria and criteria != "Select a determinant":
-        records = [r for r in records if r.get('criteria') == criteria]
-    
-    # Apply energy method filter
-    if energy_method and energy_method != "Select an output":
-        records = [r for r in records if r.get('energy_method') == energy_method]
-    
-    # Apply direction filter
-    if direction and direction not in ["Select a direction", None]:
-        clean_direction = direction.split(" [")[0] if " [" in direction else direction
-        records = [r for r in records if r.get('direction') == clean_direction]
-    
-    # Apply scale filter
-    if selected_scales and selected_scales != ["All"]:
-        records = [r for r in records if r.get('scale') in selected_scales]
-    
-    # Apply climate filter
-    if selected_climates and selected_climates != ["All"]:
-        selected_upper = [c.upper() for c in selected_climates]
-        records = [r for r in records if r.get('climate') and r.get('climate').upper() in selected_upper]
-    
-    # Count locations
-    location_counts = {}
-    for record in records:
-        location = record.get('location')
-        if location:
-            location_counts[location] = location_counts.get(location, 0) + 1
-    
-    return [(location, count) for location, count in sorted(location_counts.items())]
-
-
-def query_building_use_options_with_counts(criteria=None, energy_method=None, direction=None, selected_scales=None, selected_climates=None, selected_locations=None):
-    """Get building use options with counts filtered by current search criteria"""
-    # Get all records
-    all_records = st.session_state.db.get_energy_data(limit=5000)
-    
-    # Filter out rejected records (keep NULL, approved, pending)
-    records = [r for r in all_records if r.get('status') != 'rejected']
-    
-    # Apply criteria filter
-    if criteria and criteria != "Select a determinant":
-        records = [r for r in records if r.get('criteria') == criteria]
-    
-    # Apply energy method filter
-    if energy_method and energy_method != "Select an output":
-        records = [r for r in records if r.get('energy_method') == energy_method]
-    
-    # Apply direction filter
-    if direction and direction not in ["Select a direction", None]:
-        clean_direction = direction.split(" [")[0] if " [" in direction else direction
-        records = [r for r in records if r.get('direction') == clean_direction]
-    
-    # Apply scale filter
-    if selected_scales and selected_scales != ["All"]:
-        records = [r for r in records if r.get('scale') in selected_scales]
-    
-    # Apply climate filter
-    if selected_climates and selected_climates != ["All"]:
-        selected_upper = [c.upper() for c in selected_climates]
-        records = [r for r in records if r.get('climate') and r.get('climate').upper() in selected_upper]
-    
-    # Apply location filter
-    if selected_locations and selected_locations != ["All"]:
-        records = [r for r in records if r.get('location') in selected_locations]
-    
-    # Count building uses
-    building_use_counts = {}
-    for record in records:
-        building_use = record.get('building_use')
-        if building_use:
-            building_use_counts[building_use] = building_use_counts.get(building_use, 0) + 1
-    
-    return [(use, count) for use, count in sorted(building_use_counts.items())]
-
-
-def query_approach_options_with_counts(criteria=None, energy_method=None, direction=None, selected_scales=None, selected_climates=None, selected_locations=None, selected_building_uses=None):
-    """Get approach options with counts filtered by current search criteria"""
-    # Get all records
-    all_records = st.session_state.db.get_energy_data(limit=5000)
-    
-    # Filter out rejected records (keep NULL, approved, pending)
-    records = [r for r in all_records if r.get('status') != 'rejected']
-    
-    # Apply criteria filter
-    if criteria and criteria != "Select a determinant":
-        records = [r for r in records if r.get('criteria') == criteria]
-    
-    # Apply energy method filter
-    if energy_method and energy_method != "Select an output":
-        records = [r for r in records if r.get('energy_method') == energy_method]
-    
-    # Apply direction filter
-    if direction and direction not in ["Select a direction", None]:
-        clean_direction = direction.split(" [")[0] if " [" in direction else direction
-        records = [r for r in records if r.get('direction') == clean_direction]
-    
-    # Apply scale filter
-    if selected_scales and selected_scales != ["All"]:
-        records = [r for r in records if r.get('scale') in selected_scales]
-    
-    # Apply climate filter
-    if selected_climates and selected_climates != ["All"]:
-        selected_upper = [c.upper() for c in selected_climates]
-        records = [r for r in records if r.get('climate') and r.get('climate').upper() in selected_upper]
-    
-    # Apply location filter
-    if selected_locations and selected_locations != ["All"]:
-        records = [r for r in records if r.get('location') in selected_locations]
-    
-    # Apply building use filter
-    if selected_building_uses and selected_building_uses != ["All"]:
-        records = [r for r in records if r.get('building_use') in selected_building_uses]
-    
-    # Count approaches
-    approach_counts = {}
-    for record in records:
-        approach = record.get('approach')
-        if approach:
-            approach_counts[approach] = approach_counts.get(approach, 0) + 1
-    
-    return [(approach, count) for approach, count in sorted(approach_counts.items())]
-
 def render_unified_search_interface(enable_editing=False):
     """Unified search interface used by both main app and admin"""
     
-        # Get all records that are NOT rejected (includes NULL, approved, pending)
-    all_records = st.session_state.db.get_energy_data(limit=5000)  # Get all records
-
-    # Filter out rejected records in Python
-    valid_records = []
-    for record in all_records:
-        status = record.get('status')
-        # Include if status is not 'rejected' (includes NULL, 'approved', 'pending')
-        if status != 'rejected':
-            valid_records.append(record)
+    # One engine per render, so every count and mask below comes from the same snapshot
+    # (a newer one can appear mid-render); the cube covers non-rejected records (NULL, approved, pending)
+    engine = get_facet_engine(st.session_state.db)
+    cube = engine.cube
+    snapshot = engine.snapshot
 
-    print(f"Total valid records (excluding rejected): {len(valid_records)}")
+    print(f"Total valid records (excluding rejected): {cube.total()}")
 
     # Get counts for determinants from valid records
-    criteria_counts = {}
-    for record in valid_records:
-        criteria = record.get('criteria')
-        if criteria:
-            criteria_counts[criteria] = criteria_counts.get(criteria, 0) + 1
+    criteria_counts = cube.counts_by('criteria')
 
     print(f"Unique criteria found: {len(criteria_counts)}")
 
@@ -3024,15 +2800,8 @@ def render_unified_search_interface(enable_editing=False):
     actual_criteria = selected_criteria.split(" [")[0] if selected_criteria != "Select a determinant" else None
 
     if actual_criteria:
-        # Filter valid_records to get energy methods for this criteria
-        criteria_records = [r for r in valid_records if r.get('criteria') == actual_criteria]
-        
-        # Get energy method counts
-        method_counts = {}
-        for record in criteria_records:
-            method = record.get('energy_method')
-            if method:
-                method_counts[method] = method_counts.get(method, 0) + 1
+        # Get energy method counts for this criteria
+        method_counts = cube.counts_by('energy_method', criteria=actual_criteria)
         
         method_list = ["Select an output"] + [f"{method} [{count}]" for method, count in sorted(method_counts.items())]
         
@@ -3040,7 +2809,7 @@ def render_unified_search_interface(enable_editing=False):
         actual_method = selected_method.split(" [")[0] if selected_method != "Select an output" else None
         
         if actual_method:
-            direction_counts = query_direction_counts(actual_criteria, actual_method)
+            direction_counts = query_direction_counts(actual_criteria, actual_method, cube=cube)
             
             # Ensure direction_counts is a dictionary with default values
             if not isinstance(direction_counts, dict):
@@ -3061,25 +2830,27 @@ def render_unified_search_interface(enable_editing=False):
 
         if selected_direction:
             if selected_direction:
+                # Current facet selections from session state, counted in one pass
+                current_selections = {}
+                for facet in FACETS:
+                    current_value = st.session_state.get(f"unified_selected_{facet}", "All")
+                    if current_value == "All":
+                        continue
+                    if facet == 'climate':
+                        climate_code = current_value.split(" - ")[0]
+                        current_selections[facet] = [''.join([c for c in climate_code if c.isalnum()])]
+                    else:
+                        current_selections[facet] = [current_value.split(" [")[0]]
+                
+                facet_options = query_facet_options_with_counts(
+                    actual_criteria, actual_method, selected_direction, current_selections, engine=engine
+                )
+                
                 # Filters
                 col_scale, col_climate = st.columns(2)
                 
                 with col_scale:
-                    current_climate_filter = []
-                    if 'unified_selected_climate' in st.session_state and st.session_state.unified_selected_climate != "All":
-                        climate_code = st.session_state.unified_selected_climate.split(" - ")[0]
-                        climate_code = ''.join([c for c in climate_code if c.isalnum()])
-                        current_climate_filter = [climate_code]
-                    
-                    current_location_filter = []
-                    if 'unified_selected_location' in st.session_state and st.session_state.unified_selected_location != "All":
-                        location_name = st.session_state.unified_selected_location.split(" [")[0]
-                        current_location_filter = [location_name]
-                    
-                    scale_options_with_counts = query_scale_options_with_counts(
-                        actual_criteria, actual_method, selected_direction, 
-                        current_climate_filter, current_location_filter
-                    )
+                    scale_options_with_counts = facet_options['scale']
                     
                     if scale_options_with_counts:
                         if 'unified_selected_scale' not in st.session_state:
@@ -3121,22 +2892,7 @@ def render_unified_search_interface(enable_editing=False):
                         st.info("No scale data available")
 
                 with col_climate:
-                    current_scale_filter = []
-                    if 'unified_selected_scale' in st.session_state and st.session_state.unified_selected_scale != "All":
-                        scale_name = st.session_state.unified_selected_scale.split(" [")[0]
-                        current_scale_filter = [scale_name]
-                    
-                    current_location_filter = []
-                    if 'unified_selected_location' in st.session_state and st.session_state.unified_selected_location != "All":
-                        location_name = st.session_state.unified_selected_location.split(" [")[0]
-                        current_location_filter = [location_name]
-                    
-                    climate_options_with_counts = query_climate_options_with_counts(
-                        actual_criteria,
-                        actual_method,
-                        selected_direction,
-                        current_scale_filter
-                    )
+                    climate_options_with_counts = format_climate_options_with_counts(facet_options['climate'])
                     
                     if climate_options_with_counts:
                         if 'unified_selected_climate' not in st.session_state:
@@ -3185,12 +2941,7 @@ def render_unified_search_interface(enable_editing=False):
                 col_location, col_building_use = st.columns(2)
                 
                 with col_location:
-                    current_direction = selected_direction.split(" [")[0] if " [" in selected_direction else selected_direction
-                    
-                    location_options_with_counts = query_location_options_with_counts(
-                        actual_criteria, actual_method, current_direction, 
-                        selected_scales, selected_climates
-                    )
+                    location_options_with_counts = facet_options['location']
                     
                     if location_options_with_counts:
                         if 'unified_selected_location' not in st.session_state:
@@ -3232,10 +2983,7 @@ def render_unified_search_interface(enable_editing=False):
                         st.info("No location data available")
 
                 with col_building_use:
-                    building_use_options_with_counts = query_building_use_options_with_counts(
-                        actual_criteria, actual_method, current_direction,
-                        selected_scales, selected_climates, selected_locations
-                    )
+                    building_use_options_with_counts = facet_options['building_use']
                     
                     if building_use_options_with_counts:
                         if 'unified_selected_building_use' not in st.session_state:
@@ -3280,10 +3028,7 @@ def render_unified_search_interface(enable_editing=False):
                 col_approach = st.columns(1)[0]
                 
                 with col_approach:
-                    approach_options_with_counts = query_approach_options_with_counts(
-                        actual_criteria, actual_method, current_direction,
-                        selected_scales, selected_climates, selected_locations, selected_building_uses
-                    )
+                    approach_options_with_counts = facet_options['approach']
                     
                     if approach_options_with_counts:
                         if 'unified_selected_approach' not in st.session_state:
@@ -3325,25 +3070,17 @@ def render_unified_search_interface(enable_editing=False):
                         st.info("No approach data available")
 
     # Filter records
-    filtered_records = all_records
-    if actual_criteria:
-        filtered_records = [r for r in filtered_records if r.get('criteria') == actual_criteria]
-    if actual_method:
-        filtered_records = [r for r in filtered_records if r.get('energy_method') == actual_method]
-    if selected_direction:
-        clean_direction = selected_direction.split(" [")[0] if selected_direction else None
-        filtered_records = [r for r in filtered_records if r.get('direction') == clean_direction]
-    if selected_scales:
-        filtered_records = [r for r in filtered_records if r.get('scale') in selected_scales]
-    if selected_climates:
-        selected_climates_upper = [c.upper() for c in selected_climates]
-        filtered_records = [r for r in filtered_records if r.get('climate') and r.get('climate').upper() in selected_climates_upper]
-    if selected_locations:
-        filtered_records = [r for r in filtered_records if r.get('location') in selected_locations]
-    if selected_building_uses:
-        filtered_records = [r for r in filtered_records if r.get('building_use') in selected_building_uses]
-    if selected_approaches:
-        filtered_records = [r for r in filtered_records if r.get('approach') in selected_approaches]
+    filtered_mask = engine.filtered_mask(
+        actual_criteria, actual_method, selected_direction,
+        {
+            'scale': selected_scales,
+            'climate': selected_climates,
+            'location': selected_locations,
+            'building_use': selected_building_uses,
+            'approach': selected_approaches,
+        }
+    )
+    filtered_records = snapshot.rows(filtered_mask)
 
     # ============= RESULTS DISPLAY =============
     if actual_criteria and actual_method and selected_direction:
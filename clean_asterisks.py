@@ -5,9 +5,9 @@ import re
 print("🔍 Starting location cleanup...")
 
 db = DatabaseWrapper()
-all_records = db.get_energy_data(limit=5000)
+all_records = list(db.iter_energy_data())
 
-updated_count = 0
+pending_updates = []
 for record in all_records:
     record_id = record['id']
     old_loc = record.get('location', '')
@@ -22,8 +22,12 @@ for record in all_records:
             print(f"📝 Updating record {record_id}:")
             print(f"   Old: '{old_loc}'")
             print(f"   New: '{new_loc}'")
-            db.update_record('energy_data', record_id, {'location': new_loc})
-            updated_count += 1
+            pending_updates.append((record_id, {'location': new_loc}))
+
+result = db.update_records_bulk('energy_data', pending_updates)
+updated_count = len(result['updated'])
+for record_id, error in result['failed']:
+    print(f"❌ Record {record_id} not updated: {error}")
 
 print(f"\n✅ Updated {updated_count} records")
 
@@ -0,0 +1,91 @@
+# count_cube.py
+import threading
+import numpy as np
+from energy_snapshot import get_energy_snapshot, MISSING_CODE
+
+# The drill-down dimensions: determinant -> output -> direction -> facets
+CUBE_DIMENSIONS = (
+    'criteria', 'energy_method', 'direction',
+    'scale', 'climate', 'location', 'building_use', 'approach'
+)
+
+# Dimensions matched case-insensitively (climate codes are stored as 'Cfa', 'CFA', ...)
+CASE_INSENSITIVE_DIMENSIONS = {'climate'}
+
+
+class CountCube:
+    """
+    Sparse (COO) count cube of non-rejected records over CUBE_DIMENSIONS.
+    Each cell is one distinct combination of encoded values and its record count,
+    so any prefix of the drill-down is a mask over cells plus a weighted bincount.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.version = snapshot.version
+        self.axis = {dim: i for i, dim in enumerate(CUBE_DIMENSIONS)}
+
+        stacked = np.column_stack([snapshot.codes[dim][snapshot.valid_mask] for dim in CUBE_DIMENSIONS])
+        if len(stacked):
+            self.coords, self.counts = np.unique(stacked, axis=0, return_counts=True)
+        else:
+            self.coords = np.empty((0, len(CUBE_DIMENSIONS)), dtype=np.int32)
+            self.counts = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.counts)
+
+    def mask(self, **selections):
+        """
+        Mask of cells matching the selections.
+        Each keyword is a dimension mapped to one value or a list of values;
+        None, [] and ["All"] leave the dimension unconstrained.
+        """
+        mask = np.ones(len(self.counts), dtype=bool)
+        for dim, values in selections.items():
+            if values is None or values == [] or values == ["All"]:
+                continue
+            if isinstance(values, str):
+                values = [values]
+            codes = self.snapshot.codes_for(dim, values, dim in CASE_INSENSITIVE_DIMENSIONS)
+            mask &= np.isin(self.coords[:, self.axis[dim]], codes)
+        return mask
+
+    def marginal(self, dim, mask=None, exclude=()):
+        """Sum the cells selected by mask down to {value: count} along one dimension"""
+        codes = self.coords[:, self.axis[dim]]
+        weights = self.counts
+        if mask is not None:
+            codes = codes[mask]
+            weights = weights[mask]
+        keep = codes != MISSING_CODE
+        values = self.snapshot.categories[dim]
+        totals = np.bincount(codes[keep], weights=weights[keep], minlength=len(values))
+        return {values[code]: int(n) for code, n in enumerate(totals) if n and values[code] not in exclude}
+
+    def counts_by(self, dim, exclude=(), **selections):
+        """Counts for one dimension under the given selections"""
+        return self.marginal(dim, self.mask(**selections), exclude)
+
+    def total(self, **selections):
+        """Number of records matching the selections"""
+        return int(self.counts[self.mask(**selections)].sum())
+
+
+# ============= SHARED CUBE =============
+
+_cube = None
+_cube_lock = threading.Lock()
+
+
+def get_count_cube(db):
+    """Get the count cube for the current shared snapshot, rebuilding it on a new data version"""
+    global _cube
+    snapshot = get_energy_snapshot(db)
+    cube = _cube
+    if cube is None or cube.snapshot is not snapshot:
+        with _cube_lock:
+            if _cube is None or _cube.snapshot is not snapshot:
+                _cube = CountCube(snapshot)
+            cube = _cube
+    return cube
@@ -0,0 +1,286 @@
+# db_instrumentation.py
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+# Rotating JSONL log of every top-level DatabaseWrapper call
+CALL_LOG_PATH = os.getenv('DB_CALL_LOG', 'db_calls.jsonl')
+CALL_LOG_MAX_BYTES = 5 * 1024 * 1024
+CALL_LOG_BACKUPS = 3
+
+# Upper bounds (ms) of the wall-time histogram buckets; the last bucket is open-ended
+HISTOGRAM_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# Cheap bookkeeping accessors that would only add noise
+UNINSTRUMENTED = {'close', 'get_write_count', 'cache_stats', 'mirror_status'}
+
+
+class MethodStats:
+    """Call count, totals and a wall-time histogram for one method"""
+
+    __slots__ = ('calls', 'errors', 'cache_hits', 'wall_ms', 'cpu_ms', 'rows', 'bytes', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.wall_ms = 0.0
+        self.cpu_ms = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+
+    def add(self, record):
+        self.calls += 1
+        self.errors += record['error'] is not None
+        self.cache_hits += record['cache_hit']
+        self.wall_ms += record['wall_ms']
+        self.cpu_ms += record['cpu_ms']
+        self.rows += record['rows'] or 0
+        self.bytes += record['bytes'] or 0
+        bucket = 0
+        while bucket < len(HISTOGRAM_BOUNDS_MS) and record['wall_ms'] > HISTOGRAM_BOUNDS_MS[bucket]:
+            bucket += 1
+        self.buckets[bucket] += 1
+
+    def percentile(self, fraction):
+        """Upper bound (ms) of the bucket holding the given fraction of calls"""
+        wanted = fraction * self.calls
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= wanted and count:
+                return HISTOGRAM_BOUNDS_MS[bucket] if bucket < len(HISTOGRAM_BOUNDS_MS) else float('inf')
+        return 0
+
+
+class CallStats:
+    """Per-method aggregation of call records (one per process, one per Streamlit rerun)"""
+
+    def __init__(self):
+        self.methods = {}
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        key = f"{record['backend']}.{record['method']}"
+        with self._lock:
+            stats = self.methods.get(key)
+            if stats is None:
+                stats = self.methods[key] = MethodStats()
+            stats.add(record)
+
+    def total_calls(self):
+        return sum(stats.calls for stats in self.methods.values())
+
+    def total_wall_ms(self):
+        return sum(stats.wall_ms for stats in self.methods.values())
+
+    def summary(self, top=None):
+        """Rows for display, slowest total time first"""
+        with self._lock:
+            items = sorted(self.methods.items(), key=lambda item: item[1].wall_ms, reverse=True)
+        rows = [{
+            'method': key,
+            'calls': stats.calls,
+            'errors': stats.errors,
+            'cache_hits': stats.cache_hits,
+            'total_ms': round(stats.wall_ms, 1),
+            'cpu_ms': round(stats.cpu_ms, 1),
+            'p50_ms': stats.percentile(0.5),
+            'p95_ms': stats.percentile(0.95),
+            'rows': stats.rows,
+            'kb': round(stats.bytes / 1024, 1),
+        } for key, stats in items]
+        return rows[:top] if top else rows
+
+
+_process_stats = CallStats()
+_local = threading.local()
+_call_log = None
+_call_log_lock = threading.Lock()
+
+
+def process_stats():
+    """Aggregated calls since this server process started"""
+    return _process_stats
+
+
+def start_rerun():
+    """Collect this thread's calls into a fresh CallStats (call at the top of every Streamlit rerun) and return it"""
+    _local.rerun = CallStats()
+    return _local.rerun
+
+
+def _logger():
+    global _call_log
+    if _call_log is None:
+        with _call_log_lock:
+            if _call_log is None:
+                logger = logging.getLogger('db_calls')
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                try:
+                    handler = RotatingFileHandler(CALL_LOG_PATH, maxBytes=CALL_LOG_MAX_BYTES, backupCount=CALL_LOG_BACKUPS)
+                    handler.setFormatter(logging.Formatter('%(message)s'))
+                    logger.addHandler(handler)
+                except OSError as e:
+                    # Read-only filesystem: keep the in-memory stats only
+                    print(f"⚠️ DB call log disabled: {e}")
+                _call_log = logger
+    return _call_log
+
+
+def _record(record):
+    _process_stats.add(record)
+    rerun = getattr(_local, 'rerun', None)
+    if rerun is not None:
+        rerun.add(record)
+    _logger().info(json.dumps(record, default=str))
+
+
+# ============= SIZING =============
+
+def _value_bytes(value):
+    return len(value) if value.__class__ is str else len(str(value))
+
+
+def _row_bytes(row):
+    """Approximate payload size of one row"""
+    if isinstance(row, (tuple, list)):
+        values = row
+    elif hasattr(row, 'values'):
+        # dicts and EnergyRecords
+        values = row.values()
+    elif hasattr(row, 'keys'):
+        # sqlite3.Row is iterable but has no values()
+        values = tuple(row)
+    else:
+        values = (row,)
+    return sum(_value_bytes(value) for value in values)
+
+
+def _measure(result, cache_hit=False):
+    """
+    (rows, approximate bytes) of a method result; None for results that aren't row sets.
+    Cache hits are counted but not sized again: their bytes were recorded when they were loaded.
+    """
+    if cache_hit:
+        return (len(result), None) if isinstance(result, (list, dict)) else (None, None)
+    if isinstance(result, list):
+        return len(result), sum(_row_bytes(row) for row in result)
+    if isinstance(result, dict):
+        return len(result), sum(len(str(key)) + len(str(value)) for key, value in result.items())
+    return None, None
+
+
+# ============= WRAPPING =============
+
+def _call_args(signature, instance, args, kwargs):
+    """filters and table arguments of a call, if the method takes them"""
+    try:
+        bound = signature.bind(instance, *args, **kwargs).arguments
+    except TypeError:
+        return None, None
+    return bound.get('filters'), bound.get('table')
+
+
+def _depth():
+    return getattr(_local, 'depth', 0)
+
+
+def note_cache_hit():
+    """Mark the current top-level call as served from the query cache"""
+    _local.cache_hit = True
+
+
+def _new_record(instance, name, filters, table, wall_ms, cpu_ms, rows, nbytes, error, cache_hit=False):
+    return {
+        'ts': time.time(),
+        'backend': instance._backend_name(),
+        'method': name,
+        'table': table,
+        'filters': filters,
+        'rows': rows,
+        'bytes': nbytes,
+        'wall_ms': round(wall_ms, 3),
+        'cpu_ms': round(cpu_ms, 3),
+        'error': error,
+        'cache_hit': cache_hit,
+    }
+
+
+def _instrument(name, method):
+    signature = inspect.signature(method)
+
+    if inspect.isgeneratorfunction(method):
+        @functools.wraps(method)
+        def generator_wrapper(self, *args, **kwargs):
+            # Only time spent inside the generator counts, not the consumer's loop body,
+            # so calls the consumer makes per row show up as calls of their own
+            top_level = _depth() == 0
+            filters, table = _call_args(signature, self, args, kwargs)
+            iterator = method(self, *args, **kwargs)
+            rows = nbytes = 0
+            wall_ms = cpu_ms = 0.0
+            error = None
+            try:
+                while True:
+                    _local.depth = _depth() + 1
+                    wall_start, cpu_start = time.perf_counter(), time.thread_time()
+                    try:
+                        row = next(iterator)
+                    except StopIteration:
+                        return
+                    finally:
+                        wall_ms += (time.perf_counter() - wall_start) * 1000
+                        cpu_ms += (time.thread_time() - cpu_start) * 1000
+                        _local.depth = _depth() - 1
+                    rows += 1
+                    nbytes += _row_bytes(row)
+                    yield row
+            except Exception as e:
+                error = repr(e)
+                raise
+            finally:
+                if top_level:
+                    _record(_new_record(self, name, filters, table, wall_ms, cpu_ms, rows, nbytes, error))
+        return generator_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if _depth() > 0:
+            # Nested call (e.g. save_analysis -> insert_record): part of the outer record
+            return method(self, *args, **kwargs)
+        filters, table = _call_args(signature, self, args, kwargs)
+        _local.depth = 1
+        _local.cache_hit = False
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        result = error = None
+        try:
+            result = method(self, *args, **kwargs)
+            return result
+        except Exception as e:
+            error = repr(e)
+            raise
+        finally:
+            wall_ms = (time.perf_counter() - wall_start) * 1000
+            cpu_ms = (time.thread_time() - cpu_start) * 1000
+            _local.depth = 0
+            cache_hit = _local.cache_hit
+            rows, nbytes = _measure(result, cache_hit)
+            _record(_new_record(self, name, filters, table, wall_ms, cpu_ms, rows, nbytes, error, cache_hit))
+    return wrapper
+
+
+def instrument_methods(cls):
+    """Class decorator: record every public method call (see UNINSTRUMENTED for exceptions)"""
+    for name, member in list(vars(cls).items()):
+        if name.startswith('_') or name in UNINSTRUMENTED or not inspect.isfunction(member):
+            continue
+        setattr(cls, name, _instrument(name, member))
+    return cls
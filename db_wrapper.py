@@ -4,48 +4,435 @@ from supabase import create_client
 import sqlite3
 import os
 import re
-from functools import lru_cache
 import time
 import bcrypt
 from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sqlite_writer import SQLiteWriter
+from query_cache import QueryCache, normalize_filters
+from db_instrumentation import instrument_methods, note_cache_hit
+from energy_record import ENERGY_DATA_COLUMNS, to_energy_records, study_key
+from filter_spec import FilterSpec
+from facet_counts import FACETS, sqlite_migration_statements as facet_count_statements, group_facet_counts
+from energy_mirror import EnergyMirror, create_mirror_schema, MIRROR_DB_PATH, MIRROR_MAX_STALENESS
 
+# Process-wide count of writes to energy_data, used as a cheap data version
+_write_count = 0
+_write_count_lock = threading.Lock()
+
+def _bump_write_count():
+    global _write_count
+    with _write_count_lock:
+        _write_count += 1
+
+# Everything except the long paragraph text, for list and facet views
+SUMMARY_COLUMNS = [c for c in ENERGY_DATA_COLUMNS if c != 'paragraph']
+
+def _select_list(columns, prefix=''):
+    """SQL select list for a column projection ('*' when columns is None)"""
+    if columns is None:
+        return f"{prefix}*"
+    unknown = [c for c in columns if c not in ENERGY_DATA_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown energy_data columns: {unknown}")
+    return ', '.join(f"{prefix}{c}" for c in columns)
+
+def _postgrest_select(columns):
+    """PostgREST select string for a column projection"""
+    return _select_list(columns).replace(', ', ',')
+
+# energy_data columns added by Supabase migrations that a deployment may not have applied yet
+OPTIONAL_REMOTE_COLUMNS = (
+    'updated_at',  # supabase/005_energy_data_updated_at.sql
+    'study_key',   # supabase/006_energy_data_study_key.sql
+)
+
+# Columns energy_data_value_counts may group or filter on
+VALUE_COUNT_COLUMNS = (
+    'id', 'group_id', 'criteria', 'energy_method', 'direction', 'status', 'user', 'scale',
+    'climate', 'location', 'building_use', 'climate_multi', 'approach', 'sample_size'
+)
+
+def emulate_value_counts_rpc(conn, group_column, filters=None, exclude_values=()):
+    """
+    SQLite implementation of the energy_data_value_counts Postgres function.
+    Works on any connection holding an energy_data table, e.g. an in-memory copy for offline tests.
+    """
+    if group_column not in VALUE_COUNT_COLUMNS or group_column == 'id':
+        raise ValueError(f"Cannot count by column: {group_column}")
+    filters = filters or {}
+    unknown = [key for key in filters if key not in VALUE_COUNT_COLUMNS]
+    if unknown:
+        raise ValueError(f"Cannot filter on columns: {unknown}")
+    
+    # The Postgres function uses status != 'rejected', which also drops NULL status
+    spec = FilterSpec().present(group_column).neq('status', 'rejected')
+    if exclude_values:
+        spec.not_in(group_column, exclude_values)
+    for key, value in filters.items():
+        spec.eq(key, value)
+    sql, params = spec.count_sql(group_column)
+    
+    cursor = conn.cursor()
+    cursor.execute(sql, params)
+    return [{'value': row[0], 'count': row[1]} for row in cursor.fetchall()]
+
+# Rows per keyset page; matches PostgREST's default max-rows cap
+ENERGY_PAGE_SIZE = 1000
+
+# Rows per PostgREST request for bulk inserts/updates
+BULK_CHUNK_SIZE = 500
+
+# Rows changed by bulk writes (insert/update/delete/replace) before SQLite's planner statistics are refreshed
+ANALYZE_AFTER_ROWS = 500
+
+def _group_by_columns(rows):
+    """Group (key, row dict) pairs by column set, since one statement takes one column list"""
+    groups = {}
+    for key, row in rows:
+        groups.setdefault(tuple(row.keys()), []).append((key, row))
+    return groups
+
+def _group_by_values(updates):
+    """Group (record id, fields) updates by identical fields, so each group is one UPDATE ... WHERE id IN"""
+    groups = {}
+    for record_id, fields in updates:
+        # repr keeps 1 and '1' apart and copes with unhashable values
+        key = tuple((column, repr(value)) for column, value in fields.items())
+        groups.setdefault(key, (fields, []))[1].append(record_id)
+    return list(groups.values())
+
+# Reported for update ids that match no row
+MISSING_RECORD_ERROR = 'Record not found'
+
+def _sqlite_insert_rows(cursor, table, rows):
+    """executemany INSERT of id-less rows on the writer cursor; returns the new ids in input order"""
+    new_ids = [None] * len(rows)
+    for columns, group in _group_by_columns(enumerate(rows)).items():
+        cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+        max_before = cursor.fetchone()[0]
+        placeholders = ', '.join('?' for _ in columns)
+        cursor.executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+            [tuple(row.values()) for _, row in group]
+        )
+        # New rowids are handed out in order and the writer thread is the only writer
+        cursor.execute(f"SELECT id FROM {table} WHERE id > ? ORDER BY id", (max_before,))
+        for (position, _), (new_id,) in zip(group, cursor.fetchall()):
+            new_ids[position] = new_id
+    return new_ids
+
+# Ids reserved per reserve_id_block call (supabase/004_reserve_id_block.sql)
+ID_BLOCK_SIZE = 50
+
+class IdBlockAllocator:
+    """
+    Hands out Supabase ids from blocks reserved with the reserve_id_block function.
+    One cached block per table, so most inserts need no extra round-trip and concurrent
+    contributors never compete for the same id.
+    """
+    
+    def __init__(self, client, block_size=ID_BLOCK_SIZE):
+        self.client = client
+        self.block_size = block_size
+        self._blocks = {}  # table -> (next id, end of block)
+        self._lock = threading.Lock()
+    
+    def allocate(self, table, count=1):
+        """Take count consecutive-as-possible ids for table, reserving new blocks as needed"""
+        with self._lock:
+            next_id, end = self._blocks.get(table, (0, 0))
+            ids = []
+            while len(ids) < count:
+                if next_id >= end:
+                    size = max(self.block_size, count - len(ids))
+                    next_id = int(self.client.rpc('reserve_id_block', {
+                        'table_name': table, 'block_size': size
+                    }).execute().data)
+                    end = next_id + size
+                take = min(end - next_id, count - len(ids))
+                ids.extend(range(next_id, next_id + take))
+                next_id += take
+            self._blocks[table] = (next_id, end)
+            return ids
+
+# Text columns covered by full-text search (SQLite FTS5 / Postgres tsvector)
+SEARCH_FIELDS = ['paragraph', 'criteria', 'energy_method', 'location', 'climate', 'building_use', 'approach']
+
+_FTS_COLUMNS = ', '.join(SEARCH_FIELDS)
+_FTS_NEW = ', '.join(f"new.{field}" for field in SEARCH_FIELDS)
+_FTS_OLD = ', '.join(f"old.{field}" for field in SEARCH_FIELDS)
+
+def _add_study_key_column(cursor):
+    # The read mirror creates energy_data from ENERGY_DATA_COLUMNS, so it may already have it
+    cursor.execute("PRAGMA table_info(energy_data)")
+    if 'study_key' not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE energy_data ADD COLUMN study_key TEXT")
+
+def _backfill_study_keys(cursor):
+    cursor.execute("SELECT id, paragraph FROM energy_data WHERE study_key IS NULL")
+    cursor.executemany(
+        "UPDATE energy_data SET study_key = ? WHERE id = ?",
+        [(key, record_id) for record_id, key in ((row[0], study_key(row[1])) for row in cursor.fetchall()) if key]
+    )
+
+def _with_study_key(table, row):
+    """
+    SQLite rows for energy_data carry the study_key of their paragraph.
+    Supabase sets it in a trigger (supabase/006_energy_data_study_key.sql).
+    """
+    if table != 'energy_data' or 'paragraph' not in row:
+        return row
+    return dict(row, study_key=study_key(row['paragraph']))
+
+# Ordered SQLite schema migrations: (version, name, statements).
+# A statement is SQL text or a callable taking the migration cursor.
+# Supabase equivalents live in supabase/*.sql and are applied by hand.
+SQLITE_MIGRATIONS = [
+    (1, 'energy_data_fts', [
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS energy_data_fts USING fts5(
+            {_FTS_COLUMNS},
+            content='energy_data', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )""",
+        f"""CREATE TRIGGER IF NOT EXISTS energy_data_fts_ai AFTER INSERT ON energy_data BEGIN
+            INSERT INTO energy_data_fts(rowid, {_FTS_COLUMNS}) VALUES (new.id, {_FTS_NEW});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS energy_data_fts_ad AFTER DELETE ON energy_data BEGIN
+            INSERT INTO energy_data_fts(energy_data_fts, rowid, {_FTS_COLUMNS}) VALUES ('delete', old.id, {_FTS_OLD});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS energy_data_fts_au AFTER UPDATE ON energy_data BEGIN
+            INSERT INTO energy_data_fts(energy_data_fts, rowid, {_FTS_COLUMNS}) VALUES ('delete', old.id, {_FTS_OLD});
+            INSERT INTO energy_data_fts(rowid, {_FTS_COLUMNS}) VALUES (new.id, {_FTS_NEW});
+        END""",
+        "INSERT INTO energy_data_fts(energy_data_fts) VALUES ('rebuild')",
+    ]),
+    (2, 'energy_data_filter_indexes', [
+        "CREATE INDEX IF NOT EXISTS idx_energy_data_filter ON energy_data (status, criteria, energy_method, direction)",
+        "CREATE INDEX IF NOT EXISTS idx_energy_data_scale ON energy_data (scale)",
+        "CREATE INDEX IF NOT EXISTS idx_energy_data_climate ON energy_data (climate)",
+        "CREATE INDEX IF NOT EXISTS idx_energy_data_location ON energy_data (location)",
+        "CREATE INDEX IF NOT EXISTS idx_energy_data_building_use ON energy_data (building_use)",
+        "CREATE INDEX IF NOT EXISTS idx_energy_data_approach ON energy_data (approach)",
+    ]),
+    (3, 'energy_data_study_key', [
+        _add_study_key_column,
+        _backfill_study_keys,
+        # status is included so study grouping of non-rejected rows never touches the table
+        "CREATE INDEX IF NOT EXISTS idx_energy_data_study_key ON energy_data (study_key, status)",
+    ]),
+    (4, 'energy_facet_counts', facet_count_statements()),
+    (5, 'energy_data_change_count', [
+        # Bumped by every row change, so get_data_version also sees UPDATEs made by other processes
+        """CREATE TABLE IF NOT EXISTS energy_data_changes (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            change_count INTEGER NOT NULL
+        )""",
+        "INSERT OR IGNORE INTO energy_data_changes (id, change_count) VALUES (1, 0)",
+    ] + [
+        f"""CREATE TRIGGER IF NOT EXISTS energy_data_changes_{suffix} AFTER {event} ON energy_data BEGIN
+            UPDATE energy_data_changes SET change_count = change_count + 1 WHERE id = 1;
+        END"""
+        for suffix, event in (('ai', 'INSERT'), ('au', 'UPDATE'), ('ad', 'DELETE'))
+    ]),
+]
+
+# Seconds before Supabase's energy_facet_counts view is refreshed even without local writes
+FACET_REFRESH_INTERVAL = 300.0
+
+def _config(secret_name, env_name, default=None):
+    """A setting from Streamlit secrets, falling back to the environment"""
+    try:
+        if secret_name in st.secrets:
+            return st.secrets[secret_name]
+    except:
+        pass
+    return os.getenv(env_name, default)
+
+def _config_flag(secret_name, env_name):
+    return str(_config(secret_name, env_name, '')).strip().lower() in ('1', 'true', 'yes', 'on')
+
+@instrument_methods
 class DatabaseWrapper:
-    def __init__(self):
+    def __init__(self, db_path='my_database.db', use_supabase=None):
+        """
+        use_supabase=None picks Supabase when its credentials are configured;
+        False forces a local SQLite database at db_path (e.g. the read mirror).
+        """
         # Check if we're in production (Streamlit Cloud) or have Supabase secrets
         self.use_supabase = False
         
-        # Check for Streamlit secrets first
-        try:
-            if 'supabase_url' in st.secrets and 'supabase_key' in st.secrets:
-                self.use_supabase = True
-                self.supabase_url = st.secrets["supabase_url"]
-                self.supabase_key = st.secrets["supabase_key"]
-        except:
-            pass
+        if use_supabase is not False:
+            # Check for Streamlit secrets first
+            try:
+                if 'supabase_url' in st.secrets and 'supabase_key' in st.secrets:
+                    self.use_supabase = True
+                    self.supabase_url = st.secrets["supabase_url"]
+                    self.supabase_key = st.secrets["supabase_key"]
+            except:
+                pass
+            
+            # Check environment variables as fallback
+            if not self.use_supabase:
+                if os.getenv('SUPABASE_URL') and os.getenv('SUPABASE_KEY'):
+                    self.use_supabase = True
+                    self.supabase_url = os.getenv('SUPABASE_URL')
+                    self.supabase_key = os.getenv('SUPABASE_KEY')
         
-        # Check environment variables as fallback
-        if not self.use_supabase:
-            if os.getenv('SUPABASE_URL') and os.getenv('SUPABASE_KEY'):
-                self.use_supabase = True
-                self.supabase_url = os.getenv('SUPABASE_URL')
-                self.supabase_key = os.getenv('SUPABASE_KEY')
+        # Read results shared by all sessions, invalidated per table on every write
+        self._cache = QueryCache()
+        self._mirror = None
+        self._facets_refreshed = None  # (write count, monotonic time) of the last Supabase refresh
+        self._missing_remote_columns = None  # OPTIONAL_REMOTE_COLUMNS absent from Supabase, probed on first use
         
         if self.use_supabase:
             print("🔌 Using Supabase database")
+            # A single client, and so a single HTTP connection pool, for all sessions
             self.supabase = create_client(self.supabase_url, self.supabase_key)
+            self._id_allocator = IdBlockAllocator(self.supabase)
+            if _config_flag('energy_mirror', 'ENERGY_MIRROR'):
+                self._start_mirror()
         else:
             print("📂 Using local SQLite database")
-            self.conn = sqlite3.connect('my_database.db', check_same_thread=False)
-            self.conn.row_factory = sqlite3.Row
+            self.db_path = db_path
+            self._local = threading.local()
+            self._connections = {}  # thread id -> connection
+            self._connections_lock = threading.Lock()
+            # Shared by every session (see get_database in SpatialBuild_Energy.py); all writes go through it
+            self._writer = SQLiteWriter(self.db_path)
+            self._bulk_rows_since_analyze = 0
+            self._analyze_lock = threading.Lock()
+            self._run_migrations()
+            self.has_fts = self._table_exists('energy_data_fts')
+    
+    # ============= READ MIRROR =============
+    
+    def _start_mirror(self):
+        """
+        Mirror mode: energy_data reads are served from a local SQLite copy kept in sync
+        by EnergyMirror; writes still go to Supabase and are pulled into the copy at once.
+        """
+        max_staleness = float(_config('mirror_max_staleness', 'MIRROR_MAX_STALENESS', MIRROR_MAX_STALENESS))
+        print(f"🪞 Serving energy_data reads from local mirror {MIRROR_DB_PATH} (max staleness {max_staleness:.0f}s)")
+        create_mirror_schema(MIRROR_DB_PATH, ENERGY_DATA_COLUMNS)
+        reader = DatabaseWrapper(db_path=MIRROR_DB_PATH, use_supabase=False)
+        self._mirror = EnergyMirror(
+            self.supabase, reader, ENERGY_DATA_COLUMNS,
+            on_change=self._mirror_changed, max_staleness=max_staleness
+        )
+    
+    def _backend_name(self):
+        """Backend label for instrumentation records"""
+        if self._mirror is not None:
+            return 'supabase+mirror'
+        return 'supabase' if self.use_supabase else 'sqlite'
+    
+    def _mirror_reader(self):
+        """SQLite reader over the local mirror, or None when reads must go to Supabase"""
+        if self._mirror is None:
+            return None
+        return self._mirror.reader()
+    
+    def _mirror_changed(self):
+        self._cache.invalidate('energy_data')
+        _bump_write_count()
+    
+    def resync_mirror(self):
+        """Reload the whole local mirror from Supabase; False when mirror mode is off"""
+        if self._mirror is None:
+            return False
+        self._mirror.sync(full=True)
+        return True
+    
+    def mirror_status(self):
+        return self._mirror.status() if self._mirror is not None else None
+    
+    # ============= CONNECTION METHODS =============
+    
+    @property
+    def conn(self):
+        """This thread's SQLite connection, opened in WAL mode on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._register_connection(conn)
+        return conn
+    
+    def _register_connection(self, conn):
+        """Track a new thread connection and close those left behind by finished threads"""
+        live_threads = {thread.ident for thread in threading.enumerate()}
+        current = threading.get_ident()
+        with self._connections_lock:
+            for thread_id in list(self._connections):
+                # A reused thread id also means the old owner is gone
+                if thread_id not in live_threads or thread_id == current:
+                    self._connections.pop(thread_id).close()
+            self._connections[current] = conn
+    
+    def _write(self, job):
+        """Run job(cursor) on the SQLite writer thread and return its result once committed"""
+        return self._writer.run(job)
+    
+    def _cached(self, table, key, loader):
+        """Serve a read from the query cache, running loader() on a miss"""
+        loaded = []
+        
+        def load():
+            loaded.append(True)
+            return loader()
+        
+        value = self._cache.get_or_load(table, key, load)
+        if not loaded:
+            note_cache_hit()
+        return value
+    
+    def _after_write(self, table):
+        """Bookkeeping after any write: drop cached reads of table and bump the energy_data version"""
+        if self._mirror is not None and table == 'energy_data':
+            # Pull our own write into the mirror before anyone reads it back
+            try:
+                self._mirror.sync()
+            except Exception as e:
+                print(f"⚠️ Mirror sync after write failed, background sync will catch up: {e}")
+        self._cache.invalidate(table)
+        if table == 'energy_data':
+            _bump_write_count()
+    
+    def cache_stats(self):
+        """Query cache hit/miss counters"""
+        return self._cache.stats()
+    
+    def _new_auth_client(self):
+        """
+        Short-lived Supabase client for auth calls.
+        Signing in stores the user's session on the client, which must not leak
+        into the shared client used by every other session.
+        """
+        return create_client(self.supabase_url, self.supabase_key)
     
     # ============= ENERGY DATA METHODS =============
     
-    def get_energy_data(self, filters=None, limit=1000):
-        """Get energy_data records with optional filters and auto token refresh."""
+    def get_energy_data(self, filters=None, limit=1000, columns=None):
+        """
+        Get energy_data records with optional filters, column projection and auto token refresh.
+        filters is a {column: value} dict of equality filters or a FilterSpec.
+        """
+        key = ('get_energy_data', normalize_filters(filters), tuple(columns) if columns else None, limit)
+        return self._cached('energy_data', key, lambda: to_energy_records(self._load_energy_data(filters, limit, columns)))
+    
+    def _load_energy_data(self, filters=None, limit=1000, columns=None):
+        mirror = self._mirror_reader()
+        if mirror is not None:
+            return mirror._load_energy_data(filters, limit, columns)
         if self.use_supabase:
             try:
                 # First attempt - execute the query
-                return self._execute_energy_query(filters, limit)
+                return self._execute_energy_query(filters, limit, columns)
             except Exception as e:
                 # Check if it's a JWT expiration error
                 error_str = str(e).lower()
@@ -53,7 +440,7 @@ class DatabaseWrapper:
                     try:
                         # Refresh token and retry once
                         self.supabase.auth.refresh_session()
-                        return self._execute_energy_query(filters, limit)
+                        return self._execute_energy_query(filters, limit, columns)
                     except Exception as refresh_error:
                         # If refresh fails, raise the original error
                         raise e
@@ -61,34 +448,136 @@ class DatabaseWrapper:
                     # Not a token error, re-raise
                     raise e
         else:
-            # SQLite mode - unchanged
             cursor = self.conn.cursor()
-            sql = "SELECT * FROM energy_data"
-            params = []
-            
-            if filters:
-                where_clauses = []
-                for key, value in filters.items():
-                    if value is not None and value != "":
-                        where_clauses.append(f"{key} = ?")
-                        params.append(value)
-                if where_clauses:
-                    sql += " WHERE " + " AND ".join(where_clauses)
-            
-            if limit:
-                sql += f" LIMIT {limit}"
-            
+            sql, params = FilterSpec.from_filters(filters).select_sql(_select_list(columns), limit=limit or None)
             cursor.execute(sql, params)
             return cursor.fetchall()
 
-    def _execute_energy_query(self, filters=None, limit=1000):
-        """Internal method to execute the actual Supabase query for energy_data."""
-        query = self.supabase.table('energy_data').select('*')
+    def iter_energy_data(self, filters=None, columns=None, page_size=ENERGY_PAGE_SIZE, exclude_rejected=False, prefetch=False):
+        """
+        Stream energy_data rows as EnergyRecords using keyset pagination (id > last id).
+        Covers the whole table regardless of PostgREST's max-rows cap while
+        holding at most one page (two with prefetch) in memory.
+        filters is a {column: value} dict or a FilterSpec.
+        exclude_rejected keeps NULL, approved and pending rows.
+        prefetch fetches the next Supabase page on a background thread.
+        """
+        mirror = self._mirror_reader()
+        if mirror is not None:
+            yield from mirror.iter_energy_data(filters, columns, page_size, exclude_rejected)
+            return
         
-        if filters:
-            for key, value in filters.items():
-                if value is not None and value != "":
-                    query = query.eq(key, value)
+        if columns is not None and 'id' not in columns:
+            columns = ['id'] + list(columns)
+        
+        def fetch(last_id):
+            return to_energy_records(self._fetch_energy_page(last_id, filters, columns, page_size, exclude_rejected))
+        
+        if not (prefetch and self.use_supabase):
+            last_id = 0
+            while True:
+                page = fetch(last_id)
+                yield from page
+                if len(page) < page_size:
+                    return
+                last_id = page[-1]['id']
+        
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pending = executor.submit(fetch, 0)
+            while pending is not None:
+                page = pending.result()
+                pending = executor.submit(fetch, page[-1]['id']) if len(page) == page_size else None
+                yield from page
+    
+    def _fetch_energy_page(self, last_id, filters, columns, page_size, exclude_rejected):
+        """Fetch one keyset page of energy_data ordered by id"""
+        spec = FilterSpec.from_filters(filters)
+        if exclude_rejected:
+            spec.not_rejected()
+        spec.id_range(after=last_id)
+        if self.use_supabase:
+            def run_query():
+                query = spec.apply(self.supabase.table('energy_data').select(self._energy_select(columns)))
+                return query.order('id').limit(page_size).execute().data
+            return self._execute_with_token_refresh(run_query)
+        else:
+            cursor = self.conn.cursor()
+            sql, params = spec.select_sql(_select_list(columns), order_by='id', limit=page_size)
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+    
+    def _energy_select(self, columns):
+        """PostgREST select string for a projection, leaving out columns Supabase doesn't have yet"""
+        if columns is None:
+            return _postgrest_select(None)
+        missing = self._remote_columns_missing()
+        return _postgrest_select([c for c in columns if c not in missing] or ['id'])
+    
+    def _remote_columns_missing(self):
+        if self._missing_remote_columns is None:
+            missing = []
+            for column in OPTIONAL_REMOTE_COLUMNS:
+                try:
+                    self.supabase.table('energy_data').select(column).limit(1).execute()
+                except Exception as e:
+                    if column not in str(e):
+                        raise
+                    print(f"⚠️ energy_data.{column} missing in Supabase, leaving it out of selects until its migration is applied")
+                    missing.append(column)
+            self._missing_remote_columns = tuple(missing)
+        return self._missing_remote_columns
+    
+    def _execute_with_token_refresh(self, run_query):
+        """Run a Supabase query, refreshing an expired JWT and retrying once"""
+        try:
+            return run_query()
+        except Exception as e:
+            error_str = str(e).lower()
+            if 'jwt expired' in error_str or 'pgrst303' in error_str:
+                try:
+                    self.supabase.auth.refresh_session()
+                    return run_query()
+                except Exception:
+                    raise e
+            raise e
+
+    def get_write_count(self):
+        """Number of energy_data writes made by this process"""
+        return _write_count
+
+    def get_data_version(self):
+        """
+        Cheap version of energy_data: (row count, max id, update marker, local write count).
+        The update marker catches UPDATEs made by other processes, which leave the count and
+        max id alone: max(updated_at) on Supabase (None before its migration), the trigger-kept
+        change count on SQLite.
+        """
+        mirror = self._mirror_reader()
+        if mirror is not None:
+            return mirror.get_data_version()
+        write_count = _write_count
+        if self.use_supabase:
+            result = self.supabase.table('energy_data').select('id', count='exact').order('id', desc=True).limit(1).execute()
+            max_id = result.data[0]['id'] if result.data else 0
+            updated_at = None
+            if 'updated_at' not in self._remote_columns_missing():
+                latest = self.supabase.table('energy_data').select('updated_at').order('updated_at', desc=True).limit(1).execute()
+                updated_at = latest.data[0]['updated_at'] if latest.data else None
+            return (result.count or 0, max_id, updated_at, write_count)
+        else:
+            cursor = self.conn.cursor()
+            cursor.execute("""
+                SELECT COUNT(*), MAX(id), (SELECT change_count FROM energy_data_changes WHERE id = 1)
+                FROM energy_data
+            """)
+            row_count, max_id, change_count = cursor.fetchone()
+            return (row_count, max_id or 0, change_count, write_count)
+    
+    def _execute_energy_query(self, filters=None, limit=1000, columns=None):
+        """Internal method to execute the actual Supabase query for energy_data."""
+        query = FilterSpec.from_filters(filters).apply(
+            self.supabase.table('energy_data').select(self._energy_select(columns))
+        )
         
         if limit:
             query = query.limit(limit)
@@ -96,20 +585,37 @@ class DatabaseWrapper:
         result = query.execute()
         return result.data
         
-    def search_energy_data(self, search_term, fields=None, limit=100):
-        """Search across multiple fields including ID"""
-        print(f"🔍 search_energy_data called with: '{search_term}'")
+    def search_energy_data(self, search_term, fields=None, limit=100, columns=None):
+        """Search across multiple fields including ID, ranked by full-text relevance"""
+        key = ('search_energy_data', search_term, tuple(fields) if fields else None, limit,
+               tuple(columns) if columns else None)
+        return self._cached('energy_data', key,
+                            lambda: to_energy_records(self._search_energy_data(search_term, fields, limit, columns)))
+    
+    def _search_energy_data(self, search_term, fields=None, limit=100, columns=None):
+        mirror = self._mirror_reader()
+        if mirror is not None:
+            return mirror._search_energy_data(search_term, fields, limit, columns)
         search_term = search_term.replace(',', ' ')
         if not search_term:
             return []
         
+        # Default fields to search
+        if fields is None:
+            fields = SEARCH_FIELDS
+        
+        # Results are de-duplicated by id, so always project it
+        if columns is not None and 'id' not in columns:
+            columns = ['id'] + list(columns)
+        
         if self.use_supabase:
-            # Default fields to search
-            if fields is None:
-                fields = ['paragraph', 'criteria', 'energy_method', 'location', 'climate', 'building_use', 'approach']
+            # Ranked tsvector search through the search_energy_data RPC
+            results = self._supabase_fulltext_search(search_term, fields, limit, columns)
+            if results is not None:
+                return results
             
             # Start with a base query
-            query = self.supabase.table('energy_data').select('*')
+            query = self.supabase.table('energy_data').select(self._energy_select(columns))
             
             # Build filter conditions
             if search_term.isdigit():
@@ -145,13 +651,14 @@ class DatabaseWrapper:
             return result.data
         
         else:
-            # SQLite mode
+            # SQLite mode - FTS5 index with bm25 ranking
+            results = self._sqlite_fulltext_search(search_term, fields, limit, columns)
+            if results is not None:
+                return results
+            
             cursor = self.conn.cursor()
             search_pattern = f'%{search_term}%'
             
-            if fields is None:
-                fields = ['paragraph', 'criteria', 'energy_method', 'location', 'climate', 'building_use', 'approach']
-            
             # Include ID in SQLite search
             id_condition = "CAST(id AS TEXT) LIKE ?"
             field_conditions = [f"{field} LIKE ?" for field in fields]
@@ -159,7 +666,7 @@ class DatabaseWrapper:
             params = [search_pattern] * (len(fields) + 1)
             
             sql = f"""
-                SELECT * FROM energy_data 
+                SELECT {_select_list(columns)} FROM energy_data 
                 WHERE ({' OR '.join(all_conditions)})
                 AND status != 'rejected'
                 ORDER BY id DESC
@@ -169,92 +676,166 @@ class DatabaseWrapper:
             cursor.execute(sql, params)
             return cursor.fetchall()
     
+    def _search_tokens(self, search_term):
+        """Split a search term into lowercase word tokens for full-text queries"""
+        return re.findall(r'\w+', search_term.lower())
+    
+    def _sqlite_fulltext_search(self, search_term, fields, limit, columns=None):
+        """Ranked FTS5 search; returns None when the index can't serve the query"""
+        tokens = self._search_tokens(search_term)
+        if not self.has_fts or not tokens or not set(fields) <= set(SEARCH_FIELDS):
+            return None
+        
+        # Every token must match, each as a prefix, restricted to the requested columns
+        match_expression = "{%s} : (%s)" % (' '.join(fields), ' AND '.join(f'"{t}"*' for t in tokens))
+        
+        cursor = self.conn.cursor()
+        results = []
+        if search_term.strip().isdigit():
+            cursor.execute(f"SELECT {_select_list(columns)} FROM energy_data WHERE id = ? AND status != 'rejected'", (int(search_term),))
+            results.extend(cursor.fetchall())
+        
+        cursor.execute(f"""
+            SELECT {_select_list(columns, 'energy_data.')} FROM energy_data_fts
+            JOIN energy_data ON energy_data.id = energy_data_fts.rowid
+            WHERE energy_data_fts MATCH ?
+            AND energy_data.status != 'rejected'
+            ORDER BY bm25(energy_data_fts), energy_data.id DESC
+            LIMIT ?
+        """, (match_expression, limit))
+        seen_ids = {row['id'] for row in results}
+        results.extend(row for row in cursor.fetchall() if row['id'] not in seen_ids)
+        return results[:limit]
+    
+    def _supabase_fulltext_search(self, search_term, fields, limit, columns=None):
+        """Ranked tsvector search via RPC; returns None when it can't serve the query"""
+        tokens = self._search_tokens(search_term)
+        if not tokens or set(fields) != set(SEARCH_FIELDS):
+            return None
+        
+        ts_query = ' & '.join(f"{t}:*" for t in tokens)
+        select_list = self._energy_select(columns)
+        try:
+            results = self.supabase.rpc('search_energy_data', {
+                'search_query': ts_query,
+                'max_rows': limit
+            }).select(select_list).execute().data or []
+            if search_term.strip().isdigit():
+                id_match = self.supabase.table('energy_data').select(select_list) \
+                    .eq('id', int(search_term)).not_.eq('status', 'rejected').execute().data
+                results = id_match + [r for r in results if r['id'] != int(search_term)]
+            return results[:limit]
+        except Exception as e:
+            # Function not deployed yet (see supabase/001_search_energy_data.sql)
+            print(f"⚠️ Full-text search unavailable, falling back to ilike: {e}")
+            return None
+    
+    # ============= SCHEMA MIGRATIONS =============
+    
+    def _run_migrations(self):
+        """Apply pending SQLite schema migrations in order and record each version"""
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        self.conn.commit()
+        cursor.execute("SELECT version FROM schema_migrations")
+        applied = {row[0] for row in cursor.fetchall()}
+        
+        newly_applied = 0
+        for version, name, statements in SQLITE_MIGRATIONS:
+            if version in applied:
+                continue
+            print(f"🔧 Applying schema migration {version}: {name}")
+            try:
+                cursor.execute("BEGIN")
+                for statement in statements:
+                    if callable(statement):
+                        statement(cursor)
+                    else:
+                        cursor.execute(statement)
+                cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (?, ?)", (version, name))
+                self.conn.commit()
+                newly_applied += 1
+            except sqlite3.OperationalError as e:
+                # e.g. SQLite built without FTS5 - leave it pending and carry on
+                self.conn.rollback()
+                print(f"⚠️ Schema migration {version} ({name}) not applied: {e}")
+        
+        if newly_applied:
+            self.analyze()
+    
+    def get_schema_version(self):
+        """Highest applied schema migration version (0 if none)"""
+        if self.use_supabase:
+            return None
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT MAX(version) FROM schema_migrations")
+        return cursor.fetchone()[0] or 0
+    
+    def _table_exists(self, name):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,))
+        return cursor.fetchone() is not None
+    
+    def analyze(self):
+        """Refresh the query planner statistics after bulk changes"""
+        if not self.use_supabase:
+            self._write(lambda cursor: cursor.execute("ANALYZE"))
+    
+    def _after_bulk_write(self, table, row_count):
+        """_after_write for SQLite bulk writes, running ANALYZE once ANALYZE_AFTER_ROWS rows have changed"""
+        self._after_write(table)
+        with self._analyze_lock:
+            self._bulk_rows_since_analyze += row_count
+            if self._bulk_rows_since_analyze < ANALYZE_AFTER_ROWS:
+                return
+            self._bulk_rows_since_analyze = 0
+        try:
+            self.analyze()
+        except sqlite3.Error as e:
+            # Stale statistics only cost plan quality; the write itself is done
+            print(f"⚠️ ANALYZE after bulk write failed: {e}")
+    
     def get_distinct_values(self, column, filters=None):
         """Get distinct values for a column with optional filters"""
-        if self.use_supabase:
-            query = self.supabase.table('energy_data').select(column)
-            
-            if filters:
-                for key, value in filters.items():
-                    if value:
-                        query = query.eq(key, value)
-            
-            # Add basic filters
-            query = query.not_.is_(column, 'null')
-            query = query.neq(column, '')
-            query = query.neq(column, 'Awaiting data')
-            query = query.not_.eq('status', 'rejected')
-            
-            result = query.execute()
-            
-            # Extract unique values
-            values = set()
-            for item in result.data:
-                val = item.get(column)
-                if val and str(val).strip():
-                    values.add(str(val).strip())
-            
-            return sorted(list(values))
-        else:
-            cursor = self.conn.cursor()
-            sql = f"SELECT DISTINCT {column} FROM energy_data WHERE {column} IS NOT NULL AND {column} != '' AND {column} != 'Awaiting data' AND status != 'rejected'"
-            params = []
-            
-            if filters:
-                where_clauses = []
-                for key, value in filters.items():
-                    if value:
-                        where_clauses.append(f"{key} = ?")
-                        params.append(value)
-                if where_clauses:
-                    sql += " AND " + " AND ".join(where_clauses)
-            
-            sql += f" ORDER BY {column}"
-            
-            cursor.execute(sql, params)
-            return [row[0] for row in cursor.fetchall() if row[0]]
+        value_counts = self._energy_value_counts(column, filters, exclude_values=['Awaiting data'])
+        return [value for value, count in value_counts]
     
     def get_counts_with_filters(self, group_by_column, filters=None):
         """Get counts grouped by a column with filters"""
+        return dict(self._energy_value_counts(group_by_column, filters))
+    
+    def _energy_value_counts(self, column, filters=None, exclude_values=()):
+        """
+        (value, count) pairs for a whitelisted column of non-rejected rows, ordered by value.
+        Supabase runs the energy_data_value_counts function (supabase/003_energy_data_value_counts.sql);
+        SQLite runs the same query locally through emulate_value_counts_rpc.
+        filters is a {column: value} dict, since the Postgres function takes JSON.
+        """
+        key = ('value_counts', column, normalize_filters(filters), tuple(exclude_values))
+        return self._cached('energy_data', key, lambda: self._load_value_counts(column, filters, exclude_values))
+    
+    def _load_value_counts(self, column, filters=None, exclude_values=()):
+        mirror = self._mirror_reader()
+        if mirror is not None:
+            return mirror._load_value_counts(column, filters, exclude_values)
+        params = {
+            'group_column': column,
+            'filters': {key: value for key, value in (filters or {}).items() if value},
+            'exclude_values': list(exclude_values)
+        }
         if self.use_supabase:
-            # This is more complex in Supabase - we'll fetch and count locally for now
-            query = self.supabase.table('energy_data').select('*')
-            
-            if filters:
-                for key, value in filters.items():
-                    if value:
-                        query = query.eq(key, value)
-            
-            query = query.not_.eq('status', 'rejected')
-            result = query.execute()
-            
-            # Count locally
-            counts = {}
-            for item in result.data:
-                val = item.get(group_by_column)
-                if val and str(val).strip():
-                    key = str(val).strip()
-                    counts[key] = counts.get(key, 0) + 1
-            
-            return counts
+            rows = self._execute_with_token_refresh(
+                lambda: self.supabase.rpc('energy_data_value_counts', params).execute().data
+            )
         else:
-            cursor = self.conn.cursor()
-            sql = f"SELECT {group_by_column}, COUNT(*) as count FROM energy_data WHERE {group_by_column} IS NOT NULL AND {group_by_column} != '' AND status != 'rejected'"
-            params = []
-            
-            if filters:
-                where_clauses = []
-                for key, value in filters.items():
-                    if value:
-                        where_clauses.append(f"{key} = ?")
-                        params.append(value)
-                if where_clauses:
-                    sql += " AND " + " AND ".join(where_clauses)
-            
-            sql += f" GROUP BY {group_by_column} ORDER BY {group_by_column}"
-            
-            cursor.execute(sql, params)
-            return {row[0]: row[1] for row in cursor.fetchall()}
+            rows = emulate_value_counts_rpc(self.conn, **params)
+        return [(row['value'], row['count']) for row in rows]
     
     # ============= USER METHODS =============
     
@@ -289,13 +870,10 @@ class DatabaseWrapper:
             result = self.supabase.table('users').insert(data).execute()
             return result.data
         else:
-            cursor = self.conn.cursor()
-            cursor.execute(
+            return self._write(lambda cursor: cursor.execute(
                 "INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
                 (username, hashed_password, role)
-            )
-            self.conn.commit()
-            return cursor.lastrowid
+            ).lastrowid)
     
     # ============= AUTH METHODS =============
     
@@ -304,7 +882,8 @@ class DatabaseWrapper:
         if self.use_supabase:
             try:
                 # Sign up with Supabase Auth
-                auth_response = self.supabase.auth.sign_up({
+                auth_client = self._new_auth_client()
+                auth_response = auth_client.auth.sign_up({
                     "email": email,
                     "password": password,
                     "options": {
@@ -326,7 +905,7 @@ class DatabaseWrapper:
                     }
                     
                     # Insert without password field
-                    self.supabase.table('users').insert(user_data).execute()
+                    auth_client.table('users').insert(user_data).execute()
                             
                     return {"success": True, "user": auth_response.user}
             except Exception as e:
@@ -342,15 +921,13 @@ class DatabaseWrapper:
                     return {"success": False, "error": error_str}
         else:
             # SQLite fallback (no email verification)
-            cursor = self.conn.cursor()
             try:
                 hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-                cursor.execute(
+                user_id = self._write(lambda cursor: cursor.execute(
                     "INSERT INTO users (username, password, role, email, email_confirmed) VALUES (?, ?, ?, ?, ?)",
                     (username, hashed, 'user', email, 1)
-                )
-                self.conn.commit()
-                return {"success": True, "user": {"id": cursor.lastrowid, "username": username}}
+                ).lastrowid)
+                return {"success": True, "user": {"id": user_id, "username": username}}
             except Exception as e:
                 return {"success": False, "error": str(e)}
 
@@ -361,9 +938,10 @@ class DatabaseWrapper:
         and 'user_id' (integer from the users table) if successful.
         """
         if self.use_supabase:
+            auth_client = self._new_auth_client()
             try:
                 # Try as email first
-                auth_response = self.supabase.auth.sign_in_with_password({
+                auth_response = auth_client.auth.sign_in_with_password({
                     "email": login_id,
                     "password": password
                 })
@@ -374,7 +952,7 @@ class DatabaseWrapper:
                 username = auth_user.user_metadata.get('username', login_id.split('@')[0])
 
                 # Check if user exists in your custom users table by auth_id
-                existing = self.supabase.table('users').select('*').eq('auth_id', auth_user.id).execute()
+                existing = auth_client.table('users').select('*').eq('auth_id', auth_user.id).execute()
 
                 if existing.data:
                     # User already linked – get the integer id
@@ -382,12 +960,12 @@ class DatabaseWrapper:
                     user_id = user_record['id']
                 else:
                     # No record yet – try to find by username (legacy) or create new
-                    existing_by_username = self.supabase.table('users').select('*').eq('username', login_id).execute()
+                    existing_by_username = auth_client.table('users').select('*').eq('username', login_id).execute()
                     if existing_by_username.data:
                         # Legacy user: update with auth_id and email
                         user_record = existing_by_username.data[0]
                         user_id = user_record['id']
-                        self.supabase.table('users').update({
+                        auth_client.table('users').update({
                             'auth_id': auth_user.id,
                             'email': user_email
                         }).eq('id', user_id).execute()
@@ -400,7 +978,7 @@ class DatabaseWrapper:
                             'email_confirmed': True,
                             'auth_id': auth_user.id
                         }
-                        insert_result = self.supabase.table('users').insert(user_data).execute()
+                        insert_result = auth_client.table('users').insert(user_data).execute()
                         user_id = insert_result.data[0]['id']
 
                 return {
@@ -414,17 +992,17 @@ class DatabaseWrapper:
                 error_str = str(e).lower()
                 if 'invalid login credentials' in error_str:
                     # Try to find user by username in your table
-                    user_record = self.supabase.table('users').select('*').eq('username', login_id).execute()
+                    user_record = auth_client.table('users').select('*').eq('username', login_id).execute()
                     if user_record.data and user_record.data[0].get('email'):
                         # Retry with the email
                         try:
-                            auth_response = self.supabase.auth.sign_in_with_password({
+                            auth_response = auth_client.auth.sign_in_with_password({
                                 "email": user_record.data[0]['email'],
                                 "password": password
                             })
                             auth_user = auth_response.user
                             # Now get the user_id (should exist)
-                            existing = self.supabase.table('users').select('id').eq('auth_id', auth_user.id).execute()
+                            existing = auth_client.table('users').select('id').eq('auth_id', auth_user.id).execute()
                             if existing.data:
                                 user_id = existing.data[0]['id']
                             else:
@@ -466,7 +1044,7 @@ class DatabaseWrapper:
         """Send password reset email"""
         if self.use_supabase:
             try:
-                self.supabase.auth.reset_password_for_email(email)
+                self._new_auth_client().auth.reset_password_for_email(email)
                 return {"success": True}
             except Exception as e:
                 return {"success": False, "error": str(e)}
@@ -486,7 +1064,6 @@ class DatabaseWrapper:
                     next_id = result.data[0]['id'] + 1
                 else:
                     next_id = 1  # Start at 1 if no records
-                print(f"Next ID for {table}: {next_id}")
                 return next_id
             except Exception as e:
                 print(f"Error getting next ID: {e}")
@@ -497,6 +1074,16 @@ class DatabaseWrapper:
             max_id = cursor.fetchone()[0]
             return (max_id or 0) + 1
 
+    def _allocate_ids(self, table, count=1):
+        """Ids for new Supabase rows, from the block allocator or MAX(id)+1 if it is not deployed"""
+        try:
+            return self._id_allocator.allocate(table, count)
+        except Exception as e:
+            # Function not deployed yet (see supabase/004_reserve_id_block.sql)
+            print(f"⚠️ Id block reservation unavailable, falling back to MAX(id)+1: {e}")
+            next_id = self.get_next_id(table)
+            return list(range(next_id, next_id + count))
+
     def insert_record(self, table, data):
         """Insert a new record"""
         if self.use_supabase:
@@ -508,78 +1095,385 @@ class DatabaseWrapper:
                 print(f"⚠️ Removing existing id field: {insert_data['id']}")
                 del insert_data['id']
             
-            # Get the next available ID
-            next_id = self.get_next_id(table)
+            # Take the next id from the reserved block
+            next_id = self._allocate_ids(table)[0]
             insert_data['id'] = next_id
             
-            print(f"📦 Inserting with ID: {next_id}")
-            print(f"📦 Data keys: {list(insert_data.keys())}")
-            
             try:
                 result = self.supabase.table(table).insert(insert_data).execute()
-                print(f"✅ Insert successful with ID: {next_id}")
+                self._after_write(table)
                 return result.data
             except Exception as e:
                 print(f"❌ Insert error: {e}")
-                # If there's a duplicate key error, try one more time with a new ID
+                # Only possible on the MAX(id)+1 fallback: try one more time with a new ID
                 if 'duplicate key' in str(e).lower():
-                    next_id = self.get_next_id(table)  # Get fresh ID
+                    next_id = self._allocate_ids(table)[0]  # Get fresh ID
                     insert_data['id'] = next_id
                     print(f"🔄 Retrying with new ID: {next_id}")
                     result = self.supabase.table(table).insert(insert_data).execute()
+                    self._after_write(table)
                     return result.data
                 else:
                     raise e
         else:
             # SQLite version
-            cursor = self.conn.cursor()
-            insert_data = data.copy()
-            if 'id' in insert_data:
-                del insert_data['id']
+            insert_data = _with_study_key(table, data)
+            insert_data = {k: v for k, v in insert_data.items() if k != 'id'}
                 
             columns = ', '.join(insert_data.keys())
             placeholders = ', '.join(['?' for _ in insert_data])
             values = list(insert_data.values())
             
             sql = f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
-            cursor.execute(sql, values)
-            self.conn.commit()
-            return cursor.lastrowid
+            record_id = self._write(lambda cursor: cursor.execute(sql, values).lastrowid)
+            self._after_write(table)
+            return record_id
 
     def update_record(self, table, record_id, data):
         """Update an existing record"""
         if self.use_supabase:
             result = self.supabase.table(table).update(data).eq('id', record_id).execute()
+            self._after_write(table)
             return result.data
         else:
-            cursor = self.conn.cursor()
+            data = _with_study_key(table, data)
             set_clause = ', '.join([f"{k} = ?" for k in data.keys()])
             values = list(data.values()) + [record_id]
             
             sql = f"UPDATE {table} SET {set_clause} WHERE id = ?"
-            cursor.execute(sql, values)
-            self.conn.commit()
-            return cursor.rowcount
+            rowcount = self._write(lambda cursor: cursor.execute(sql, values).rowcount)
+            self._after_write(table)
+            return rowcount
+
+    def insert_records_bulk(self, table, rows):
+        """
+        Insert many rows at once.
+        Returns {'inserted': [new ids, in input order], 'failed': [(row index, error), ...]}.
+        SQLite inserts everything in one transaction, so a failure rolls the whole batch back.
+        Supabase sends chunks of BULK_CHUNK_SIZE rows; a failing chunk is retried row by row
+        so only the rows that really fail are reported (rows already sent stay inserted).
+        """
+        rows = [{k: v for k, v in row.items() if k != 'id'} for row in rows]
+        if not rows:
+            return {'inserted': [], 'failed': []}
 
-    def get_non_rejected_records(self, limit=5000):
+        if self.use_supabase:
+            inserted, failed = [], []
+            ids = self._allocate_ids(table, len(rows))
+            for start in range(0, len(rows), BULK_CHUNK_SIZE):
+                chunk = [dict(row, id=ids[start + i]) for i, row in enumerate(rows[start:start + BULK_CHUNK_SIZE])]
+                try:
+                    # default_to_null=False: columns missing from a row keep their default
+                    self.supabase.table(table).insert(chunk, default_to_null=False).execute()
+                    inserted.extend(row['id'] for row in chunk)
+                except Exception as e:
+                    print(f"⚠️ Bulk insert chunk at row {start} failed, retrying row by row: {e}")
+                    for i, row in enumerate(chunk):
+                        try:
+                            result = self.insert_record(table, row)
+                            inserted.append(result[0]['id'] if result else None)
+                        except Exception as row_error:
+                            failed.append((start + i, str(row_error)))
+            self._after_write(table)
+            return {'inserted': inserted, 'failed': failed}
+
+        rows = [_with_study_key(table, row) for row in rows]
+        try:
+            new_ids = self._write(lambda cursor: _sqlite_insert_rows(cursor, table, rows))
+        except Exception as e:
+            return {'inserted': [], 'failed': [(i, str(e)) for i in range(len(rows))]}
+        self._after_bulk_write(table, len(rows))
+        return {'inserted': new_ids, 'failed': []}
+
+    def update_records_bulk(self, table, updates):
+        """
+        Apply many updates given as [(record_id, {column: value}), ...].
+        Returns {'updated': [ids], 'failed': [(record_id, error), ...]}; ids that match
+        no row are reported as failed with MISSING_RECORD_ERROR, never created.
+        SQLite applies everything in one transaction, so a failure rolls the whole batch back.
+        Supabase sends one UPDATE ... WHERE id IN per group of identical fields (per
+        BULK_CHUNK_SIZE ids); a failing request is retried row by row and only the
+        failing rows are reported.
+        """
+        updates = [(record_id, fields) for record_id, fields in updates if fields]
+        if not updates:
+            return {'updated': [], 'failed': []}
+
+        if self.use_supabase:
+            updated, failed = [], []
+            for fields, record_ids in _group_by_values(updates):
+                for start in range(0, len(record_ids), BULK_CHUNK_SIZE):
+                    chunk = record_ids[start:start + BULK_CHUNK_SIZE]
+                    try:
+                        result = self.supabase.table(table).update(fields).in_('id', chunk).execute()
+                        matched = {row['id'] for row in result.data}
+                    except Exception as e:
+                        print(f"⚠️ Bulk update chunk failed, retrying row by row: {e}")
+                        matched, errors = set(), {}
+                        for record_id in chunk:
+                            try:
+                                result = self.supabase.table(table).update(fields).eq('id', record_id).execute()
+                                matched.update(row['id'] for row in result.data)
+                            except Exception as row_error:
+                                errors[record_id] = str(row_error)
+                        failed.extend(errors.items())
+                        chunk = [record_id for record_id in chunk if record_id not in errors]
+                    for record_id in chunk:
+                        if record_id in matched:
+                            updated.append(record_id)
+                        else:
+                            failed.append((record_id, MISSING_RECORD_ERROR))
+            self._after_write(table)
+            return {'updated': updated, 'failed': failed}
+
+        updates = [(record_id, _with_study_key(table, fields)) for record_id, fields in updates]
+
+        def update_all(cursor):
+            # Ids are checked up front: executemany's rowcount is a total, not per id
+            record_ids = list(dict.fromkeys(record_id for record_id, _ in updates))
+            existing = set()
+            for start in range(0, len(record_ids), BULK_CHUNK_SIZE):
+                chunk = record_ids[start:start + BULK_CHUNK_SIZE]
+                cursor.execute(
+                    f"SELECT id FROM {table} WHERE id IN ({', '.join('?' for _ in chunk)})", chunk
+                )
+                existing.update(row[0] for row in cursor.fetchall())
+            found = [(record_id, fields) for record_id, fields in updates if record_id in existing]
+            for columns, group in _group_by_columns(found).items():
+                set_clause = ', '.join(f"{column} = ?" for column in columns)
+                cursor.executemany(
+                    f"UPDATE {table} SET {set_clause} WHERE id = ?",
+                    [tuple(fields.values()) + (record_id,) for record_id, fields in group]
+                )
+            return existing
+
+        try:
+            existing = self._write(update_all)
+        except Exception as e:
+            return {'updated': [], 'failed': [(record_id, str(e)) for record_id, _ in updates]}
+        updated = [record_id for record_id, _ in updates if record_id in existing]
+        failed = [(record_id, MISSING_RECORD_ERROR) for record_id, _ in updates if record_id not in existing]
+        self._after_bulk_write(table, len(updated))
+        return {'updated': updated, 'failed': failed}
+
+    def delete_record(self, table, record_id):
+        """Delete a record by id"""
+        if self.use_supabase:
+            result = self.supabase.table(table).delete().eq('id', record_id).execute()
+            self._after_write(table)
+            return result.data
+        else:
+            rowcount = self._write(lambda cursor: cursor.execute(f"DELETE FROM {table} WHERE id = ?", (record_id,)).rowcount)
+            self._after_write(table)
+            return rowcount
+
+    def delete_records_bulk(self, table, record_ids):
+        """
+        Delete many records by id.
+        Returns {'deleted': [ids], 'failed': [(record_id, error), ...]}.
+        SQLite deletes everything in one transaction; Supabase sends one request per
+        BULK_CHUNK_SIZE ids and reports the ids of any chunk that fails.
+        """
+        record_ids = list(record_ids)
+        if not record_ids:
+            return {'deleted': [], 'failed': []}
+
+        if self.use_supabase:
+            deleted, failed = [], []
+            for start in range(0, len(record_ids), BULK_CHUNK_SIZE):
+                chunk = record_ids[start:start + BULK_CHUNK_SIZE]
+                try:
+                    self.supabase.table(table).delete().in_('id', chunk).execute()
+                    deleted.extend(chunk)
+                except Exception as e:
+                    failed.extend((record_id, str(e)) for record_id in chunk)
+            self._after_write(table)
+            return {'deleted': deleted, 'failed': failed}
+
+        try:
+            self._write(lambda cursor: cursor.executemany(
+                f"DELETE FROM {table} WHERE id = ?", [(record_id,) for record_id in record_ids]
+            ))
+        except Exception as e:
+            return {'deleted': [], 'failed': [(record_id, str(e)) for record_id in record_ids]}
+        self._after_bulk_write(table, len(record_ids))
+        return {'deleted': record_ids, 'failed': []}
+
+    def replace_records(self, table, replacements):
+        """
+        Replace records with new rows, given as {original_id: [row, ...]}.
+        Each original's delete-plus-inserts is applied as one unit, so a record is never
+        lost or duplicated. Returns {'replaced': {original_id: [new ids]}, 'failed': [(original_id, error), ...]}.
+        SQLite runs every unit in its own savepoint of the writer's batched transaction.
+        Supabase has no multi-request transactions: the new rows are inserted first and the
+        original is deleted only if that worked; if the delete fails the new rows are removed again.
+        """
+        replaced, failed = {}, []
+        replacements = {
+            original_id: [{k: v for k, v in row.items() if k != 'id'} for row in rows]
+            for original_id, rows in replacements.items()
+        }
+        if not replacements:
+            return {'replaced': replaced, 'failed': failed}
+
+        if self.use_supabase:
+            for original_id, rows in replacements.items():
+                inserted = self.insert_records_bulk(table, rows)
+                new_ids = [new_id for new_id in inserted['inserted'] if new_id is not None]
+                if inserted['failed']:
+                    self.delete_records_bulk(table, new_ids)
+                    failed.append((original_id, inserted['failed'][0][1]))
+                    continue
+                try:
+                    self.supabase.table(table).delete().eq('id', original_id).execute()
+                    replaced[original_id] = new_ids
+                except Exception as e:
+                    self.delete_records_bulk(table, new_ids)
+                    failed.append((original_id, str(e)))
+        else:
+            def replace_job(original_id, rows):
+                rows = [_with_study_key(table, row) for row in rows]
+
+                def job(cursor):
+                    cursor.execute(f"DELETE FROM {table} WHERE id = ?", (original_id,))
+                    return _sqlite_insert_rows(cursor, table, rows)
+                return job
+
+            futures = {
+                original_id: self._writer.submit(replace_job(original_id, rows))
+                for original_id, rows in replacements.items()
+            }
+            for original_id, future in futures.items():
+                try:
+                    replaced[original_id] = future.result()
+                except Exception as e:
+                    failed.append((original_id, str(e)))
+            self._after_bulk_write(table, sum(len(new_ids) + 1 for new_ids in replaced.values()))
+            return {'replaced': replaced, 'failed': failed}
+
+        self._after_write(table)
+        return {'replaced': replaced, 'failed': failed}
+
+    def get_non_rejected_records(self, limit=5000, columns=None):
         """Get all records that are not rejected (includes NULL, approved, pending)"""
+        if limit is None:
+            # No cap - stream every page
+            return list(self.iter_energy_data(columns=columns, exclude_rejected=True, prefetch=True))
+        key = ('get_non_rejected_records', limit, tuple(columns) if columns else None)
+        return self._cached('energy_data', key, lambda: to_energy_records(self._load_non_rejected_records(limit, columns)))
+    
+    def _load_non_rejected_records(self, limit, columns=None):
+        mirror = self._mirror_reader()
+        if mirror is not None:
+            return mirror._load_non_rejected_records(limit, columns)
+        spec = FilterSpec().not_rejected()
         if self.use_supabase:
-            # In Supabase, we need to use OR condition for status != 'rejected' OR status IS NULL
-            query = self.supabase.table('energy_data').select('*')
-            query = query.or_('status.neq.rejected,status.is.null')
+            query = spec.apply(self.supabase.table('energy_data').select(self._energy_select(columns)))
             if limit:
                 query = query.limit(limit)
             result = query.execute()
             return result.data
         else:
             cursor = self.conn.cursor()
-            cursor.execute("""
-                SELECT * FROM energy_data 
-                WHERE status != 'rejected' OR status IS NULL
-                LIMIT ?
-            """, (limit,))
+            sql, params = spec.select_sql(_select_list(columns), limit=limit)
+            cursor.execute(sql, params)
             return cursor.fetchall()
 
+    def get_facet_counts(self):
+        """
+        {facet: {value: (record_count, study_count)}} over non-rejected records, read from the
+        materialized energy_facet_counts table (facets in facet_counts.FACETS). The 'records'
+        facet holds the totals under the value 'all'.
+        """
+        return self._cached('energy_data', ('get_facet_counts',), self._load_facet_counts)
+
+    def _load_facet_counts(self):
+        mirror = self._mirror_reader()
+        if mirror is not None:
+            return mirror._load_facet_counts()
+        if self.use_supabase:
+            self._refresh_facet_counts()
+            rows = self._execute_with_token_refresh(
+                lambda: self.supabase.table('energy_facet_counts')
+                .select('facet,value,record_count,study_count').execute().data
+            )
+        else:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT facet, value, record_count, study_count FROM energy_facet_counts")
+            rows = cursor.fetchall()
+        return group_facet_counts(rows)
+
+    def _refresh_facet_counts(self):
+        """Refresh the Supabase materialized view after our own writes or once it is old"""
+        refreshed = self._facets_refreshed
+        if (refreshed is not None and refreshed[0] == _write_count
+                and time.monotonic() - refreshed[1] < FACET_REFRESH_INTERVAL):
+            return
+        write_count = _write_count
+        try:
+            self.supabase.rpc('refresh_energy_facet_counts', {}).execute()
+            self._facets_refreshed = (write_count, time.monotonic())
+        except Exception as e:
+            # Function not deployed yet (see supabase/007_energy_facet_counts.sql)
+            print(f"⚠️ Facet count refresh failed, serving the last refresh: {e}")
+
+    def get_facet_study_keys(self, facet):
+        """
+        {value: tuple of study keys} over non-rejected records for one facet of facet_counts.FACETS,
+        for views that merge several raw values into one and must count each study once.
+        None when Supabase can't provide them yet (supabase/006 or 007 not applied).
+        """
+        if facet not in FACETS or facet == 'records':
+            raise ValueError(f"Unknown facet: {facet}")
+        return self._cached('energy_data', ('get_facet_study_keys', facet),
+                            lambda: self._load_facet_study_keys(facet))
+    
+    def _load_facet_study_keys(self, facet):
+        mirror = self._mirror_reader()
+        if mirror is not None:
+            return mirror._load_facet_study_keys(facet)
+        if self.use_supabase:
+            if 'study_key' in self._remote_columns_missing():
+                return None
+            # Read from the materialized members, not energy_data, so the cost doesn't grow with the table
+            self._refresh_facet_counts()
+            try:
+                keys = self._execute_with_token_refresh(
+                    lambda: self.supabase.rpc('energy_facet_study_keys', {'facet_name': facet}).execute().data
+                )
+            except Exception as e:
+                # Function not deployed yet (see supabase/007_energy_facet_counts.sql)
+                print(f"⚠️ Facet study keys unavailable, counting records instead: {e}")
+                return None
+            return {value: tuple(value_keys) for value, value_keys in (keys or {}).items()}
+        # The facet count triggers keep one member row per (facet, value, study)
+        keys = {}
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "SELECT value, study_key FROM energy_facet_members WHERE facet = ? AND study_key != ''", (facet,)
+        )
+        for value, key in cursor.fetchall():
+            keys.setdefault(value, []).append(key)
+        return {value: tuple(value_keys) for value, value_keys in keys.items()}
+    
+    def get_paragraphs(self, record_ids):
+        """Fetch paragraph text for the given record ids as {id: paragraph}"""
+        record_ids = [int(record_id) for record_id in record_ids]
+        if not record_ids:
+            return {}
+        mirror = self._mirror_reader()
+        if mirror is not None:
+            return mirror.get_paragraphs(record_ids)
+        if self.use_supabase:
+            result = self.supabase.table('energy_data').select('id,paragraph').in_('id', record_ids).execute()
+            rows = result.data
+        else:
+            cursor = self.conn.cursor()
+            placeholders = ', '.join('?' for _ in record_ids)
+            cursor.execute(f"SELECT id, paragraph FROM energy_data WHERE id IN ({placeholders})", record_ids)
+            rows = cursor.fetchall()
+        return {row['id']: row['paragraph'] for row in rows}
+
     def save_analysis(self, user_id, analysis_type, determinant, top_energy, bottom_energy, html, top_sorted=None, bottom_sorted=None, top_height=0, bottom_height=0):
         """Save a user's analysis to the database"""
         data = {
@@ -599,6 +1493,10 @@ class DatabaseWrapper:
 
     def get_user_analyses(self, user_id):
         """Get all analyses saved by a user"""
+        return self._cached('user_saved_analyses', ('get_user_analyses', user_id),
+                            lambda: self._load_user_analyses(user_id))
+    
+    def _load_user_analyses(self, user_id):
         if self.use_supabase:
             response = self.supabase.table('user_saved_analyses') \
                 .select('*') \
@@ -625,21 +1523,23 @@ class DatabaseWrapper:
                 .eq('id', analysis_id) \
                 .execute()
         else:
-            cursor = self.conn.cursor()
-            cursor.execute('DELETE FROM user_saved_analyses WHERE id = ?', (analysis_id,))
-            self.conn.commit()
+            self._write(lambda cursor: cursor.execute('DELETE FROM user_saved_analyses WHERE id = ?', (analysis_id,)))
+        self._after_write('user_saved_analyses')
 
 
     # ============= HELPER METHODS =============
     
-    @lru_cache(maxsize=128)
-    def get_cached_distinct(self, column, filter_hash=""):
-        """Cached version of get_distinct_values for performance"""
-        return self.get_distinct_values(column)
-    
     def close(self):
+        if self._mirror is not None:
+            self._mirror.close()
+            self._mirror.db.close()
         if not self.use_supabase:
-            self.conn.close()
+            self._writer.close()
+            with self._connections_lock:
+                for conn in self._connections.values():
+                    conn.close()
+                self._connections.clear()
+            self._local = threading.local()
     
     def __enter__(self):
         return self
@@ -7,6 +7,7 @@ from collections import Counter
 import re
 import base64
 import hashlib
+from energy_snapshot import get_energy_snapshot
 from color_schemes import (
     get_climate_color,
     get_scale_color,
@@ -31,7 +32,7 @@ if 'analyses_list' not in st.session_state:
     
 def analyze_determinant_pair(db_connection, determinant, top_keywords, bottom_keywords):
     """Analyze a determinant against two energy output categories"""
-    all_records = db_connection.get_energy_data(limit=5000)
+    all_records = get_energy_snapshot(db_connection).records
     
     top_records = []
     bottom_records = []
@@ -102,7 +103,7 @@ def render_frequency_analysis(db_connection):
         st.session_state.saved_visuals = []
     
     # Get all determinants with counts
-    all_records = db_connection.get_energy_data(limit=5000)
+    all_records = get_energy_snapshot(db_connection).records
     
     # Count determinants
     determinant_counts = {}
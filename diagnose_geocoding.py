@@ -9,7 +9,7 @@ print("🚀 Starting geocoding diagnosis...")
 
 # Initialize
 db = DatabaseWrapper()
-all_records = db.get_energy_data(limit=5000)
+all_records = db.iter_energy_data(columns=['location'])
 
 # Get unique locations
 locations = set()
@@ -0,0 +1,320 @@
+# energy_mirror.py
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from energy_record import study_key
+
+MIRROR_DB_PATH = 'energy_mirror.db'
+
+# Background delta sync period, and the oldest data a read will accept before syncing itself
+MIRROR_SYNC_INTERVAL = 10.0
+MIRROR_MAX_STALENESS = 30.0
+
+# updated_at is taken when a statement starts, so a slow transaction can commit a row
+# older than rows already seen; every delta re-reads this far behind the watermark
+MIRROR_SYNC_OVERLAP = timedelta(seconds=60)
+
+# Without the deletions log (supabase/005_energy_data_updated_at.sql) deletes are
+# only picked up by a periodic full resync
+MIRROR_FULL_RESYNC_INTERVAL = 3600.0
+
+MIRROR_PAGE_SIZE = 1000
+
+
+def create_mirror_schema(db_path, columns):
+    """
+    Create the mirror's energy_data table (untyped columns keep values exactly as
+    PostgREST returns them) and its sync state table.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        column_list = ', '.join(c for c in columns if c != 'id')
+        conn.execute(f"CREATE TABLE IF NOT EXISTS energy_data (id INTEGER PRIMARY KEY, {column_list}, updated_at)")
+        conn.execute("CREATE TABLE IF NOT EXISTS mirror_state (key TEXT PRIMARY KEY, value TEXT)")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+class EnergyMirror:
+    """
+    Local SQLite copy of the Supabase energy_data table.
+    A background thread pulls deltas: rows whose updated_at moved past the watermark
+    (or, before the updated_at migration, rows past the highest id) plus ids from the
+    energy_data_deletions log. Reads go to `db`, a SQLite-mode DatabaseWrapper over the copy.
+    """
+
+    def __init__(self, client, db, columns, on_change=None,
+                 max_staleness=MIRROR_MAX_STALENESS, sync_interval=MIRROR_SYNC_INTERVAL):
+        self.client = client
+        self.db = db
+        self.columns = list(columns)
+        self.on_change = on_change
+        self.max_staleness = max_staleness
+        self.sync_interval = sync_interval
+
+        self.has_updated_at = True
+        self.has_deletions_log = True
+        self.has_study_key = True
+        self._columns_probed = False
+        self.synced_at = None  # monotonic time of the last successful sync
+        self._sync_lock = threading.Lock()
+        self._state = self._load_state()
+
+        try:
+            self.sync()
+        except Exception as e:
+            print(f"⚠️ Initial mirror sync failed, reading from Supabase until it succeeds: {e}")
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="energy-mirror-sync", daemon=True)
+        self._thread.start()
+
+    # ============= READS =============
+
+    def reader(self):
+        """The local reader, synced first if older than max_staleness; None until the first sync succeeds"""
+        if self.is_stale():
+            with self._sync_lock:
+                if self.is_stale():
+                    try:
+                        self._sync_locked(full=False)
+                    except Exception as e:
+                        print(f"⚠️ Mirror sync failed, serving stale data: {e}")
+        return self.db if self.synced_at is not None else None
+
+    def is_stale(self):
+        return self.synced_at is None or time.monotonic() - self.synced_at > self.max_staleness
+
+    def status(self):
+        """Age of the local copy and how deltas are detected, for the admin sidebar"""
+        return {
+            'age': None if self.synced_at is None else time.monotonic() - self.synced_at,
+            'updated_watermark': self._state.get('updated_watermark'),
+            'has_updated_at': self.has_updated_at,
+            'has_deletions_log': self.has_deletions_log,
+            'has_study_key': self.has_study_key,
+        }
+
+    # ============= SYNC =============
+
+    def sync(self, full=False):
+        """Pull changes from Supabase now; full=True reloads the whole table"""
+        with self._sync_lock:
+            self._sync_locked(full)
+
+    def close(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.sync_interval):
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"⚠️ Mirror sync failed: {e}")
+
+    def _sync_locked(self, full):
+        if not self._columns_probed:
+            self._probe_columns()
+        last_full = float(self._state.get('full_synced_at') or 0)
+        needs_full = (
+            full
+            or not last_full
+            or (not self.has_deletions_log and time.time() - last_full > MIRROR_FULL_RESYNC_INTERVAL)
+        )
+        changed = self._full_sync() if needs_full else self._delta_sync()
+        self.synced_at = time.monotonic()
+        if changed:
+            # The reader's own cache and energy_data version, then the owner's
+            self.db._after_write('energy_data')
+            if self.on_change:
+                self.on_change()
+
+    def _full_sync(self):
+        rows = self._fetch_rows(lambda query: query)
+        state = {'full_synced_at': str(time.time())}
+        state.update(self._watermarks(rows))
+        if self.has_deletions_log:
+            latest = self._fetch_deletions(None, latest_only=True)
+            if latest:
+                state['deleted_watermark'] = latest[0]['deleted_at']
+
+        def replace_all(cursor):
+            cursor.execute("DELETE FROM energy_data")
+            self._upsert(cursor, rows)
+            self._save_state(cursor, state)
+
+        self.db._write(replace_all)
+        self._state.update(state)
+        print(f"🪞 Mirror full sync: {len(rows)} records")
+        return True
+
+    def _delta_sync(self):
+        if self.has_updated_at:
+            since = _before(self._state.get('updated_watermark'), MIRROR_SYNC_OVERLAP)
+            rows = self._fetch_rows(lambda query: query.gte('updated_at', since) if since else query)
+        else:
+            max_id = int(self._state.get('max_id') or 0)
+            rows = self._fetch_rows(lambda query: query.gt('id', max_id))
+
+        deleted_ids = []
+        state = self._watermarks(rows)
+        if self.has_deletions_log:
+            since = _before(self._state.get('deleted_watermark'), MIRROR_SYNC_OVERLAP)
+            deletions = self._fetch_deletions(since)
+            deleted_ids = [row['id'] for row in deletions]
+            if deletions:
+                state['deleted_watermark'] = max((row['deleted_at'] for row in deletions), key=datetime.fromisoformat)
+
+        rows = self._changed_rows(rows)
+        deleted_ids = self._local_ids(deleted_ids)
+        if not rows and not deleted_ids:
+            if state:
+                self.db._write(lambda cursor: self._save_state(cursor, state))
+                self._state.update(state)
+            return False
+
+        def apply_delta(cursor):
+            self._upsert(cursor, rows)
+            cursor.executemany("DELETE FROM energy_data WHERE id = ?", [(record_id,) for record_id in deleted_ids])
+            self._save_state(cursor, state)
+
+        self.db._write(apply_delta)
+        self._state.update(state)
+        print(f"🪞 Mirror delta sync: {len(rows)} changed, {len(deleted_ids)} deleted")
+        return True
+
+    # ============= SUPABASE =============
+
+    def _probe_columns(self):
+        """Detect whether the updated_at (005) and study_key (006) migrations have been applied"""
+        while True:
+            try:
+                self.client.table('energy_data').select(self._select()).limit(1).execute()
+                break
+            except Exception as e:
+                if self.has_updated_at and 'updated_at' in str(e):
+                    # Migration not applied yet - fall back to id watermarks
+                    print("⚠️ energy_data.updated_at missing, mirror syncs new ids only")
+                    self.has_updated_at = False
+                elif self.has_study_key and 'study_key' in str(e):
+                    # Migration not applied yet - compute the keys locally
+                    print("⚠️ energy_data.study_key missing, mirror computes study keys itself")
+                    self.has_study_key = False
+                else:
+                    raise
+        self._columns_probed = True
+
+    def _remote_columns(self):
+        return [c for c in self.columns if c != 'study_key' or self.has_study_key]
+
+    def _select(self):
+        columns = self._remote_columns() + (['updated_at'] if self.has_updated_at else [])
+        return ','.join(columns)
+
+    def _fetch_rows(self, apply_filter):
+        """All rows matching the filter, by keyset pages on id"""
+        rows = []
+        last_id = 0
+        while True:
+            query = apply_filter(self.client.table('energy_data').select(self._select()))
+            page = query.gt('id', last_id).order('id').limit(MIRROR_PAGE_SIZE).execute().data
+            if not self.has_study_key and 'study_key' in self.columns:
+                for row in page:
+                    row['study_key'] = study_key(row.get('paragraph'))
+            rows.extend(page)
+            if len(page) < MIRROR_PAGE_SIZE:
+                return rows
+            last_id = page[-1]['id']
+
+    def _fetch_deletions(self, since, latest_only=False):
+        try:
+            query = self.client.table('energy_data_deletions').select('id,deleted_at')
+            if since:
+                query = query.gte('deleted_at', since)
+            if latest_only:
+                query = query.order('deleted_at', desc=True).limit(1)
+            return query.execute().data
+        except Exception as e:
+            if 'energy_data_deletions' not in str(e):
+                raise
+            print(f"⚠️ energy_data_deletions unavailable, deletes sync hourly by full resync: {e}")
+            self.has_deletions_log = False
+            return []
+
+    # ============= LOCAL =============
+
+    def _changed_rows(self, rows):
+        """Drop rows the mirror already holds unchanged (the overlap window re-reads some)"""
+        if not rows:
+            return rows
+        local = {}
+        conn = self.db.conn
+        ids = [row['id'] for row in rows]
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            cursor = conn.execute(
+                f"SELECT * FROM energy_data WHERE id IN ({', '.join('?' for _ in chunk)})", chunk
+            )
+            local.update((row['id'], dict(row)) for row in cursor.fetchall())
+
+        def unchanged(row):
+            current = local.get(row['id'])
+            return current is not None and all(current.get(k) == v for k, v in row.items())
+
+        return [row for row in rows if not unchanged(row)]
+
+    def _local_ids(self, ids):
+        if not ids:
+            return []
+        conn = self.db.conn
+        found = set()
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            cursor = conn.execute(
+                f"SELECT id FROM energy_data WHERE id IN ({', '.join('?' for _ in chunk)})", chunk
+            )
+            found.update(row[0] for row in cursor.fetchall())
+        return [record_id for record_id in ids if record_id in found]
+
+    def _upsert(self, cursor, rows):
+        """Insert or update rows in place, so the FTS update triggers fire"""
+        if not rows:
+            return
+        columns = list(rows[0].keys())
+        updates = ', '.join(f"{c} = excluded.{c}" for c in columns if c != 'id')
+        cursor.executemany(
+            f"INSERT INTO energy_data ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)}) "
+            f"ON CONFLICT(id) DO UPDATE SET {updates}",
+            [tuple(row.get(c) for c in columns) for row in rows]
+        )
+
+    def _watermarks(self, rows):
+        state = {}
+        if rows:
+            state['max_id'] = str(max(max(row['id'] for row in rows), int(self._state.get('max_id') or 0)))
+            stamps = [row['updated_at'] for row in rows if row.get('updated_at')]
+            if self._state.get('updated_watermark'):
+                stamps.append(self._state['updated_watermark'])
+            if stamps:
+                state['updated_watermark'] = max(stamps, key=datetime.fromisoformat)
+        return state
+
+    def _load_state(self):
+        cursor = self.db.conn.execute("SELECT key, value FROM mirror_state")
+        return {row[0]: row[1] for row in cursor.fetchall()}
+
+    def _save_state(self, cursor, state):
+        cursor.executemany(
+            "INSERT INTO mirror_state (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            list(state.items())
+        )
+
+
+def _before(timestamp, delta):
+    """ISO timestamp moved back by delta (None stays None)"""
+    if not timestamp:
+        return None
+    return (datetime.fromisoformat(timestamp) - delta).isoformat()
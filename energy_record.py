@@ -0,0 +1,179 @@
+# energy_record.py
+import hashlib
+import re
+import sys
+
+# energy_data schema, used to validate column projections
+ENERGY_DATA_COLUMNS = (
+    'id', 'group_id', 'criteria', 'energy_method', 'direction', 'paragraph', 'status', 'user',
+    'scale', 'climate', 'location', 'building_use', 'climate_multi', 'approach', 'sample_size',
+    'study_key'
+)
+
+# Paragraph values that mean "no study text"
+EMPTY_PARAGRAPHS = ('', '0', '0.0')
+
+# Whitespace study_text collapses (the str.isspace() set, NBSP included), spelled out so that
+# energy_data_study_key() in supabase/006_energy_data_study_key.sql uses the same class text;
+# Postgres' \s would leave NBSP and the other Unicode spaces alone
+STUDY_WHITESPACE_CLASS = r'[\u0009-\u000d\u001c-\u0020\u0085\u00a0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000]'
+_STUDY_WHITESPACE = re.compile(STUDY_WHITESPACE_CLASS + '+')
+
+# Low-cardinality text columns: every row shares one copy of each distinct value
+INTERNED_COLUMNS = frozenset(ENERGY_DATA_COLUMNS) - {'id', 'paragraph'}
+
+
+class _Layout:
+    """How to copy one column order (a query's projection) into record slots"""
+
+    __slots__ = ('fields', 'steps')
+
+    def __init__(self, columns):
+        known = [(position, column) for position, column in enumerate(columns) if column in _SLOT_SETTERS]
+        self.fields = tuple(column for _, column in known)
+        self.steps = tuple(
+            (position, _SLOT_SETTERS[column], column in INTERNED_COLUMNS) for position, column in known
+        )
+
+
+_layouts = {}
+
+
+def _layout(columns):
+    layout = _layouts.get(columns)
+    if layout is None:
+        layout = _layouts[columns] = _Layout(columns)
+    return layout
+
+
+class EnergyRecord:
+    """
+    One energy_data row, identical for both backends.
+    Fields are slots (record.criteria), categorical values are interned strings, and the
+    read-only mapping interface (record['id'], record.get('scale'), dict(record)) is kept
+    for existing callers. Only the columns the query selected are present.
+    Records are immutable: the snapshot and the query cache share them between sessions,
+    so edits go through copy() (a plain dict).
+    """
+
+    __slots__ = ENERGY_DATA_COLUMNS + ('_fields',)
+
+    @classmethod
+    def from_values(cls, columns, values):
+        """Build a record from a column-name tuple and matching values (unknown columns are dropped)"""
+        layout = _layout(columns)
+        record = cls.__new__(cls)
+        _set_fields(record, layout.fields)
+        for position, set_slot, intern in layout.steps:
+            value = values[position]
+            if intern and value.__class__ is str:
+                value = sys.intern(value)
+            set_slot(record, value)
+        return record
+
+    @classmethod
+    def from_mapping(cls, mapping):
+        """Build a record from a dict (PostgREST JSON row)"""
+        return cls.from_values(tuple(mapping), tuple(mapping.values()))
+
+    # ============= MAPPING COMPATIBILITY =============
+
+    def get(self, key, default=None):
+        if key in self._fields:
+            return getattr(self, key)
+        return default
+
+    def __getitem__(self, key):
+        if key not in self._fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self._fields
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def keys(self):
+        return self._fields
+
+    def values(self):
+        return [getattr(self, field) for field in self._fields]
+
+    def items(self):
+        return [(field, getattr(self, field)) for field in self._fields]
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self._fields}
+
+    def copy(self):
+        """Mutable dict copy, for callers that edit a row"""
+        return self.to_dict()
+
+    def __setattr__(self, name, value):
+        raise AttributeError("EnergyRecord is read-only; edit record.copy() instead")
+
+    def __delattr__(self, name):
+        raise AttributeError("EnergyRecord is read-only; edit record.copy() instead")
+
+    def __eq__(self, other):
+        if isinstance(other, EnergyRecord):
+            return self._fields == other._fields and self.values() == other.values()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"EnergyRecord({self.to_dict()!r})"
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        layout = _layout(tuple(state))
+        _set_fields(self, layout.fields)
+        values = tuple(state.values())
+        for position, set_slot, _ in layout.steps:
+            set_slot(self, values[position])
+
+
+def study_text(paragraph):
+    """A paragraph lower-cased with whitespace collapsed: the text a study key is taken from"""
+    return _STUDY_WHITESPACE.sub(' ', str(paragraph)).strip(' ').lower()
+
+
+def study_key(paragraph):
+    """
+    Study identity of a paragraph: md5 of its study_text, None for empty paragraphs.
+    Same as energy_data_study_key() in supabase/006_energy_data_study_key.sql.
+    """
+    if paragraph is None:
+        return None
+    text = study_text(paragraph)
+    if text in EMPTY_PARAGRAPHS:
+        return None
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+# Slot descriptors' setters bypass the read-only __setattr__
+_SLOT_SETTERS = {column: getattr(EnergyRecord, column).__set__ for column in ENERGY_DATA_COLUMNS}
+_set_fields = EnergyRecord._fields.__set__
+
+
+def to_energy_records(rows):
+    """EnergyRecords from sqlite3.Row results, PostgREST dicts or records already converted"""
+    if not rows:
+        return []
+    first = rows[0]
+    if isinstance(first, EnergyRecord):
+        return list(rows)
+    if isinstance(first, dict):
+        return [EnergyRecord.from_mapping(row) for row in rows]
+    # sqlite3.Row: one column tuple for the whole result
+    columns = tuple(first.keys())
+    return [EnergyRecord.from_values(columns, tuple(row)) for row in rows]
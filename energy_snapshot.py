@@ -0,0 +1,145 @@
+# energy_snapshot.py
+import threading
+import time
+import numpy as np
+
+# Categorical columns that get dictionary-encoded. paragraph is kept only in
+# the row dicts because it is free text and never used as a filter.
+CATEGORICAL_COLUMNS = (
+    'criteria', 'energy_method', 'direction', 'status', 'user', 'scale',
+    'climate', 'location', 'building_use', 'approach', 'sample_size',
+    'group_id', 'climate_multi'
+)
+
+# How long a snapshot is trusted before the (cheap) data version is re-checked.
+# Writes made through DatabaseWrapper bypass this and refresh immediately.
+VERSION_CHECK_INTERVAL = 5.0
+
+MISSING_CODE = -1
+
+
+class EnergySnapshot:
+    """Read-only, columnar copy of energy_data shared by every session"""
+
+    def __init__(self, records, version):
+        # EnergyRecords from either backend: slotted rows with interned categorical values
+        self.records = list(records)
+        self.version = version
+        self.loaded_at = time.time()
+        self.checked_at = time.monotonic()
+
+        self.ids = np.fromiter((r['id'] for r in self.records), dtype=np.int64, count=len(self.records))
+        self.id_index = {int(record_id): row for row, record_id in enumerate(self.ids)}
+
+        self.categories = {}   # column -> list of distinct values (code -> value)
+        self.value_codes = {}  # column -> {value: code}
+        self.codes = {}        # column -> int32 array, MISSING_CODE for NULL/''
+        for column in CATEGORICAL_COLUMNS:
+            self._encode_column(column)
+
+        # Every render path starts with "status != 'rejected'" (NULL included)
+        self.valid_mask = self.codes['status'] != self.value_codes['status'].get('rejected', -2)
+
+    def __len__(self):
+        return len(self.records)
+
+    def _encode_column(self, column):
+        """Dictionary-encode one column into an int32 code array"""
+        lookup = {}
+        values = []
+        codes = np.empty(len(self.records), dtype=np.int32)
+        for row, record in enumerate(self.records):
+            value = record.get(column)
+            if value is None or value == '':
+                codes[row] = MISSING_CODE
+                continue
+            code = lookup.get(value)
+            if code is None:
+                code = len(values)
+                lookup[value] = code
+                values.append(value)
+            codes[row] = code
+        self.categories[column] = values
+        self.value_codes[column] = lookup
+        self.codes[column] = codes
+
+    # ============= LOOKUPS =============
+
+    def get(self, record_id):
+        """Get a single record by id, or None"""
+        row = self.id_index.get(int(record_id))
+        return self.records[row] if row is not None else None
+
+    def codes_for(self, column, values, case_insensitive=False):
+        """Translate values into the codes used by a column (unknown values are dropped)"""
+        if case_insensitive:
+            wanted = {str(v).upper() for v in values}
+            return [code for code, value in enumerate(self.categories[column]) if str(value).upper() in wanted]
+        lookup = self.value_codes[column]
+        return [lookup[v] for v in values if v in lookup]
+
+    def mask_in(self, column, values, case_insensitive=False):
+        """Boolean mask of rows whose column is one of values"""
+        codes = self.codes_for(column, values, case_insensitive)
+        if not codes:
+            return np.zeros(len(self.records), dtype=bool)
+        return np.isin(self.codes[column], codes)
+
+    def mask_eq(self, column, value, case_insensitive=False):
+        """Boolean mask of rows whose column equals value"""
+        return self.mask_in(column, [value], case_insensitive)
+
+    def rows(self, mask=None):
+        """Records selected by a boolean mask, in table order"""
+        if mask is None:
+            return list(self.records)
+        return [self.records[i] for i in np.flatnonzero(mask)]
+
+    def valid_records(self):
+        """All non-rejected records (includes NULL, approved, pending)"""
+        return self.rows(self.valid_mask)
+
+    def value_counts(self, column, mask=None, exclude=()):
+        """Count non-empty values of a column over the rows selected by mask"""
+        codes = self.codes[column]
+        if mask is not None:
+            codes = codes[mask]
+        codes = codes[codes != MISSING_CODE]
+        counts = np.bincount(codes, minlength=len(self.categories[column]))
+        values = self.categories[column]
+        return {values[code]: int(n) for code, n in enumerate(counts) if n and values[code] not in exclude}
+
+
+# ============= PROCESS-WIDE CACHE =============
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_energy_snapshot(db):
+    """Get the shared snapshot, reloading only if the data version changed"""
+    global _snapshot
+    snapshot = _snapshot
+    write_count = db.get_write_count()
+    if (snapshot is not None and snapshot.version[-1] == write_count
+            and time.monotonic() - snapshot.checked_at < VERSION_CHECK_INTERVAL):
+        return snapshot
+
+    with _snapshot_lock:
+        snapshot = _snapshot
+        version = db.get_data_version()
+        if snapshot is not None and snapshot.version == version:
+            snapshot.checked_at = time.monotonic()
+            return snapshot
+
+        records = db.iter_energy_data(prefetch=True)
+        _snapshot = EnergySnapshot(records, version)
+        print(f"📸 Energy snapshot loaded: {len(_snapshot)} records (version {version})")
+        return _snapshot
+
+
+def invalidate_energy_snapshot():
+    """Drop the shared snapshot so the next reader reloads it"""
+    global _snapshot
+    with _snapshot_lock:
+        _snapshot = None
@@ -0,0 +1,115 @@
+# facet_counts.py
+# Materialized (facet, value, record_count, study_count) aggregate of non-rejected energy_data rows.
+# SQLite keeps it current with triggers (schema migration 4 in db_wrapper.py);
+# Supabase refreshes a materialized view (supabase/007_energy_facet_counts.sql).
+
+# facet name -> value expression over a row ('{row}' is new/old in triggers, the table otherwise).
+# 'records' has one value counting every non-rejected record and study.
+FACETS = {
+    'records': "'all'",
+    'criteria': '{row}.criteria',
+    'energy_method': '{row}.energy_method',
+    'climate': '{row}.climate',
+    'scale': '{row}.scale',
+    'location': '{row}.location',
+    'building_use': '{row}.building_use',
+    'approach': '{row}.approach',
+}
+
+# Columns whose change moves a row between facet values
+TRACKED_COLUMNS = ('status', 'study_key') + tuple(facet for facet in FACETS if facet != 'records')
+
+
+def _valid(row):
+    return f"({row}.status != 'rejected' OR {row}.status IS NULL)"
+
+
+def _member_insert(facet, row):
+    value = FACETS[facet].format(row=row)
+    # INSERT ... SELECT needs a WHERE clause before ON CONFLICT
+    return f"""INSERT INTO energy_facet_members (facet, value, study_key, record_count)
+            SELECT '{facet}', {value}, COALESCE({row}.study_key, ''), 1
+            WHERE {_valid(row)} AND {value} IS NOT NULL AND {value} != ''
+            ON CONFLICT (facet, value, study_key) DO UPDATE SET record_count = record_count + 1;"""
+
+
+def _member_remove(facet, row):
+    value = FACETS[facet].format(row=row)
+    match = f"facet = '{facet}' AND value = {value} AND study_key = COALESCE({row}.study_key, '')"
+    return f"""UPDATE energy_facet_members SET record_count = record_count - 1
+            WHERE {match} AND {_valid(row)};
+            DELETE FROM energy_facet_members WHERE {match} AND record_count <= 0;"""
+
+
+def _trigger_body(*steps):
+    return "\n            ".join(steps)
+
+
+def _populate(facet):
+    value = FACETS[facet].format(row='energy_data')
+    return f"""INSERT INTO energy_facet_members (facet, value, study_key, record_count)
+        SELECT '{facet}', {value}, COALESCE(study_key, ''), COUNT(*) FROM energy_data
+        WHERE {_valid('energy_data')} AND {value} IS NOT NULL AND {value} != ''
+        GROUP BY 2, 3"""
+
+
+def sqlite_migration_statements():
+    """
+    energy_facet_members counts records per (facet, value, study); its triggers roll it up
+    into energy_facet_counts, where study_count is the number of member rows with a study key.
+    """
+    facets = list(FACETS)
+    return [
+        """CREATE TABLE IF NOT EXISTS energy_facet_counts (
+            facet TEXT NOT NULL,
+            value TEXT NOT NULL,
+            record_count INTEGER NOT NULL DEFAULT 0,
+            study_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (facet, value)
+        )""",
+        """CREATE TABLE IF NOT EXISTS energy_facet_members (
+            facet TEXT NOT NULL,
+            value TEXT NOT NULL,
+            study_key TEXT NOT NULL,
+            record_count INTEGER NOT NULL,
+            PRIMARY KEY (facet, value, study_key)
+        )""",
+        """CREATE TRIGGER IF NOT EXISTS energy_facet_members_ai AFTER INSERT ON energy_facet_members BEGIN
+            INSERT INTO energy_facet_counts (facet, value, record_count, study_count)
+            VALUES (new.facet, new.value, new.record_count, new.study_key != '')
+            ON CONFLICT (facet, value) DO UPDATE SET
+                record_count = record_count + excluded.record_count,
+                study_count = study_count + excluded.study_count;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS energy_facet_members_au AFTER UPDATE ON energy_facet_members BEGIN
+            UPDATE energy_facet_counts SET record_count = record_count + new.record_count - old.record_count
+            WHERE facet = new.facet AND value = new.value;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS energy_facet_members_ad AFTER DELETE ON energy_facet_members BEGIN
+            UPDATE energy_facet_counts SET
+                record_count = record_count - old.record_count,
+                study_count = study_count - (old.study_key != '')
+            WHERE facet = old.facet AND value = old.value;
+            DELETE FROM energy_facet_counts WHERE facet = old.facet AND value = old.value AND record_count <= 0;
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS energy_facets_ai AFTER INSERT ON energy_data BEGIN
+            {_trigger_body(*(_member_insert(facet, 'new') for facet in facets))}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS energy_facets_ad AFTER DELETE ON energy_data BEGIN
+            {_trigger_body(*(_member_remove(facet, 'old') for facet in facets))}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS energy_facets_au AFTER UPDATE OF {', '.join(TRACKED_COLUMNS)} ON energy_data BEGIN
+            {_trigger_body(*(_member_remove(facet, 'old') for facet in facets))}
+            {_trigger_body(*(_member_insert(facet, 'new') for facet in facets))}
+        END""",
+        "DELETE FROM energy_facet_members",
+        "DELETE FROM energy_facet_counts",
+    ] + [_populate(facet) for facet in facets]
+
+
+def group_facet_counts(rows):
+    """{facet: {value: (record_count, study_count)}} from energy_facet_counts rows"""
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row['facet'], {})[row['value']] = (row['record_count'], row['study_count'])
+    return grouped
@@ -0,0 +1,115 @@
+# facet_engine.py
+import threading
+from count_cube import CountCube, CASE_INSENSITIVE_DIMENSIONS, get_count_cube
+
+# Dropdown facets under the determinant -> output -> direction drill-down
+FACETS = ('scale', 'climate', 'location', 'building_use', 'approach')
+
+# Placeholder values that never appear as dropdown options
+FACET_EXCLUDED_VALUES = {
+    'scale': ('Awaiting data',),
+    'climate': ('Awaiting data',),
+}
+
+# Placeholder labels the selectboxes use for "nothing selected"
+UNSELECTED_LABELS = ("Select a determinant", "Select an output", "Select a direction")
+
+
+def clean_selection(value):
+    """Strip the ' [count]' suffix and placeholder labels from a widget value"""
+    if not value or value in UNSELECTED_LABELS:
+        return None
+    return value.split(" [")[0] if " [" in value else value
+
+
+class FacetEngine:
+    """Counts every facet for one filter state in a single vectorised pass"""
+
+    def __init__(self, snapshot, cube=None):
+        self.snapshot = snapshot
+        self.cube = cube if cube is not None else CountCube(snapshot)
+
+    def base_mask(self, criteria=None, energy_method=None, direction=None):
+        """Mask for non-rejected rows matching the drill-down selections"""
+        snapshot = self.snapshot
+        mask = snapshot.valid_mask.copy()
+        for column, value in (('criteria', criteria), ('energy_method', energy_method), ('direction', direction)):
+            value = clean_selection(value)
+            if value:
+                mask &= snapshot.mask_eq(column, value)
+        return mask
+
+    def _selection_masks(self, selections):
+        """One mask per facet; None where the facet is unselected ("All")"""
+        masks = {}
+        for facet in FACETS:
+            values = (selections or {}).get(facet)
+            if values and values != ["All"]:
+                masks[facet] = self.snapshot.mask_in(facet, values, facet in CASE_INSENSITIVE_DIMENSIONS)
+            else:
+                masks[facet] = None
+        return masks
+
+    def filtered_mask(self, criteria=None, energy_method=None, direction=None, selections=None):
+        """Mask of the rows matching every selection, including all facets"""
+        mask = self.base_mask(criteria, energy_method, direction)
+        for facet_mask in self._selection_masks(selections).values():
+            if facet_mask is not None:
+                mask &= facet_mask
+        return mask
+
+    def facet_counts(self, criteria=None, energy_method=None, direction=None, selections=None):
+        """
+        Get {facet: {value: count}} for every facet.
+        Each facet is counted under all the other selections but not its own,
+        so a dropdown keeps showing its alternatives after a choice is made.
+        Works on count cube cells rather than rows.
+        """
+        cube = self.cube
+        base = cube.mask(
+            criteria=clean_selection(criteria),
+            energy_method=clean_selection(energy_method),
+            direction=clean_selection(direction),
+        )
+        masks = []
+        for facet in FACETS:
+            values = (selections or {}).get(facet)
+            masks.append(cube.mask(**{facet: values}) if values and values != ["All"] else None)
+
+        # prefix[i] = base & masks[:i], suffix[i] = masks[i:], so facet i sees prefix[i] & suffix[i + 1]
+        prefix = [base]
+        for facet_mask in masks:
+            prefix.append(prefix[-1] if facet_mask is None else prefix[-1] & facet_mask)
+        suffix = [None] * (len(masks) + 1)
+        for i in range(len(masks) - 1, -1, -1):
+            if masks[i] is None:
+                suffix[i] = suffix[i + 1]
+            elif suffix[i + 1] is None:
+                suffix[i] = masks[i]
+            else:
+                suffix[i] = masks[i] & suffix[i + 1]
+
+        counts = {}
+        for i, facet in enumerate(FACETS):
+            mask = prefix[i] if suffix[i + 1] is None else prefix[i] & suffix[i + 1]
+            counts[facet] = cube.marginal(facet, mask, FACET_EXCLUDED_VALUES.get(facet, ()))
+        return counts
+
+
+# ============= SHARED ENGINE =============
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_facet_engine(db):
+    """Get the facet engine for the current shared snapshot and count cube"""
+    global _engine
+    cube = get_count_cube(db)
+    engine = _engine
+    if engine is None or engine.cube is not cube:
+        with _engine_lock:
+            if _engine is None or _engine.cube is not cube:
+                _engine = FacetEngine(cube.snapshot, cube)
+            engine = _engine
+    return engine
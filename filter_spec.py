@@ -0,0 +1,290 @@
+# filter_spec.py
+from functools import lru_cache
+
+from energy_record import ENERGY_DATA_COLUMNS
+
+# Compiled SQL texts kept per statement kind (by spec shape, ...); identical text lets each
+# connection's sqlite3 statement cache reuse the prepared statement. Bounded, since every
+# shape and IN-list length is a new entry
+COMPILED_SQL_CACHE_SIZE = 512
+
+
+def _check_column(column):
+    if column not in ENERGY_DATA_COLUMNS:
+        raise ValueError(f"Unknown energy_data column: {column}")
+    return column
+
+
+def _postgrest_value(value):
+    """Quote a value for a PostgREST or=(...) expression"""
+    text = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{text}"'
+
+
+class FilterSpec:
+    """
+    Declarative energy_data filter: a list of terms ANDed together, compiled either to
+    SQLite SQL with ? parameters or onto a PostgREST query chain.
+    Builder methods return the spec, so terms chain:
+        FilterSpec().eq('criteria', c).not_rejected().present('location')
+    """
+
+    def __init__(self, terms=()):
+        self.terms = list(terms)
+
+    @classmethod
+    def from_filters(cls, filters):
+        """Spec from the legacy {column: value} dict (empty values ignored); specs pass through"""
+        if isinstance(filters, FilterSpec):
+            return cls(filters.terms)
+        spec = cls()
+        for column, value in (filters or {}).items():
+            if value is not None and value != "":
+                spec.eq(column, value)
+        return spec
+
+    # ============= TERMS =============
+
+    def _add(self, *term):
+        self.terms.append(term)
+        return self
+
+    def eq(self, column, value):
+        return self._add('eq', _check_column(column), value)
+
+    def neq(self, column, value):
+        """column != value (NULL does not match, as in SQL)"""
+        return self._add('neq', _check_column(column), value)
+
+    def in_(self, column, values):
+        return self._add('in', _check_column(column), tuple(values))
+
+    def not_in(self, column, values):
+        return self._add('not_in', _check_column(column), tuple(values))
+
+    def present(self, column):
+        """column is neither NULL nor ''"""
+        return self._add('present', _check_column(column))
+
+    def missing(self, column, placeholders=()):
+        """column is NULL, '' or one of the placeholder values (e.g. 'Awaiting data')"""
+        return self._add('missing', _check_column(column), tuple(placeholders))
+
+    def not_rejected(self):
+        """status is anything but 'rejected', NULL included"""
+        return self._add('not_rejected')
+
+    def ilike(self, column, pattern):
+        """Case-insensitive match with % wildcards"""
+        return self._add('ilike', _check_column(column), pattern)
+
+    def id_range(self, after=None, until=None):
+        """after < id <= until; either bound may be None"""
+        return self._add('id_range', after, until)
+
+    def any_of(self, *specs):
+        """At least one of the given specs matches"""
+        return self._add('any', tuple(FilterSpec.from_filters(spec) for spec in specs))
+
+    # ============= IDENTITY =============
+
+    def shape(self):
+        """Everything that affects the SQL text, i.e. the terms without their values"""
+        return tuple(_term_shape(term) for term in self.terms)
+
+    def cache_key(self):
+        return tuple(_term_key(term) for term in self.terms)
+
+    def __bool__(self):
+        return bool(self.terms)
+
+    def __repr__(self):
+        return f"FilterSpec({self.terms!r})"
+
+    # ============= SQLITE =============
+
+    def where_sql(self):
+        """(' WHERE ...' or '', params)"""
+        sql = _where_sql(self.shape())
+        params = []
+        for term in self.terms:
+            params.extend(_sql_params(term))
+        return sql, params
+
+    def select_sql(self, select_list, order_by=None, limit=None):
+        """SELECT statement over energy_data; limit is bound as a parameter"""
+        _, params = self.where_sql()
+        sql = _select_sql(select_list, self.shape(), order_by, limit is not None)
+        if limit is not None:
+            params.append(limit)
+        return sql, params
+
+    def count_sql(self, group_column):
+        """(value, count) per group_column value, ordered by value"""
+        _, params = self.where_sql()
+        return _count_sql(_check_column(group_column), self.shape()), params
+
+    # ============= POSTGREST =============
+
+    def apply(self, query):
+        """Add every term to a PostgREST query builder and return it"""
+        for term in self.terms:
+            query = _apply_term(query, term)
+        return query
+
+    def postgrest_condition(self):
+        """The whole spec as one PostgREST logic expression, e.g. for or=(...)"""
+        conditions = [_postgrest_condition(term) for term in self.terms]
+        return conditions[0] if len(conditions) == 1 else f"and({','.join(conditions)})"
+
+
+# ============= TERM COMPILERS =============
+
+def _term_shape(term):
+    op = term[0]
+    if op in ('in', 'not_in'):
+        return (op, term[1], len(term[2]))
+    if op == 'missing':
+        return (op, term[1], len(term[2]))
+    if op == 'id_range':
+        return (op, term[1] is not None, term[2] is not None)
+    if op == 'any':
+        return (op, tuple(spec.shape() for spec in term[1]))
+    return term[:2]
+
+
+def _term_key(term):
+    if term[0] == 'any':
+        return ('any', tuple(spec.cache_key() for spec in term[1]))
+    return term
+
+
+@lru_cache(maxsize=COMPILED_SQL_CACHE_SIZE)
+def _where_sql(shape):
+    clauses = [_sql_clause(term_shape) for term_shape in shape]
+    return (" WHERE " + " AND ".join(clauses)) if clauses else ""
+
+
+@lru_cache(maxsize=COMPILED_SQL_CACHE_SIZE)
+def _select_sql(select_list, shape, order_by, limited):
+    sql = f"SELECT {select_list} FROM energy_data{_where_sql(shape)}"
+    if order_by:
+        sql += f" ORDER BY {_check_column(order_by)}"
+    if limited:
+        sql += " LIMIT ?"
+    return sql
+
+
+@lru_cache(maxsize=COMPILED_SQL_CACHE_SIZE)
+def _count_sql(column, shape):
+    return (
+        f"SELECT {column} AS value, COUNT(*) AS count FROM energy_data{_where_sql(shape)} "
+        f"GROUP BY {column} ORDER BY {column}"
+    )
+
+
+def _placeholders(count):
+    return ', '.join('?' for _ in range(count))
+
+
+def _sql_clause(term_shape):
+    """SQL for one term from its shape (see _term_shape), which is all the text depends on"""
+    op = term_shape[0]
+    if op == 'eq':
+        return f"{term_shape[1]} = ?"
+    if op == 'neq':
+        return f"{term_shape[1]} != ?"
+    if op == 'in':
+        return f"{term_shape[1]} IN ({_placeholders(term_shape[2])})" if term_shape[2] else "0"
+    if op == 'not_in':
+        return f"{term_shape[1]} NOT IN ({_placeholders(term_shape[2])})" if term_shape[2] else "1"
+    if op == 'present':
+        return f"({term_shape[1]} IS NOT NULL AND {term_shape[1]} != '')"
+    if op == 'missing':
+        placeholders = f" OR {term_shape[1]} IN ({_placeholders(term_shape[2])})" if term_shape[2] else ""
+        return f"({term_shape[1]} IS NULL OR {term_shape[1]} = ''{placeholders})"
+    if op == 'not_rejected':
+        return "(status != 'rejected' OR status IS NULL)"
+    if op == 'ilike':
+        return f"{term_shape[1]} LIKE ?"
+    if op == 'id_range':
+        bounds = (["id > ?"] if term_shape[1] else []) + (["id <= ?"] if term_shape[2] else [])
+        return " AND ".join(bounds) or "1"
+    if op == 'any':
+        parts = []
+        for spec_shape in term_shape[1]:
+            clauses = [_sql_clause(sub) for sub in spec_shape] or ["1"]
+            parts.append("(" + " AND ".join(clauses) + ")")
+        return "(" + " OR ".join(parts) + ")" if parts else "0"
+    raise ValueError(f"Unknown filter term: {op}")
+
+
+def _sql_params(term):
+    op = term[0]
+    if op in ('eq', 'neq', 'ilike'):
+        return [term[2]]
+    if op in ('in', 'not_in', 'missing'):
+        return list(term[2])
+    if op == 'id_range':
+        return [bound for bound in term[1:] if bound is not None]
+    if op == 'any':
+        params = []
+        for spec in term[1]:
+            for sub in spec.terms:
+                params.extend(_sql_params(sub))
+        return params
+    return []
+
+
+def _apply_term(query, term):
+    op = term[0]
+    if op == 'eq':
+        return query.eq(term[1], term[2])
+    if op == 'neq':
+        return query.neq(term[1], term[2])
+    if op == 'in':
+        return query.in_(term[1], list(term[2]))
+    if op == 'not_in':
+        return query.not_.in_(term[1], list(term[2])) if term[2] else query
+    if op == 'present':
+        return query.not_.is_(term[1], 'null').neq(term[1], '')
+    if op == 'ilike':
+        return query.ilike(term[1], term[2])
+    if op == 'id_range':
+        if term[1] is not None:
+            query = query.gt('id', term[1])
+        if term[2] is not None:
+            query = query.lte('id', term[2])
+        return query
+    # missing / not_rejected / any compile to or(...); or_() takes the inner list
+    return query.or_(_postgrest_condition(term)[len('or('):-1])
+
+
+def _postgrest_condition(term):
+    op = term[0]
+    column = term[1] if len(term) > 1 else None
+    if op == 'eq':
+        return f"{column}.eq.{_postgrest_value(term[2])}"
+    if op == 'neq':
+        return f"{column}.neq.{_postgrest_value(term[2])}"
+    if op == 'in':
+        return f"{column}.in.({','.join(_postgrest_value(v) for v in term[2])})"
+    if op == 'not_in':
+        return f"{column}.not.in.({','.join(_postgrest_value(v) for v in term[2])})"
+    if op == 'present':
+        return f"and({column}.not.is.null,{column}.neq.\"\")"
+    if op == 'missing':
+        conditions = [f"{column}.is.null", f"{column}.eq.\"\""]
+        if term[2]:
+            conditions.append(f"{column}.in.({','.join(_postgrest_value(v) for v in term[2])})")
+        return f"or({','.join(conditions)})"
+    if op == 'not_rejected':
+        return "or(status.neq.rejected,status.is.null)"
+    if op == 'ilike':
+        return f"{column}.ilike.{_postgrest_value(term[2])}"
+    if op == 'id_range':
+        bounds = ([f"id.gt.{term[1]}"] if term[1] is not None else []) + ([f"id.lte.{term[2]}"] if term[2] is not None else [])
+        return bounds[0] if len(bounds) == 1 else f"and({','.join(bounds)})"
+    if op == 'any':
+        return f"or({','.join(spec.postgrest_condition() for spec in term[1])})"
+    raise ValueError(f"Unknown filter term: {op}")
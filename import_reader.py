@@ -0,0 +1,226 @@
+# import_reader.py
+import codecs
+import csv
+import zipfile
+
+import pandas as pd
+
+# Header words that mark the study title column, in order of preference per column
+STUDY_COLUMN_KEYWORDS = ('study', 'title', 'paper', 'reference', 'citation')
+
+# Metadata fields an import sheet can fill in
+IMPORT_FIELDS = ('location', 'climate', 'scale', 'building_use', 'approach', 'sample_size')
+
+# Rows per batch handed on from the parser; bounds peak memory on large sheets
+IMPORT_BATCH_SIZE = 2000
+
+PREVIEW_ROWS = 10
+
+# Enough of a CSV to guess its delimiter and encoding
+_SNIFF_BYTES = 64 * 1024
+_ODS_MIMETYPE = b'application/vnd.oasis.opendocument.spreadsheet'
+_OLE_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+
+def import_column_role(column):
+    """Metadata field an import sheet column feeds, or None"""
+    col_lower = str(column).lower()
+    if 'location' in col_lower or 'site' in col_lower or 'region' in col_lower:
+        return 'location'
+    elif 'climate' in col_lower:
+        return 'climate'
+    elif 'scale' in col_lower:
+        return 'scale'
+    elif 'building' in col_lower and ('use' in col_lower or 'type' in col_lower):
+        return 'building_use'
+    elif 'approach' in col_lower or 'method' in col_lower:
+        return 'approach'
+    elif 'sample' in col_lower or 'n' == col_lower:
+        return 'sample_size'
+    return None
+
+
+def detect_study_column(columns):
+    """First column whose header looks like a study title, or None"""
+    for col in columns:
+        col_lower = str(col).lower()
+        if any(keyword in col_lower for keyword in STUDY_COLUMN_KEYWORDS):
+            return col
+    return None
+
+
+def import_columns(columns, study_column=None):
+    """The columns an import reads, in sheet order: study title candidates and metadata fields"""
+    return [
+        col for col in columns
+        if col == study_column or detect_study_column([col]) is not None or import_column_role(col)
+    ]
+
+
+def sniff_format(uploaded_file):
+    """'xlsx', 'ods' or 'csv' from the file's content; the upload's extension is not trusted"""
+    uploaded_file.seek(0)
+    head = uploaded_file.read(len(_OLE_MAGIC))
+    uploaded_file.seek(0)
+    if head.startswith(b'PK\x03\x04'):
+        try:
+            with zipfile.ZipFile(uploaded_file) as archive:
+                names = set(archive.namelist())
+                if 'mimetype' in names and archive.read('mimetype').strip() == _ODS_MIMETYPE:
+                    return 'ods'
+                if 'xl/workbook.xml' in names:
+                    return 'xlsx'
+        finally:
+            uploaded_file.seek(0)
+        raise ValueError("Unrecognised spreadsheet archive; upload an .xlsx, .ods or .csv file")
+    if head == _OLE_MAGIC:
+        raise ValueError("Legacy .xls workbooks are not supported; save the sheet as .xlsx or .csv")
+    return 'csv'
+
+
+def _header_names(values):
+    """Header cells named the way pandas names them: blanks as 'Unnamed: i', repeats as 'name.1'"""
+    names, seen = [], {}
+    for position, value in enumerate(values):
+        name = f"Unnamed: {position}" if value is None or value == '' else value
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _cell_text(value):
+    """Sheet cells as text (None when empty), matching what pd.read_csv(dtype=str) yields for CSV"""
+    if isinstance(value, str):
+        return value if value != '' else None
+    if value is None or pd.isna(value):
+        return None
+    return str(value)
+
+
+class ImportSheet:
+    """
+    First sheet of an uploaded metadata import, read lazily. Opening it parses only the
+    header and the preview rows; iter_batches() streams the rest in row batches holding
+    just the requested columns: CSV through pandas' chunked parser, XLSX through
+    openpyxl's read-only row iterator. ODS has no streaming reader, so it is parsed whole
+    (projected to the requested columns) and batched afterwards.
+    Batch cells are text, or None/NaN when empty, whatever the format.
+    """
+
+    def __init__(self, uploaded_file, preview_rows=PREVIEW_ROWS):
+        self.file = uploaded_file
+        self.format = sniff_format(uploaded_file)
+        self._csv_options = self._sniff_csv() if self.format == 'csv' else None
+        self.columns, self.preview = self._read_head(preview_rows)
+        if not self.columns:
+            raise ValueError("The sheet has no header row")
+
+    # ============= HEADER AND PREVIEW =============
+
+    def _sniff_csv(self):
+        self.file.seek(0)
+        sample = self.file.read(_SNIFF_BYTES)
+        self.file.seek(0)
+        try:
+            # Incremental, so a character cut off at the end of the sample isn't an error
+            text = codecs.getincrementaldecoder('utf-8-sig')().decode(sample, final=False)
+            encoding = 'utf-8-sig'
+        except UnicodeDecodeError:
+            text = sample.decode('latin-1')
+            encoding = 'latin-1'
+        try:
+            delimiter = csv.Sniffer().sniff(text, delimiters=',;\t|').delimiter
+        except csv.Error:
+            delimiter = ','
+        return {'sep': delimiter, 'encoding': encoding}
+
+    def _read_head(self, rows):
+        self.file.seek(0)
+        if self.format == 'csv':
+            preview = pd.read_csv(self.file, nrows=rows, dtype=str, **self._csv_options)
+        elif self.format == 'ods':
+            preview = pd.read_excel(self.file, sheet_name=0, nrows=rows, engine='odf')
+        else:
+            preview = None
+            with _open_xlsx_rows(self.file) as sheet_rows:
+                header = next(sheet_rows, None)
+                if header is not None:
+                    columns = _header_names(header)
+                    body = [row for _, row in zip(range(rows), sheet_rows)]
+                    preview = pd.DataFrame([_pad(row, len(columns)) for row in body], columns=columns)
+            if preview is None:
+                preview = pd.DataFrame()
+        return list(preview.columns), preview
+
+    # ============= BATCHES =============
+
+    def iter_batches(self, columns=None, batch_size=IMPORT_BATCH_SIZE):
+        """DataFrames of up to batch_size rows with only the given columns (all by default)"""
+        columns = list(self.columns if columns is None else columns)
+        missing = [col for col in columns if col not in self.columns]
+        if missing:
+            raise ValueError(f"Columns not in sheet: {missing}")
+        self.file.seek(0)
+        if self.format == 'csv':
+            reader = pd.read_csv(self.file, usecols=columns, dtype=str, chunksize=batch_size,
+                                 **self._csv_options)
+            with reader:
+                for batch in reader:
+                    yield batch[columns]
+        elif self.format == 'ods':
+            # dtype=object keeps whole numbers as ints in columns with empty cells, as for XLSX
+            sheet = pd.read_excel(self.file, sheet_name=0, usecols=columns, engine='odf', dtype=object)
+            # Series.map, since DataFrame.map is pandas >= 2.1 and applymap is gone in 3.0
+            sheet = sheet[columns].apply(lambda column: column.map(_cell_text))
+            for start in range(0, len(sheet), batch_size):
+                yield sheet.iloc[start:start + batch_size]
+        else:
+            yield from self._iter_xlsx_batches(columns, batch_size)
+
+    def _iter_xlsx_batches(self, columns, batch_size):
+        positions = [self.columns.index(col) for col in columns]
+        with _open_xlsx_rows(self.file) as sheet_rows:
+            next(sheet_rows, None)  # header
+            batch = []
+            row_number = 0
+            for row in sheet_rows:
+                values = [_cell_text(row[position]) if position < len(row) else None
+                          for position in positions]
+                # Formatting-only rows at the end of a sheet still come back from openpyxl
+                if any(value is not None for value in values):
+                    batch.append(values)
+                if len(batch) >= batch_size:
+                    yield pd.DataFrame(batch, columns=columns,
+                                       index=range(row_number, row_number + len(batch)))
+                    row_number += len(batch)
+                    batch = []
+            if batch:
+                yield pd.DataFrame(batch, columns=columns, index=range(row_number, row_number + len(batch)))
+
+
+def _pad(row, width):
+    row = list(row[:width])
+    return row + [None] * (width - len(row))
+
+
+class _open_xlsx_rows:
+    """Context manager over the first worksheet's rows (cell values) of a read-only workbook"""
+
+    def __init__(self, uploaded_file):
+        self.file = uploaded_file
+        self.workbook = None
+
+    def __enter__(self):
+        # Imported here so CSV imports work without openpyxl
+        from openpyxl import load_workbook
+        self.workbook = load_workbook(self.file, read_only=True, data_only=True)
+        return self.workbook.worksheets[0].iter_rows(values_only=True)
+
+    def __exit__(self, *exc_info):
+        # Read-only workbooks keep the archive open until closed
+        self.workbook.close()
+        return False
@@ -2,12 +2,39 @@
 import streamlit as st
 import pandas as pd
 import re
+from collections import defaultdict
+
+def apply_location_cleanup(db_connection, updates, split_records):
+    """
+    Apply the planned cleanup: location renames in one bulk update, and each split record
+    replaced by its new records as one atomic delete-plus-inserts unit.
+    Split records are grouped by original id in a single pass.
+    """
+    splits_by_original = defaultdict(list)
+    originals = {}
+    for split in split_records:
+        splits_by_original[split['original_id']].append(split['new_location'])
+        originals[split['original_id']] = split['original_record']
+    
+    location_updates = [(u['id'], {'location': u['new']}) for u in updates if u['action'] == 'update']
+    update_result = db_connection.update_records_bulk('energy_data', location_updates)
+    
+    replacements = {}
+    for update in updates:
+        if update['action'] == 'delete' and update['id'] in originals:
+            original = originals[update['id']]
+            replacements[update['id']] = [
+                {**original, 'location': new_location} for new_location in splits_by_original[update['id']]
+            ]
+    replace_result = db_connection.replace_records('energy_data', replacements)
+    
+    return update_result, replace_result
 
 def cleanup_locations(db_connection):
     """Clean up location names in the database"""
     
     # Get all records
-    all_records = db_connection.get_energy_data(limit=5000)
+    all_records = db_connection.iter_energy_data()
     
     # Define cleaning rules
     cleaning_rules = {
@@ -101,22 +128,10 @@ def cleanup_locations(db_connection):
     # Confirmation button
     if st.button("Apply Cleanup"):
         with st.spinner("Updating locations..."):
-            # Apply updates
-            for update in updates:
-                if update['action'] == 'update':
-                    db_connection.update_record('energy_data', update['id'], {'location': update['new']})
-                elif update['action'] == 'delete':
-                    # For split locations, we'll delete original and create new records
-                    original = next((s['original_record'] for s in split_records if s['original_id'] == update['id']), None)
-                    if original:
-                        # Delete original
-                        db_connection.delete_record('energy_data', update['id'])
-                        
-                        # Create new records for each split
-                        for split in [s for s in split_records if s['original_id'] == update['id']]:
-                            new_record = original.copy()
-                            new_record.pop('id', None)  # Remove ID to let DB assign new one
-                            new_record['location'] = split['new_location']
-                            db_connection.insert_record('energy_data', new_record)
+            update_result, replace_result = apply_location_cleanup(db_connection, updates, split_records)
+            created = sum(len(new_ids) for new_ids in replace_result['replaced'].values())
             
-            st.success(f"Applied {len(updates)} updates and created {len(split_records)} new records!")
\ No newline at end of file
+            failures = len(update_result['failed']) + len(replace_result['failed'])
+            if failures:
+                st.error(f"{failures} changes could not be applied")
+            st.success(f"Applied {len(update_result['updated'])} updates and created {created} new records!")
\ No newline at end of file
@@ -8,6 +8,7 @@ import re
 from folium import IFrame, Html
 import math
 from location_lookup import get_location_coordinates  # Fixed import!
+from energy_snapshot import get_energy_snapshot
 import pandas as pd
 from color_schemes import (
     get_climate_color
@@ -170,7 +171,7 @@ def render_location_map(db_connection):
     
     # Get all non-rejected records
     with st.spinner("Loading location data..."):
-        all_records = db_connection.get_energy_data(limit=5000)
+        all_records = get_energy_snapshot(db_connection).records
         
         # Only include non-rejected records (keep NULL, approved, pending)
         valid_records = [r for r in all_records if r.get('status') != 'rejected']
@@ -328,7 +329,7 @@ def render_location_map(db_connection):
     cache = load_location_cache()
 
     # Get all valid records
-    all_records = db_connection.get_energy_data(limit=5000)
+    all_records = get_energy_snapshot(db_connection).records
     valid_records = [r for r in all_records if r.get('status') != 'rejected']
 
     # Separate records based on cache
@@ -0,0 +1,286 @@
+# match_jobs.py
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from study_matcher import StudyTitles, FuzzyStudyIndex, CONFIDENCE_ORDER
+
+# Records per exact-matching task: the corpus is split among the workers, and each worker
+# matches its slices against every title at once
+MATCH_CORPUS_SLICE = 2000
+
+# Studies per fuzzy-matching task (titles without an exact hit); small enough for smooth
+# progress and quick cancellation
+MATCH_CHUNK_SIZE = 20
+
+MATCH_WORKERS = max(1, min(4, os.cpu_count() or 1))
+
+# Seconds a finished job's results stay in the registry for its session to collect
+MATCH_JOB_RETENTION = 600.0
+
+# Running and finished jobs by import session id, shared by every rerun of the server process
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+class _MatchWorker:
+    """
+    A worker's matching state: the paragraph corpus, the sheet's title automaton and (built on
+    first use) the corpus' fuzzy index. Results refer to records by their corpus position, which
+    pickles small and means the same in every process.
+    """
+
+    def __init__(self, records, studies):
+        self.records = records
+        self.titles = StudyTitles(studies)
+        self.positions = {id(record): position for position, record in enumerate(records)}
+        self._fuzzy_index = None
+
+    def scan(self, start, stop):
+        """{pattern: [(corpus position, match position)]} of the exact hits in records[start:stop]"""
+        hits = self.titles.exact_hits(self.records[start:stop])
+        return {
+            pattern: [(self.positions[id(record)], position) for record, position in pattern_hits]
+            for pattern, pattern_hits in enumerate(hits) if pattern_hits
+        }
+
+    def fuzzy(self, titles):
+        """FuzzyStudyIndex.query of each title, records as corpus positions"""
+        if self._fuzzy_index is None:
+            self._fuzzy_index = FuzzyStudyIndex()
+            for _ in self._fuzzy_index.index_records(self.records):
+                pass
+        return [
+            [(tuple(self.positions[id(record)] for record in group), score, offset)
+             for group, score, offset in self._fuzzy_index.query(title)]
+            for title in titles
+        ]
+
+
+# Worker process state, built once per worker
+_worker = None
+
+
+def _init_worker(records, studies):
+    global _worker
+    _worker = _MatchWorker(records, studies)
+
+
+def _worker_task(method, *args):
+    """Run one _MatchWorker method in a pool process"""
+    return getattr(_worker, method)(*args)
+
+
+class MatchJob:
+    """
+    Study matching for one import session, run by a background thread on a process pool
+    (spawned workers, so nothing of the Streamlit process is forked). The exact pass splits
+    the corpus among the workers and matches every slice against all titles at once; titles
+    without an exact hit then get fuzzy tiers in chunks of titles.
+    Reruns poll progress() and status; cancel() stops it between tasks.
+    """
+
+    def __init__(self, session_id, studies, load_records, unmatched_reason,
+                 workers=MATCH_WORKERS, chunk_size=MATCH_CHUNK_SIZE, slice_size=MATCH_CORPUS_SLICE):
+        self.session_id = session_id
+        self.studies = list(studies)
+        self.unmatched_reason = unmatched_reason
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.slice_size = slice_size
+        self._load_records = load_records
+
+        self.status = 'loading'  # loading -> matching -> done | cancelled | failed
+        self.error = None
+        self.finished_at = None  # monotonic time the job reached a final status
+        self.matched_records = None
+        self.unmatched_studies = None
+        self.tasks_done = 0
+        self.tasks_total = 0
+        self.matches_found = 0
+        self._executor = None
+        self._inline_worker = None
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"study-matching-{session_id}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def progress(self):
+        """(tasks done, total tasks, matches found so far)"""
+        with self._lock:
+            return self.tasks_done, self.tasks_total, self.matches_found
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'cancelled', 'failed')
+
+    # ============= BACKGROUND THREAD =============
+
+    def _run(self):
+        try:
+            # Plain dicts pickle small and fast for the workers
+            records = [record.to_dict() if hasattr(record, 'to_dict') else dict(record)
+                       for record in self._load_records()]
+            if self._cancel.is_set():
+                self.status = 'cancelled'
+                return
+            titles = StudyTitles(self.studies)
+            slices = [(start, start + self.slice_size) for start in range(0, len(records), self.slice_size)]
+            # At most this many fuzzy chunks; the ones not needed count as done once it is known
+            fuzzy_bound = -(-len(titles.studies) // self.chunk_size)
+            with self._lock:
+                self.tasks_total = len(slices) + fuzzy_bound
+            self.status = 'matching'
+            try:
+                self._start_pool(records, len(slices))
+
+                # Exact pass: one scan of each corpus slice against every title
+                pattern_counts = [0] * len(titles.automaton.patterns)
+                for pattern in titles.patterns:
+                    pattern_counts[pattern] += 1
+                scans = self._map(records, 'scan', slices, lambda scan: sum(
+                    len(pattern_hits) * pattern_counts[pattern] for pattern, pattern_hits in scan.items()
+                ))
+                if scans is None:
+                    self.status = 'cancelled'
+                    return
+                hits = [[] for _ in titles.automaton.patterns]
+                for scan in scans:
+                    for pattern, pattern_hits in scan.items():
+                        hits[pattern].extend((records[position], start) for position, start in pattern_hits)
+
+                # Fuzzy tiers for the titles without an exact hit
+                unmatched = titles.unmatched(hits)
+                chunks = [unmatched[start:start + self.chunk_size]
+                          for start in range(0, len(unmatched), self.chunk_size)]
+                with self._lock:
+                    self.tasks_done += fuzzy_bound - len(chunks)
+                fuzzy_results = self._map(
+                    records, 'fuzzy', [([titles.studies[number][1] for number in chunk],) for chunk in chunks],
+                    lambda result: sum(len(group) for title_hits in result for group, _, _ in title_hits)
+                )
+                if fuzzy_results is None:
+                    self.status = 'cancelled'
+                    return
+            finally:
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False, cancel_futures=True)
+                    self._executor = None
+
+            fuzzy_hits = {}
+            for chunk, result in zip(chunks, fuzzy_results):
+                for number, title_hits in zip(chunk, result):
+                    fuzzy_hits[number] = [
+                        ([records[position] for position in group], score, offset)
+                        for group, score, offset in title_hits
+                    ]
+            self._finish(*titles.results(hits, fuzzy_hits, self.unmatched_reason))
+        except Exception as e:
+            self.error = str(e)
+            self.status = 'failed'
+            print(f"❌ Study matching for {self.session_id} failed: {e}")
+        finally:
+            self.finished_at = time.monotonic()
+
+    def _start_pool(self, records, slice_count):
+        self._executor = ProcessPoolExecutor(
+            max_workers=min(self.workers, max(1, slice_count)),
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(records, self.studies)
+        )
+
+    def _map(self, records, method, tasks, count_matches):
+        """
+        Results of the _MatchWorker method for every task (an argument tuple), in task order:
+        on the pool while it works, in this thread once it is unavailable; None when cancelled
+        """
+        results = {}
+        if self._executor is not None:
+            try:
+                pending = {self._executor.submit(_worker_task, method, *task): number for number, task in enumerate(tasks)}
+                while pending and not self._cancel.is_set():
+                    # Wake up now and then to notice a cancel while tasks are running
+                    done, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        number = pending.pop(future)
+                        results[number] = future.result()
+                        self._task_done(count_matches(results[number]))
+            except (BrokenProcessPool, OSError, NotImplementedError) as e:
+                # Workers can't be spawned or initialized on this host (the pool only
+                # starts them on submit): run the remaining tasks in this thread
+                print(f"⚠️ Process pool unavailable, matching in-process: {e}")
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+        for number, task in enumerate(tasks):
+            if self._cancel.is_set():
+                return None
+            if number in results:
+                continue
+            if self._inline_worker is None:
+                self._inline_worker = _MatchWorker(records, self.studies)
+            results[number] = getattr(self._inline_worker, method)(*task)
+            self._task_done(count_matches(results[number]))
+        return [results[number] for number in range(len(tasks))]
+
+    def _task_done(self, matches):
+        with self._lock:
+            self.tasks_done += 1
+            self.matches_found += matches
+
+    def _finish(self, matched_records, unmatched_studies):
+        matched_records.sort(key=lambda x: (CONFIDENCE_ORDER.get(x['confidence'], 999), -x.get('match_percentage', 0)))
+        self.matched_records = matched_records
+        self.unmatched_studies = unmatched_studies
+        self.status = 'done'
+
+
+# ============= REGISTRY =============
+
+def _evict_finished_jobs():
+    """Forget jobs whose results have waited longer than MATCH_JOB_RETENTION (caller holds _jobs_lock)"""
+    now = time.monotonic()
+    expired = [
+        session_id for session_id, job in _jobs.items()
+        if job.finished_at is not None and now - job.finished_at > MATCH_JOB_RETENTION
+    ]
+    for session_id in expired:
+        del _jobs[session_id]
+
+
+def start_match_job(session_id, studies, load_records, unmatched_reason):
+    """
+    Start matching studies ((name, normalized name) pairs) for an import session.
+    load_records is called on the job's thread and returns the energy_data records to match against.
+    """
+    job = MatchJob(session_id, studies, load_records, unmatched_reason)
+    with _jobs_lock:
+        _evict_finished_jobs()
+        previous = _jobs.get(session_id)
+        if previous is not None:
+            previous.cancel()
+        _jobs[session_id] = job
+    return job.start()
+
+
+def get_match_job(session_id):
+    with _jobs_lock:
+        _evict_finished_jobs()
+        return _jobs.get(session_id)
+
+
+def discard_match_job(session_id):
+    """Cancel the session's job if it is still running and forget it"""
+    with _jobs_lock:
+        job = _jobs.pop(session_id, None)
+    if job is not None:
+        job.cancel()
@@ -0,0 +1,112 @@
+# query_cache.py
+import threading
+import time
+from collections import OrderedDict
+
+# Entries kept before the least recently used one is evicted
+QUERY_CACHE_SIZE = 256
+
+# Seconds an entry is trusted; covers writes made by other processes (scripts, other servers)
+QUERY_CACHE_TTL = 60.0
+
+
+def normalize_filters(filters):
+    """Hashable, order-independent form of a filters dict (empty values are ignored by every query)"""
+    if not filters:
+        return ()
+    if hasattr(filters, 'cache_key'):
+        # FilterSpec
+        return filters.cache_key()
+    return tuple(sorted(
+        (key, tuple(value) if isinstance(value, list) else value)
+        for key, value in filters.items()
+        if value is not None and value != ""
+    ))
+
+
+class QueryCache:
+    """
+    Size-bounded LRU cache of read results with an optional TTL.
+    Every entry belongs to a table, and a write to a table invalidates exactly its entries.
+    """
+
+    def __init__(self, max_entries=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (table, stored_at, value)
+        self._keys_by_table = {}       # table -> set of keys
+        self._generations = {}         # table -> invalidation count, to spot writes during a load
+        self._clears = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_or_load(self, table, key, loader):
+        """Cached result for key, calling loader() on a miss or an expired entry"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (self.ttl is None or time.monotonic() - entry[1] < self.ttl):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return _copy(entry[2])
+            self.misses += 1
+            generation = (self._generations.get(table, 0), self._clears)
+
+        # Load outside the lock so slow queries don't block other readers
+        value = loader()
+        with self._lock:
+            # A write that invalidated the table meanwhile may not be in this result
+            if (self._generations.get(table, 0), self._clears) == generation:
+                self._store(table, key, value)
+        return _copy(value)
+
+    def _store(self, table, key, value):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        self._entries[key] = (table, time.monotonic(), value)
+        self._keys_by_table.setdefault(table, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            old_key, (old_table, _, _) = self._entries.popitem(last=False)
+            self._keys_by_table[old_table].discard(old_key)
+            self.evictions += 1
+
+    def invalidate(self, table):
+        """Drop every cached result read from table"""
+        with self._lock:
+            for key in self._keys_by_table.pop(table, ()):
+                self._entries.pop(key, None)
+            self._generations[table] = self._generations.get(table, 0) + 1
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_table.clear()
+            self._clears += 1
+
+    def stats(self):
+        """Counters for monitoring: hits, misses, hit_rate, evictions, invalidations, entries"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries),
+            }
+
+
+def _copy(value):
+    """
+    Copy of the list/dict containers of a result, nested ones included, so callers can't
+    mutate the cached object. EnergyRecords, tuples and scalars are immutable and shared.
+    """
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    return value
@@ -14,7 +14,7 @@ print(f"📊 Connected to database (Supabase mode: {db.use_supabase})")
 
 # Get all records
 print("📥 Fetching all records...")
-all_records = db.get_energy_data(limit=5000)
+all_records = list(db.iter_energy_data(columns=['location'], prefetch=True))
 print(f"✅ Found {len(all_records)} total records")
 
 # Extract unique locations
@@ -0,0 +1,95 @@
+# sqlite_writer.py
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+# Most write jobs folded into one transaction
+MAX_BATCH_SIZE = 200
+
+
+class SQLiteWriter:
+    """
+    Owns the only SQLite write connection and applies write jobs on a dedicated thread.
+    Jobs queued while a transaction is running are grouped into the next one; each job
+    runs inside its own SAVEPOINT so a failing job is rolled back without affecting the rest.
+    Readers keep their own connections and are not blocked thanks to WAL mode.
+    """
+
+    def __init__(self, db_path, max_batch_size=MAX_BATCH_SIZE):
+        self.db_path = db_path
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, job):
+        """Queue job(cursor) for the writer thread and return a Future with its result"""
+        future = Future()
+        self._queue.put((job, future))
+        return future
+
+    def run(self, job):
+        """Queue job(cursor) and wait until its transaction has committed"""
+        return self.submit(job).result()
+
+    def close(self):
+        """Finish queued jobs and stop the writer thread"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _connect(self):
+        # Autocommit mode: transactions are opened and committed explicitly per batch
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _run(self):
+        conn = self._connect()
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stopping = True
+                batch = [item for item in batch if item is not None]
+            if batch:
+                self._apply_batch(conn, batch)
+        conn.close()
+
+    def _apply_batch(self, conn, batch):
+        """Run a batch of jobs in one transaction and resolve their futures after commit"""
+        outcomes = []
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            for job, future in batch:
+                cursor.execute("SAVEPOINT write_job")
+                try:
+                    result = job(cursor)
+                    cursor.execute("RELEASE write_job")
+                    outcomes.append((future, result, None))
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO write_job")
+                    cursor.execute("RELEASE write_job")
+                    outcomes.append((future, None, e))
+            cursor.execute("COMMIT")
+        except Exception as e:
+            # The transaction itself failed - nothing in this batch was written
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for job, future in batch:
+                future.set_exception(e)
+            return
+
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
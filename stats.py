@@ -13,35 +13,20 @@ def render_statistics_tab(db_connection):
     """Render the Statistics tab with all Frequencys"""
     st.subheader("Database Statistics")
     
-    # Get all non-rejected records
-    all_records = db_connection.get_energy_data(limit=5000)
-    valid_records = [r for r in all_records if r.get('status') != 'rejected']
+    # (record_count, study_count) per facet value of non-rejected records, kept current by the database
+    facet_counts = db_connection.get_facet_counts()
+    total_records, total_studies = facet_counts.get('records', {}).get('all', (0, 0))
     
-    if not valid_records:
+    if not total_records:
         st.info("No data available for statistics")
         return
     
-    # First, identify unique studies by paragraph content
-    study_map = {}  # Map paragraph -> first record with that paragraph
-    for record in valid_records:
-        para = record.get('paragraph')
-        if para and para not in ['0', '0.0', '', None]:
-            if para not in study_map:
-                study_map[para] = record
-    
-    unique_studies = list(study_map.values())
-    total_studies = len(unique_studies)
-    total_records = len(valid_records)
-    
-    # Count unique values across all records
-    unique_determinants = set(r.get('criteria') for r in valid_records if r.get('criteria'))
-    unique_outputs = set(r.get('energy_method') for r in valid_records if r.get('energy_method'))
-    unique_locations = set(r.get('location') for r in valid_records if r.get('location') and r.get('location') not in ['', None])
-    unique_climates = set(r.get('climate') for r in valid_records if r.get('climate') and r.get('climate') not in ['Awaiting data', ''])
-    unique_scales = set(r.get('scale') for r in valid_records if r.get('scale') and r.get('scale') not in ['Awaiting data', ''])
-    unique_building_uses = set(r.get('building_use') for r in valid_records if r.get('building_use') and r.get('building_use') not in ['', None])
-    unique_approaches = set(r.get('approach') for r in valid_records if r.get('approach') and r.get('approach') not in ['', None])
-    unique_contributors = set(r.get('user') for r in valid_records if r.get('user'))
+    # Number of studies per value (a study counts once for every value its records carry)
+    study_counts = {
+        facet: {value: studies for value, (_, studies) in counts.items() if studies}
+        for facet, counts in facet_counts.items()
+    }
+    unique_locations = facet_counts.get('location', {})
 
     # Display summary metrics
     col1, col2, col3 = st.columns(3)
@@ -65,24 +50,47 @@ def render_statistics_tab(db_connection):
         " Building Use", 
         " Approach"
     ])
+    # Charts that merge raw values count the distinct studies of the merged values
     with dist_tab1:
-        render_determinant_chart(unique_studies)
+        render_determinant_chart(facet_studies(db_connection, 'criteria'))
 
     with dist_tab2:
-        render_climate_distribution(unique_studies)
+        render_climate_distribution(facet_studies(db_connection, 'climate'))
     
     with dist_tab3:
-        render_scale_distribution(unique_studies)
+        render_scale_distribution(facet_studies(db_connection, 'scale'))
     
     with dist_tab4:
-        render_building_use_distribution(unique_studies)
+        render_building_use_distribution(study_counts.get('building_use', {}))
     
     with dist_tab5:
-        render_approach_distribution(unique_studies)
+        render_approach_distribution(study_counts.get('approach', {}))
     
     st.divider()
     
-def render_determinant_chart(unique_studies):
+def facet_studies(db_connection, facet):
+    """
+    {value: study keys} of a facet, or {value: record count} when the backend
+    has no study keys yet (Supabase before its study_key migrations)
+    """
+    study_keys = db_connection.get_facet_study_keys(facet)
+    if study_keys is None:
+        return db_connection.get_counts_with_filters(facet)
+    return study_keys
+
+def merge_study_counts(merged):
+    """{merged value: count} from (merged value, study keys or record count) pairs, each study counted once"""
+    counts = {}
+    studies = {}
+    for value, keys in merged:
+        if isinstance(keys, int):
+            counts[value] = counts.get(value, 0) + keys
+        else:
+            studies.setdefault(value, set()).update(keys)
+    counts.update((value, len(keys)) for value, keys in studies.items())
+    return counts
+
+def render_determinant_chart(study_keys):
     """Render top determinants chart with toggle and SVG export"""
     st.subheader("Top 10 Studied Determinants")
     
@@ -90,12 +98,10 @@ def render_determinant_chart(unique_studies):
     if 'show_all_determinants_stats' not in st.session_state:
         st.session_state.show_all_determinants_stats = False
     
-    determinant_counts = {}
-    for study in unique_studies:
-        criteria = study.get('criteria')
-        if criteria:
-            clean_criteria = sanitize_metadata_text(criteria)
-            determinant_counts[clean_criteria] = determinant_counts.get(clean_criteria, 0) + 1
+    # Spellings that clean to the same determinant share their studies
+    determinant_counts = merge_study_counts(
+        (sanitize_metadata_text(criteria), keys) for criteria, keys in study_keys.items()
+    )
     
     if determinant_counts:
         # Determine which set to show
@@ -243,22 +249,21 @@ def render_determinant_chart(unique_studies):
     else:
         st.info("No determinant data available")
 
-def render_climate_distribution(unique_studies):
+def render_climate_distribution(study_keys):
     """Render climate code distribution with clean bars - code on bar, description on left"""
     st.subheader("Climate Code Distribution (by unique study)")
     
     # Count climates by UNIQUE STUDY
-    climate_counts = {}
+    climate_studies = []
     climate_display_map = {}  # Map code to full display with description
-    for study in unique_studies:
-        climate = study.get('climate')
-        if climate and climate not in ['Awaiting data', '']:
+    for climate, keys in study_keys.items():
+        if climate not in ['Awaiting data', '']:
             # Extract the climate code
             climate_code = climate
             if " - " in str(climate):
                 climate_code = climate.split(" - ")[0]
             climate_code = ''.join([c for c in str(climate_code) if c.isalnum()])
-            climate_counts[climate_code] = climate_counts.get(climate_code, 0) + 1
+            climate_studies.append((climate_code, keys))
             
             # Store the description for this code
             if climate_code not in climate_display_map:
@@ -267,6 +272,7 @@ def render_climate_distribution(unique_studies):
                     climate_display_map[climate_code] = description
                 else:
                     climate_display_map[climate_code] = climate_code
+    climate_counts = merge_study_counts(climate_studies)
     
     if climate_counts:
         sorted_items = sorted(climate_counts.items(), key=lambda x: x[1], reverse=True)
@@ -395,19 +401,19 @@ def render_climate_distribution(unique_studies):
     else:
         st.info("No climate data available")
 
-def render_scale_distribution(unique_studies):
+def render_scale_distribution(study_keys):
     """Render scale Frequency with clean bars"""
     st.subheader("Scale Frequency ")
     
     # Count scales by UNIQUE STUDY
-    scale_counts = {}
-    for study in unique_studies:
-        scale = study.get('scale')
-        if scale and scale not in ['Awaiting data', '']:
+    scale_studies = []
+    for scale, keys in study_keys.items():
+        if scale not in ['Awaiting data', '']:
             scale_clean = scale
             if " - " in str(scale):
                 scale_clean = scale.split(" - ")[0]
-            scale_counts[scale_clean] = scale_counts.get(scale_clean, 0) + 1
+            scale_studies.append((scale_clean, keys))
+    scale_counts = merge_study_counts(scale_studies)
     
     if scale_counts:
         render_clean_distribution_bars(
@@ -419,16 +425,14 @@ def render_scale_distribution(unique_studies):
     else:
         st.info("No scale data available")
 
-def render_building_use_distribution(unique_studies):
+def render_building_use_distribution(study_counts):
     """Render building use Frequency with clean bars"""
     st.subheader("Building Use Frequency ")
     
     # Count building uses by UNIQUE STUDY
     building_counts = {}
-    for study in unique_studies:
-        building_use = study.get('building_use')
-        if building_use and building_use not in ['', None]:
-            building_counts[building_use] = building_counts.get(building_use, 0) + 1
+    for building_use, studies in study_counts.items():
+        building_counts[building_use] = studies
     
     if building_counts:
         render_clean_distribution_bars(
@@ -440,16 +444,14 @@ def render_building_use_distribution(unique_studies):
     else:
         st.info("No building use data available")
 
-def render_approach_distribution(unique_studies):
+def render_approach_distribution(study_counts):
     """Render approach Frequency with clean bars"""
     st.subheader("Approach Frequency ")
     
     # Count approaches by UNIQUE STUDY
     approach_counts = {}
-    for study in unique_studies:
-        approach = study.get('approach')
-        if approach and approach not in ['', None]:
-            approach_counts[approach] = approach_counts.get(approach, 0) + 1
+    for approach, studies in study_counts.items():
+        approach_counts[approach] = studies
     
     if approach_counts:
         render_clean_distribution_bars(
@@ -0,0 +1,338 @@
+# study_matcher.py
+import re
+import zlib
+from collections import deque
+from difflib import SequenceMatcher
+
+import numpy as np
+
+from energy_record import study_text
+
+# Columns a study match carries into the admin review (study_key groups records of one study)
+MATCH_COLUMNS = ['id', 'paragraph', 'study_key', 'criteria', 'energy_method', 'direction', 'scale', 'climate', 'location']
+
+# Fuzzy tiers by token-set similarity (percent), best first; below the last one is no match
+FUZZY_TIERS = (
+    (90, 'strong_match_90pct'),
+    (80, 'strong_match'),
+    (70, 'good_match'),
+    (60, 'partial_match'),
+    (50, 'fuzzy_match'),
+)
+
+# Share of a title's words a candidate sentence must contain before it is scored
+FUZZY_MIN_SHARED_TOKENS = 0.5
+
+# Review order of the confidence labels
+CONFIDENCE_ORDER = {'exact_match': 0}
+CONFIDENCE_ORDER.update((tier, rank) for rank, (_, tier) in enumerate(FUZZY_TIERS, start=1))
+
+# MinHash signature length and LSH banding (bands * rows = perms). Segments whose
+# character-trigram Jaccard similarity with a title is above ~(1/bands)^(1/rows) = 0.5
+# share a bucket with it with high probability
+MINHASH_PERMS = 64
+LSH_BANDS = 16
+LSH_ROWS = MINHASH_PERMS // LSH_BANDS
+
+# Citation paragraphs put the title in its own sentence or quotes
+_SEGMENT_SPLIT = re.compile(r'[.?!"\u201c\u201d]+\s*')
+_TOKEN = re.compile(r'\w+')
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+class AhoCorasick:
+    """
+    Multi-pattern substring automaton: one pass over a text finds every occurrence
+    of every pattern in O(len(text) + matches).
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self._goto = [{}]      # state -> {char: next state}
+        self._fail = [0]
+        self._output = [()]    # state -> pattern indices ending here (suffix states included)
+        for index, pattern in enumerate(self.patterns):
+            if pattern:
+                self._add(pattern, index)
+        self._link()
+
+    def _add(self, pattern, index):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+            state = next_state
+        self._output[state] += (index,)
+
+    def _link(self):
+        """Breadth-first failure links; each state also inherits its failure state's outputs"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state] += self._output[self._fail[next_state]]
+
+    def iter_matches(self, text):
+        """(pattern index, start position) of every occurrence, in order of end position"""
+        goto, fail, output, patterns = self._goto, self._fail, self._output, self.patterns
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index in output[state]:
+                yield index, position - len(patterns[index]) + 1
+
+
+def _tokens(text):
+    return _TOKEN.findall(text.lower())
+
+
+def token_set_similarity(title_tokens, text_tokens):
+    """
+    Token-set ratio (0-100) of a title against a text: shared tokens compared with the whole
+    title, so word order and extra words in the text don't count and typos count partly.
+    A text holding only some of the title's words scores by how much of the title they cover.
+    """
+    title, text = set(title_tokens), set(text_tokens)
+    shared = ' '.join(sorted(title & text))
+    title_text = (shared + ' ' + ' '.join(sorted(title - text))).strip()
+    other_text = (shared + ' ' + ' '.join(sorted(text - title))).strip()
+    best = SequenceMatcher(None, shared, title_text).ratio() if shared else 0.0
+    matcher = SequenceMatcher(None, title_text, other_text)
+    # The full comparison is the slow one; skip it when even its upper bound can't win
+    if matcher.real_quick_ratio() > best and matcher.quick_ratio() > best:
+        best = max(best, matcher.ratio())
+    return round(100 * best)
+
+
+def fuzzy_tier(score):
+    for threshold, tier in FUZZY_TIERS:
+        if score >= threshold:
+            return tier
+    return None
+
+
+class FuzzyStudyIndex:
+    """
+    MinHash/LSH index over the sentences of every paragraph (and adjacent sentence pairs),
+    so a title's candidate paragraphs are bucket lookups instead of a scan of the table.
+    Built once per import session and reused for every title of the sheet.
+    """
+
+    def __init__(self, perms=MINHASH_PERMS, bands=LSH_BANDS, seed=1):
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 1 << 31, size=perms).astype(np.uint64)
+        self._b = rng.randint(0, 1 << 31, size=perms).astype(np.uint64)
+        self.bands = bands
+        self.rows = perms // bands
+        self.records = []       # every record seen, for reuse within the session
+        self._paragraphs = {}   # study key (paragraph text without one) -> paragraph number
+        self._records_by_paragraph = []
+        self._segments = []     # (paragraph number, start offset, tokens)
+        self._buckets = {}      # (band, band signature) -> segment numbers
+
+    def index_records(self, records):
+        """Index records while passing them through, so the exact pass and indexing share one stream"""
+        for record in records:
+            self.records.append(record)
+            paragraph = record.get('paragraph')
+            if paragraph:
+                self._add(paragraph, record)
+            yield record
+
+    def _add(self, paragraph, record):
+        # Records of one study are indexed once, by its short key rather than its text
+        key = record.get('study_key') or paragraph
+        number = self._paragraphs.get(key)
+        if number is not None:
+            self._records_by_paragraph[number].append(record)
+            return
+        number = self._paragraphs[key] = len(self._records_by_paragraph)
+        self._records_by_paragraph.append([record])
+
+        # Sentences with their offsets; a title may also span two sentences
+        sentences = []
+        start = 0
+        for separator in _SEGMENT_SPLIT.finditer(paragraph):
+            sentences.append((start, paragraph[start:separator.start()]))
+            start = separator.end()
+        sentences.append((start, paragraph[start:]))
+        sentences = [(offset, _tokens(text)) for offset, text in sentences]
+        sentences = [(offset, tokens) for offset, tokens in sentences if tokens]
+        segments = sentences + [
+            (first[0], first[1] + second[1]) for first, second in zip(sentences, sentences[1:])
+        ]
+        for offset, tokens in segments:
+            signature = self._signature(tokens)
+            if signature is None:
+                continue
+            segment = len(self._segments)
+            self._segments.append((number, offset, tokens))
+            for band_key in self._band_keys(signature):
+                self._buckets.setdefault(band_key, []).append(segment)
+
+    def _signature(self, tokens):
+        text = ' '.join(tokens)
+        shingles = {text[i:i + 3] for i in range(len(text) - 2)}
+        if not shingles:
+            return None
+        # crc32 keeps signatures identical across processes (unlike hash())
+        hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles),
+                             dtype=np.uint64, count=len(shingles))
+        return ((np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME).min(axis=0)
+
+    def _band_keys(self, signature):
+        rows = self.rows
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(self.bands)]
+
+    def query(self, title):
+        """[(records sharing the paragraph, score, segment offset)] scoring at least the lowest tier, best first"""
+        tokens = _tokens(title)
+        signature = self._signature(tokens)
+        if signature is None:
+            return []
+        candidates = set()
+        for band_key in self._band_keys(signature):
+            candidates.update(self._buckets.get(band_key, ()))
+
+        title = set(tokens)
+        minimum_shared = len(title) * FUZZY_MIN_SHARED_TOKENS
+        best = {}  # paragraph number -> (score, offset)
+        for segment in candidates:
+            number, offset, segment_tokens = self._segments[segment]
+            # Buckets only promise similar trigrams; most candidates fail this cheap word check
+            if len(title.intersection(segment_tokens)) < minimum_shared:
+                continue
+            score = token_set_similarity(tokens, segment_tokens)
+            if score > best.get(number, (-1, 0))[0]:
+                best[number] = (score, offset)
+        minimum = FUZZY_TIERS[-1][0]
+        results = [
+            (self._records_by_paragraph[number], score, offset)
+            for number, (score, offset) in best.items() if score >= minimum
+        ]
+        results.sort(key=lambda result: -result[1])
+        return results
+
+
+def _match_entry(study_name, normalized, record, confidence, position, percentage):
+    return {
+        'excel_study': study_name,
+        'excel_study_normalized': normalized,
+        'db_record_id': record['id'],
+        'matching_paragraph': record['paragraph'],
+        'criteria': record['criteria'],
+        'energy_method': record['energy_method'],
+        'direction': record['direction'],
+        'scale': record.get('scale'),
+        'climate': record.get('climate'),
+        'location': record.get('location'),
+        'confidence': confidence,
+        'match_position': position,
+        'match_percentage': percentage,
+        'matching_text': normalized
+    }
+
+
+class StudyTitles:
+    """
+    The non-empty titles of an import sheet and one Aho-Corasick automaton over their distinct
+    lower-cased, whitespace-collapsed forms, so any slice of the corpus is matched against
+    every title in a single pass.
+    studies: (study name as in the sheet, normalized name) pairs; empty names are skipped.
+    """
+
+    def __init__(self, studies):
+        self.studies = [(name, normalized) for name, normalized in studies if normalized]
+        pattern_index = {}   # study_text of the title -> automaton pattern index
+        self.patterns = [
+            pattern_index.setdefault(study_text(normalized), len(pattern_index)) for _, normalized in self.studies
+        ]
+        self.automaton = AhoCorasick(pattern_index)
+
+    def exact_hits(self, records):
+        """
+        [(record, first match position)] per automaton pattern over records with a paragraph.
+        Each study (records sharing a study_key) is scanned once, in its whitespace-collapsed
+        form, and its hits apply to all of its records; match positions are in that form.
+        """
+        # study key (paragraph text without one) -> (paragraph, its records in stream order)
+        paragraphs = {}
+        for record in records:
+            paragraph = record.get('paragraph')
+            if not paragraph:
+                continue
+            key = record.get('study_key') or paragraph
+            group = paragraphs.get(key)
+            if group is None:
+                paragraphs[key] = (paragraph, [record])
+            else:
+                group[1].append(record)
+
+        hits = [[] for _ in self.automaton.patterns]
+        for paragraph, paragraph_records in paragraphs.values():
+            first_position = {}
+            for index, start in self.automaton.iter_matches(study_text(paragraph)):
+                first_position.setdefault(index, start)
+            for index, start in first_position.items():
+                hits[index].extend((record, start) for record in paragraph_records)
+        return hits
+
+    def unmatched(self, hits):
+        """Numbers of the studies without an exact hit"""
+        return [number for number, pattern in enumerate(self.patterns) if not hits[pattern]]
+
+    def results(self, hits, fuzzy_hits, unmatched_reason):
+        """
+        (matched_records, unmatched_studies) in the admin review's format, from exact_hits and
+        {study number: FuzzyStudyIndex.query result} for the studies without an exact hit
+        """
+        matched_records = []
+        unmatched_studies = []
+        for number, ((study_name, normalized), pattern) in enumerate(zip(self.studies, self.patterns)):
+            if hits[pattern]:
+                for record, position in hits[pattern]:
+                    matched_records.append(_match_entry(study_name, normalized, record, 'exact_match', position, 100))
+                continue
+            if not fuzzy_hits.get(number):
+                unmatched_studies.append({
+                    'study_name': study_name,
+                    'normalized_name': normalized,
+                    'reason': unmatched_reason
+                })
+                continue
+            for paragraph_records, score, position in fuzzy_hits[number]:
+                for record in paragraph_records:
+                    matched_records.append(
+                        _match_entry(study_name, normalized, record, fuzzy_tier(score), position, score)
+                    )
+        return matched_records, unmatched_studies
+
+
+def match_studies(studies, records, unmatched_reason='No match found in paragraph field', fuzzy_index=None):
+    """
+    Exact, case-insensitive title matching of every study against every paragraph in one pass.
+    studies: (study name as in the sheet, normalized name) pairs; empty names are skipped.
+    records: iterable of energy_data records with MATCH_COLUMNS (e.g. streamed non-rejected rows).
+    With a FuzzyStudyIndex, studies without an exact hit get tiered fuzzy matches from it;
+    the index must already hold the same records or be filled through index_records.
+    Returns (matched_records, unmatched_studies) in the admin review's format.
+    """
+    titles = StudyTitles(studies)
+    hits = titles.exact_hits(records)
+    fuzzy_hits = {}
+    if fuzzy_index is not None:
+        for number in titles.unmatched(hits):
+            fuzzy_hits[number] = fuzzy_index.query(titles.studies[number][1])
+    return titles.results(hits, fuzzy_hits, unmatched_reason)
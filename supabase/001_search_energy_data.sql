@@ -0,0 +1,32 @@
+-- 001_search_energy_data.sql
+-- Full-text search for Supabase mode, used by DatabaseWrapper.search_energy_data.
+-- Run once in the Supabase SQL editor. Until it is applied the app falls back to ilike.
+
+ALTER TABLE energy_data
+    ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        to_tsvector('simple',
+            coalesce(paragraph, '') || ' ' ||
+            coalesce(criteria, '') || ' ' ||
+            coalesce(energy_method, '') || ' ' ||
+            coalesce(location, '') || ' ' ||
+            coalesce(climate, '') || ' ' ||
+            coalesce(building_use, '') || ' ' ||
+            coalesce(approach, ''))
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS energy_data_search_vector_idx
+    ON energy_data USING gin (search_vector);
+
+-- search_query is a to_tsquery expression such as 'urban:* & heat:*'
+CREATE OR REPLACE FUNCTION search_energy_data(search_query text, max_rows integer DEFAULT 100)
+RETURNS SETOF energy_data
+LANGUAGE sql STABLE
+AS $$
+    SELECT *
+    FROM energy_data
+    WHERE search_vector @@ to_tsquery('simple', search_query)
+      AND status IS DISTINCT FROM 'rejected'
+    ORDER BY ts_rank_cd(search_vector, to_tsquery('simple', search_query)) DESC, id DESC
+    LIMIT max_rows;
+$$;
@@ -0,0 +1,11 @@
+-- 002_energy_data_filter_indexes.sql
+-- Indexes for the hot energy_data filter columns (mirrors SQLite migration 2).
+
+CREATE INDEX IF NOT EXISTS idx_energy_data_filter ON energy_data (status, criteria, energy_method, direction);
+CREATE INDEX IF NOT EXISTS idx_energy_data_scale ON energy_data (scale);
+CREATE INDEX IF NOT EXISTS idx_energy_data_climate ON energy_data (climate);
+CREATE INDEX IF NOT EXISTS idx_energy_data_location ON energy_data (location);
+CREATE INDEX IF NOT EXISTS idx_energy_data_building_use ON energy_data (building_use);
+CREATE INDEX IF NOT EXISTS idx_energy_data_approach ON energy_data (approach);
+
+ANALYZE energy_data;
@@ -0,0 +1,42 @@
+-- 003_energy_data_value_counts.sql
+-- Server-side GROUP BY for DatabaseWrapper.get_counts_with_filters / get_distinct_values.
+-- Mirrors emulate_value_counts_rpc in db_wrapper.py: non-empty values of non-rejected rows,
+-- equality filters from a JSON object, optional excluded values, ordered by value.
+
+CREATE OR REPLACE FUNCTION energy_data_value_counts(
+    group_column text,
+    filters jsonb DEFAULT '{}'::jsonb,
+    exclude_values text[] DEFAULT '{}'
+)
+RETURNS TABLE (value text, count bigint)
+LANGUAGE plpgsql STABLE
+AS $$
+DECLARE
+    allowed text[] := ARRAY[
+        'id', 'group_id', 'criteria', 'energy_method', 'direction', 'status', 'user', 'scale',
+        'climate', 'location', 'building_use', 'climate_multi', 'approach', 'sample_size'
+    ];
+    where_sql text := '';
+    filter_key text;
+    filter_value text;
+BEGIN
+    IF group_column = 'id' OR NOT group_column = ANY(allowed) THEN
+        RAISE EXCEPTION 'Cannot count by column: %', group_column;
+    END IF;
+
+    FOR filter_key, filter_value IN SELECT key, j.value FROM jsonb_each_text(filters) AS j LOOP
+        IF NOT filter_key = ANY(allowed) THEN
+            RAISE EXCEPTION 'Cannot filter on column: %', filter_key;
+        END IF;
+        where_sql := where_sql || format(' AND %I::text = %L', filter_key, filter_value);
+    END LOOP;
+
+    RETURN QUERY EXECUTE format(
+        'SELECT %1$I::text, COUNT(*) FROM energy_data
+         WHERE %1$I IS NOT NULL AND %1$I::text <> '''' AND status <> ''rejected''
+           AND NOT (%1$I::text = ANY($1))%2$s
+         GROUP BY %1$I ORDER BY %1$I',
+        group_column, where_sql
+    ) USING exclude_values;
+END;
+$$;
@@ -0,0 +1,39 @@
+-- 004_reserve_id_block.sql
+-- Block id allocation for DatabaseWrapper inserts in Supabase mode.
+-- Each call atomically reserves block_size consecutive ids for a table and returns the first,
+-- so clients hand out ids from a local block instead of reading MAX(id) before every insert.
+-- The counter row is locked for the UPDATE, which serializes concurrent reservations.
+
+CREATE TABLE IF NOT EXISTS id_allocations (
+    table_name text PRIMARY KEY,
+    next_id bigint NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION reserve_id_block(table_name text, block_size integer DEFAULT 50)
+RETURNS bigint
+LANGUAGE plpgsql VOLATILE
+AS $$
+DECLARE
+    allowed text[] := ARRAY['energy_data', 'user_saved_analyses', 'users'];
+    current_max bigint;
+    first_id bigint;
+BEGIN
+    IF NOT (reserve_id_block.table_name = ANY (allowed)) THEN
+        RAISE EXCEPTION 'Cannot reserve ids for table: %', reserve_id_block.table_name;
+    END IF;
+    IF block_size < 1 THEN
+        RAISE EXCEPTION 'block_size must be positive';
+    END IF;
+
+    -- Rows inserted without the allocator (SQL editor, old clients) must never collide
+    EXECUTE format('SELECT COALESCE(MAX(id), 0) FROM %I', reserve_id_block.table_name) INTO current_max;
+
+    INSERT INTO id_allocations AS a (table_name, next_id)
+    VALUES (reserve_id_block.table_name, current_max + 1 + block_size)
+    ON CONFLICT (table_name) DO UPDATE
+        SET next_id = GREATEST(a.next_id, current_max + 1) + block_size
+    RETURNING a.next_id - block_size INTO first_id;
+
+    RETURN first_id;
+END;
+$$;
@@ -0,0 +1,54 @@
+-- 005_energy_data_updated_at.sql
+-- Change tracking for the local read mirror (energy_mirror.py, ENERGY_MIRROR=1).
+-- updated_at lets the mirror pull only rows changed since its watermark;
+-- energy_data_deletions records deleted ids so deletes reach the mirror without a full resync.
+-- Until this is applied the mirror only picks up new ids and resyncs fully every hour.
+
+-- Existing rows get the time of the migration
+ALTER TABLE energy_data
+    ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT now();
+
+CREATE INDEX IF NOT EXISTS energy_data_updated_at_idx ON energy_data (updated_at);
+
+CREATE OR REPLACE FUNCTION energy_data_touch_updated_at()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    NEW.updated_at := now();
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS energy_data_touch_updated_at ON energy_data;
+CREATE TRIGGER energy_data_touch_updated_at
+    BEFORE UPDATE ON energy_data
+    FOR EACH ROW EXECUTE FUNCTION energy_data_touch_updated_at();
+
+CREATE TABLE IF NOT EXISTS energy_data_deletions (
+    id bigint NOT NULL,
+    deleted_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS energy_data_deletions_deleted_at_idx ON energy_data_deletions (deleted_at);
+
+CREATE OR REPLACE FUNCTION energy_data_log_deletion()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+BEGIN
+    INSERT INTO energy_data_deletions (id) VALUES (OLD.id);
+    RETURN OLD;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS energy_data_log_deletion ON energy_data;
+CREATE TRIGGER energy_data_log_deletion
+    AFTER DELETE ON energy_data
+    FOR EACH ROW EXECUTE FUNCTION energy_data_log_deletion();
+
+-- The mirror reads the log with the same key it uses for energy_data
+ALTER TABLE energy_data_deletions ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS energy_data_deletions_read ON energy_data_deletions;
+CREATE POLICY energy_data_deletions_read ON energy_data_deletions FOR SELECT USING (true);
@@ -0,0 +1,44 @@
+-- 006_energy_data_study_key.sql
+-- Study identity: study counts in energy_facet_counts (007), study matching and the papers tab.
+-- study_key is the md5 of the paragraph lower-cased with whitespace collapsed, NULL for
+-- empty paragraphs; it mirrors study_key() in energy_record.py and is set on every write
+-- by a trigger, so clients never send it. Whitespace is the explicit class of
+-- STUDY_WHITESPACE_CLASS (NBSP and the other Unicode spaces), not \s.
+-- Safe to re-run: the backfill only rewrites keys that changed.
+-- Until this is applied DatabaseWrapper leaves study_key out of its selects and the read
+-- mirror computes the keys itself.
+
+ALTER TABLE energy_data ADD COLUMN IF NOT EXISTS study_key text;
+
+CREATE OR REPLACE FUNCTION energy_data_study_key(paragraph text)
+RETURNS text
+LANGUAGE sql IMMUTABLE
+AS $$
+    SELECT CASE
+        WHEN normalized IS NULL OR normalized IN ('', '0', '0.0') THEN NULL
+        ELSE md5(normalized)
+    END
+    FROM (SELECT lower(btrim(regexp_replace(paragraph, '[\u0009-\u000d\u001c-\u0020\u0085\u00a0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000]+', ' ', 'g'))) AS normalized) AS n;
+$$;
+
+CREATE OR REPLACE FUNCTION energy_data_set_study_key()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    NEW.study_key := energy_data_study_key(NEW.paragraph);
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS energy_data_set_study_key ON energy_data;
+CREATE TRIGGER energy_data_set_study_key
+    BEFORE INSERT OR UPDATE OF paragraph ON energy_data
+    FOR EACH ROW EXECUTE FUNCTION energy_data_set_study_key();
+
+-- Backfill (also bumps updated_at, so the read mirror picks the keys up)
+UPDATE energy_data
+SET study_key = energy_data_study_key(paragraph)
+WHERE study_key IS DISTINCT FROM energy_data_study_key(paragraph);
+
+CREATE INDEX IF NOT EXISTS energy_data_study_key_idx ON energy_data (study_key, status);
@@ -0,0 +1,64 @@
+-- 007_energy_facet_counts.sql
+-- Materialized (facet, value, record_count, study_count) aggregate for DatabaseWrapper.get_facet_counts
+-- (statistics tab), and the (facet, value, study_key) members it is rolled up from, read through
+-- energy_facet_study_keys() by DatabaseWrapper.get_facet_study_keys. Same rows as the
+-- trigger-maintained SQLite tables built from facet_counts.FACETS: non-rejected records with a
+-- non-empty value, study_key '' for records without one, study_count = members with a study_key (006).
+-- DatabaseWrapper calls refresh_energy_facet_counts() after its own writes and every few minutes.
+
+DROP MATERIALIZED VIEW IF EXISTS energy_facet_counts;
+DROP MATERIALIZED VIEW IF EXISTS energy_facet_members;
+
+CREATE MATERIALIZED VIEW energy_facet_members AS
+SELECT f.facet, f.value, COALESCE(e.study_key, '') AS study_key, COUNT(*) AS record_count
+FROM energy_data e
+CROSS JOIN LATERAL (VALUES
+    ('records', 'all'),
+    ('criteria', e.criteria),
+    ('energy_method', e.energy_method),
+    ('climate', e.climate),
+    ('scale', e.scale),
+    ('location', e.location),
+    ('building_use', e.building_use),
+    ('approach', e.approach)
+) AS f(facet, value)
+WHERE e.status IS DISTINCT FROM 'rejected' AND f.value IS NOT NULL AND f.value <> ''
+GROUP BY 1, 2, 3;
+
+CREATE MATERIALIZED VIEW energy_facet_counts AS
+SELECT facet, value, SUM(record_count)::bigint AS record_count,
+       COUNT(*) FILTER (WHERE study_key <> '') AS study_count
+FROM energy_facet_members
+GROUP BY facet, value;
+
+-- Required by REFRESH ... CONCURRENTLY, which keeps the views readable during a refresh
+CREATE UNIQUE INDEX energy_facet_members_key ON energy_facet_members (facet, value, study_key);
+CREATE UNIQUE INDEX energy_facet_counts_key ON energy_facet_counts (facet, value);
+
+GRANT SELECT ON energy_facet_members TO anon, authenticated;
+GRANT SELECT ON energy_facet_counts TO anon, authenticated;
+
+-- Members first: the counts are rolled up from them
+CREATE OR REPLACE FUNCTION refresh_energy_facet_counts()
+RETURNS void
+LANGUAGE sql
+SECURITY DEFINER
+AS $$
+    REFRESH MATERIALIZED VIEW CONCURRENTLY energy_facet_members;
+    REFRESH MATERIALIZED VIEW CONCURRENTLY energy_facet_counts;
+$$;
+
+-- {value: [study keys]} of one facet as a single JSON value, so it is one request
+-- whatever the number of members (PostgREST caps rows per response)
+CREATE OR REPLACE FUNCTION energy_facet_study_keys(facet_name text)
+RETURNS jsonb
+LANGUAGE sql STABLE
+AS $$
+    SELECT COALESCE(jsonb_object_agg(value, study_keys), '{}'::jsonb)
+    FROM (
+        SELECT value, jsonb_agg(study_key) AS study_keys
+        FROM energy_facet_members
+        WHERE facet = facet_name AND study_key <> ''
+        GROUP BY value
+    ) AS v;
+$$;
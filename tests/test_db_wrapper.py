@@ -0,0 +1,157 @@
+# test_db_wrapper.py
+import sqlite3
+
+import pytest
+
+from db_wrapper import MISSING_RECORD_ERROR, DatabaseWrapper
+from query_cache import QueryCache
+from energy_record import ENERGY_DATA_COLUMNS
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / 'energy.db')
+    conn = sqlite3.connect(path)
+    columns = ', '.join(c for c in ENERGY_DATA_COLUMNS if c != 'id')
+    conn.execute(f"CREATE TABLE energy_data (id INTEGER PRIMARY KEY, {columns})")
+    conn.executemany("INSERT INTO energy_data (paragraph, location) VALUES (?, ?)",
+                     [('Study A.', 'Paris'), ('Study B.', 'Berlin')])
+    conn.commit()
+    conn.close()
+    return DatabaseWrapper(path, use_supabase=False)
+
+
+def test_update_records_bulk_reports_missing_ids(db):
+    result = db.update_records_bulk('energy_data', [
+        (1, {'location': 'Lyon'}),
+        (999999, {'location': 'Nowhere'}),
+        (2, {'location': 'Bonn', 'scale': 'Urban'}),
+    ])
+    assert result == {'updated': [1, 2], 'failed': [(999999, MISSING_RECORD_ERROR)]}
+    rows = db.conn.execute("SELECT id, location, scale FROM energy_data ORDER BY id").fetchall()
+    assert [tuple(row) for row in rows] == [(1, 'Lyon', None), (2, 'Bonn', 'Urban')]
+
+
+class FakeUpdate:
+    """PostgREST update chain over a set of existing ids, recording each request"""
+
+    def __init__(self, client, fields):
+        self.client, self.fields = client, fields
+
+    def in_(self, column, ids):
+        self.ids = list(ids)
+        return self
+
+    def eq(self, column, record_id):
+        self.ids = [record_id]
+        return self
+
+    def execute(self):
+        self.client.requests.append((self.fields, self.ids))
+        if any(record_id in self.client.broken for record_id in self.ids):
+            raise Exception('constraint violated')
+
+        class Result:
+            data = [{'id': record_id} for record_id in self.ids if record_id in self.client.existing]
+        return Result()
+
+
+class FakeSupabase:
+    def __init__(self, existing, broken=()):
+        self.existing, self.broken = set(existing), set(broken)
+        self.requests = []
+
+    def table(self, name):
+        client = self
+
+        class Table:
+            def update(self, fields):
+                return FakeUpdate(client, fields)
+        return Table()
+
+
+def supabase_wrapper(client):
+    db = DatabaseWrapper.__new__(DatabaseWrapper)
+    db.use_supabase = True
+    db.supabase = client
+    db._mirror = None
+    db._after_write = lambda table: None
+    return db
+
+
+def test_supabase_update_groups_identical_fields_and_never_upserts():
+    client = FakeSupabase(existing=[1, 2, 3])
+    result = supabase_wrapper(client).update_records_bulk('energy_data', [
+        (1, {'status': 'approved'}), (2, {'status': 'approved'}), (9, {'status': 'approved'}),
+        (3, {'location': 'Paris'}),
+    ])
+    assert client.requests == [({'status': 'approved'}, [1, 2, 9]), ({'location': 'Paris'}, [3])]
+    assert result == {'updated': [1, 2, 3], 'failed': [(9, MISSING_RECORD_ERROR)]}
+
+
+def test_supabase_update_retries_a_failing_chunk_row_by_row():
+    client = FakeSupabase(existing=[1, 2], broken=[2])
+    result = supabase_wrapper(client).update_records_bulk('energy_data', [
+        (1, {'status': 'approved'}), (2, {'status': 'approved'}),
+    ])
+    assert result == {'updated': [1], 'failed': [(2, 'constraint violated')]}
+
+
+class FakeRpc:
+    def __init__(self, client, name, params):
+        self.client, self.name, self.params = client, name, params
+
+    def execute(self):
+        self.client.requests.append((self.name, self.params))
+        if self.name not in self.client.functions:
+
+            class Missing(Exception):
+                pass
+            raise Missing(f"Could not find the function public.{self.name}")
+
+        class Result:
+            data = self.client.functions[self.name]
+        return Result()
+
+
+class FakeRpcSupabase:
+    def __init__(self, functions):
+        self.functions = functions
+        self.requests = []
+
+    def rpc(self, name, params):
+        return FakeRpc(self, name, params)
+
+
+def rpc_wrapper(client, missing_columns=()):
+    db = supabase_wrapper(client)
+    db._cache = QueryCache()
+    db._facets_refreshed = None
+    db._missing_remote_columns = tuple(missing_columns)
+    return db
+
+
+def test_supabase_facet_study_keys_come_from_the_members_function():
+    client = FakeRpcSupabase({
+        'refresh_energy_facet_counts': None,
+        'energy_facet_study_keys': {'Cfb': ['a', 'b'], 'Dfa': ['a']},
+    })
+    keys = rpc_wrapper(client).get_facet_study_keys('climate')
+    assert keys == {'Cfb': ('a', 'b'), 'Dfa': ('a',)}
+    assert ('energy_facet_study_keys', {'facet_name': 'climate'}) in client.requests
+
+
+def test_supabase_facet_study_keys_unavailable():
+    # Before 006 no request is made; before 007 the missing function is reported as None
+    client = FakeRpcSupabase({})
+    assert rpc_wrapper(client, missing_columns=['study_key']).get_facet_study_keys('scale') is None
+    assert client.requests == []
+    assert rpc_wrapper(client).get_facet_study_keys('scale') is None
+
+
+def test_sqlite_facet_study_keys(db):
+    db.conn.execute("UPDATE energy_data SET climate = 'Cfb'")
+    db.conn.commit()
+    keys = db.get_facet_study_keys('climate')
+    assert list(keys) == ['Cfb']
+    assert len(set(keys['Cfb'])) == 2
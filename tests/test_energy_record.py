@@ -0,0 +1,34 @@
+# test_energy_record.py
+import os
+import re
+import sys
+
+import pytest
+
+from energy_record import STUDY_WHITESPACE_CLASS, study_key, study_text
+
+MIGRATION = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         'supabase', '006_energy_data_study_key.sql')
+
+
+def test_nbsp_is_collapsed_like_a_space():
+    assert study_text('Smith (2020).\u00a0 Urban\u00a0form\u00a0') == 'smith (2020). urban form'
+    assert study_key('Smith (2020). Urban\u00a0form') == study_key('smith (2020).\n urban   form')
+
+
+def test_whitespace_class_is_python_whitespace():
+    whitespace = re.compile(STUDY_WHITESPACE_CLASS)
+    for code in range(sys.maxunicode + 1):
+        char = chr(code)
+        assert bool(whitespace.fullmatch(char)) == char.isspace(), hex(code)
+
+
+def test_supabase_key_function_uses_the_same_class():
+    with open(MIGRATION, encoding='utf-8') as migration:
+        sql = migration.read()
+    assert f"regexp_replace(paragraph, '{STUDY_WHITESPACE_CLASS}+', ' ', 'g')" in sql
+
+
+@pytest.mark.parametrize('paragraph', [None, '', '   ', '0', '0.0'])
+def test_empty_paragraphs_have_no_key(paragraph):
+    assert study_key(paragraph) is None
@@ -0,0 +1,46 @@
+# test_energy_snapshot.py
+import sqlite3
+
+import pytest
+
+from db_wrapper import DatabaseWrapper
+from energy_record import ENERGY_DATA_COLUMNS
+from energy_snapshot import get_energy_snapshot, invalidate_energy_snapshot
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / 'energy.db')
+    conn = sqlite3.connect(path)
+    columns = ', '.join(c for c in ENERGY_DATA_COLUMNS if c != 'id')
+    conn.execute(f"CREATE TABLE energy_data (id INTEGER PRIMARY KEY, {columns})")
+    conn.executemany("INSERT INTO energy_data (paragraph, criteria, status) VALUES (?, ?, ?)",
+                     [('Study A.', 'Density', None), ('Study B.', 'Height', None)])
+    conn.commit()
+    conn.close()
+    invalidate_energy_snapshot()
+    yield DatabaseWrapper(path, use_supabase=False), path
+    invalidate_energy_snapshot()
+
+
+def test_data_version_sees_updates_from_other_connections(db):
+    wrapper, path = db
+    before = wrapper.get_data_version()
+    other = sqlite3.connect(path)
+    other.execute("UPDATE energy_data SET status = 'rejected' WHERE id = 1")
+    other.commit()
+    other.close()
+    after = wrapper.get_data_version()
+    assert after[:2] == before[:2]
+    assert after != before
+
+
+def test_snapshot_reloads_after_outside_update(db, monkeypatch):
+    wrapper, path = db
+    monkeypatch.setattr('energy_snapshot.VERSION_CHECK_INTERVAL', 0.0)
+    assert len(get_energy_snapshot(wrapper).valid_records()) == 2
+    other = sqlite3.connect(path)
+    other.execute("UPDATE energy_data SET status = 'rejected' WHERE id = 1")
+    other.commit()
+    other.close()
+    assert [r['id'] for r in get_energy_snapshot(wrapper).valid_records()] == [2]
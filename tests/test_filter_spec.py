@@ -0,0 +1,201 @@
+# test_filter_spec.py
+import sqlite3
+
+import pytest
+
+from energy_record import ENERGY_DATA_COLUMNS
+import filter_spec
+from filter_spec import COMPILED_SQL_CACHE_SIZE, FilterSpec
+
+ROWS = [
+    {'id': 1, 'criteria': 'Density', 'status': 'approved', 'location': 'Sydney', 'scale': 'Urban'},
+    {'id': 2, 'criteria': 'Density', 'status': 'rejected', 'location': 'Berlin', 'scale': 'Urban'},
+    {'id': 3, 'criteria': 'Height', 'status': None, 'location': '', 'scale': 'Awaiting data'},
+    {'id': 4, 'criteria': 'Height', 'status': 'pending', 'location': None, 'scale': None},
+    {'id': 5, 'criteria': 'Street "width"', 'status': None, 'location': 'Paris', 'scale': 'Block(s)'},
+]
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    columns = ', '.join(c for c in ENERGY_DATA_COLUMNS if c != 'id')
+    conn.execute(f"CREATE TABLE energy_data (id INTEGER PRIMARY KEY, {columns})")
+    for row in ROWS:
+        conn.execute(
+            f"INSERT INTO energy_data ({', '.join(row)}) VALUES ({', '.join('?' for _ in row)})",
+            tuple(row.values())
+        )
+    yield conn
+    conn.close()
+
+
+def ids(conn, spec, **kwargs):
+    sql, params = spec.select_sql('id', order_by='id', **kwargs)
+    return [row[0] for row in conn.execute(sql, params)]
+
+
+class RecordingQuery:
+    """Stand-in for a PostgREST query builder that records the chain"""
+
+    def __init__(self):
+        self.calls = []
+
+    @property
+    def not_(self):
+        self.calls.append(('not',))
+        return self
+
+    def __getattr__(self, name):
+        def method(*args):
+            self.calls.append((name,) + args)
+            return self
+        return method
+
+
+# ============= SQLITE =============
+
+def test_empty_spec_selects_everything(conn):
+    assert FilterSpec().where_sql() == ("", [])
+    assert ids(conn, FilterSpec()) == [1, 2, 3, 4, 5]
+
+
+def test_terms_are_anded(conn):
+    spec = FilterSpec().eq('criteria', 'Density').not_rejected()
+    assert spec.where_sql() == (
+        " WHERE criteria = ? AND (status != 'rejected' OR status IS NULL)", ['Density']
+    )
+    assert ids(conn, spec) == [1]
+
+
+def test_not_rejected_keeps_null_status(conn):
+    assert ids(conn, FilterSpec().not_rejected()) == [1, 3, 4, 5]
+
+
+def test_in_and_not_in(conn):
+    assert ids(conn, FilterSpec().in_('location', ['Sydney', 'Paris'])) == [1, 5]
+    assert ids(conn, FilterSpec().not_in('location', ['Sydney', 'Paris'])) == [2, 3]
+    # Empty lists match nothing / everything
+    assert ids(conn, FilterSpec().in_('location', [])) == []
+    assert ids(conn, FilterSpec().not_in('location', [])) == [1, 2, 3, 4, 5]
+
+
+def test_present_and_missing(conn):
+    assert ids(conn, FilterSpec().present('location')) == [1, 2, 5]
+    assert ids(conn, FilterSpec().missing('location')) == [3, 4]
+    assert ids(conn, FilterSpec().missing('scale', ['Awaiting data'])) == [3, 4]
+
+
+def test_any_of(conn):
+    spec = FilterSpec().not_rejected().any_of(
+        FilterSpec().missing('scale', ['Awaiting data']),
+        {'location': 'Paris'},
+    )
+    assert ids(conn, spec) == [3, 4, 5]
+
+
+def test_id_range_and_limit(conn):
+    assert ids(conn, FilterSpec().id_range(after=1, until=4)) == [2, 3, 4]
+    assert ids(conn, FilterSpec().id_range(after=2), limit=2) == [3, 4]
+
+
+def test_ilike_is_case_insensitive(conn):
+    assert ids(conn, FilterSpec().ilike('criteria', '%HEIGHT%')) == [3, 4]
+
+
+def test_count_sql(conn):
+    sql, params = FilterSpec().not_rejected().count_sql('criteria')
+    assert conn.execute(sql, params).fetchall() == [('Density', 1), ('Height', 2), ('Street "width"', 1)]
+
+
+def test_same_shape_reuses_sql_text():
+    first, first_params = FilterSpec().eq('criteria', 'Density').select_sql('id', limit=10)
+    second, second_params = FilterSpec().eq('criteria', 'Height').select_sql('id', limit=20)
+    assert first is second
+    assert first_params == ['Density', 10]
+    assert second_params == ['Height', 20]
+
+
+def test_in_lists_of_different_length_compile_separately():
+    two = FilterSpec().in_('scale', ['a', 'b']).where_sql()[0]
+    three = FilterSpec().in_('scale', ['a', 'b', 'c']).where_sql()[0]
+    assert two.count('?') == 2
+    assert three.count('?') == 3
+
+
+def test_compiled_sql_cache_is_bounded():
+    for count in range(COMPILED_SQL_CACHE_SIZE + 50):
+        FilterSpec().in_('location', range(count)).select_sql('id')
+    assert filter_spec._where_sql.cache_info().currsize <= COMPILED_SQL_CACHE_SIZE
+    assert filter_spec._select_sql.cache_info().currsize <= COMPILED_SQL_CACHE_SIZE
+
+
+def test_unknown_column_is_rejected():
+    with pytest.raises(ValueError):
+        FilterSpec().eq('criteria; DROP TABLE energy_data', 'x')
+
+
+# ============= IDENTITY =============
+
+def test_cache_key_includes_values_and_shape_does_not():
+    density = FilterSpec().eq('criteria', 'Density')
+    height = FilterSpec().eq('criteria', 'Height')
+    assert density.shape() == height.shape()
+    assert density.cache_key() != height.cache_key()
+    assert FilterSpec.from_filters({'criteria': 'Density', 'scale': ''}).cache_key() == density.cache_key()
+
+
+def test_from_filters_copies_a_spec():
+    spec = FilterSpec().eq('criteria', 'Density')
+    copy = FilterSpec.from_filters(spec).not_rejected()
+    assert len(spec.terms) == 1
+    assert len(copy.terms) == 2
+
+
+# ============= POSTGREST =============
+
+def test_apply_simple_terms():
+    spec = (FilterSpec().eq('criteria', 'Density').neq('scale', 'Urban')
+            .in_('location', ['Sydney', 'Paris']).ilike('criteria', '%den%').id_range(after=10, until=20))
+    query = spec.apply(RecordingQuery())
+    assert query.calls == [
+        ('eq', 'criteria', 'Density'),
+        ('neq', 'scale', 'Urban'),
+        ('in_', 'location', ['Sydney', 'Paris']),
+        ('ilike', 'criteria', '%den%'),
+        ('gt', 'id', 10),
+        ('lte', 'id', 20),
+    ]
+
+
+def test_apply_negations():
+    query = FilterSpec().not_in('scale', ['Urban']).present('location').apply(RecordingQuery())
+    assert query.calls == [
+        ('not',), ('in_', 'scale', ['Urban']),
+        ('not',), ('is_', 'location', 'null'), ('neq', 'location', ''),
+    ]
+    # An empty NOT IN adds nothing
+    assert FilterSpec().not_in('scale', []).apply(RecordingQuery()).calls == []
+
+
+def test_apply_or_terms():
+    spec = FilterSpec().not_rejected().missing('scale', ['Awaiting data'])
+    assert spec.apply(RecordingQuery()).calls == [
+        ('or_', 'status.neq.rejected,status.is.null'),
+        ('or_', 'scale.is.null,scale.eq."",scale.in.("Awaiting data")'),
+    ]
+
+
+def test_apply_any_of():
+    spec = FilterSpec().any_of(
+        FilterSpec().missing('scale'),
+        FilterSpec().eq('location', 'Paris').eq('criteria', 'Density'),
+    )
+    assert spec.apply(RecordingQuery()).calls == [
+        ('or_', 'or(scale.is.null,scale.eq.""),and(location.eq."Paris",criteria.eq."Density")'),
+    ]
+
+
+def test_postgrest_values_are_quoted():
+    condition = FilterSpec().eq('criteria', 'Street "width", (a\\b)').postgrest_condition()
+    assert condition == 'criteria.eq."Street \\"width\\", (a\\\\b)"'
@@ -0,0 +1,157 @@
+# test_import_reader.py
+import io
+import zipfile
+
+import pandas as pd
+import pytest
+
+from import_reader import ImportSheet, detect_study_column, import_columns, sniff_format
+
+
+def rows(sheet, columns=None, batch_size=2):
+    batches = list(sheet.iter_batches(columns, batch_size=batch_size))
+    assert all(len(batch) <= batch_size for batch in batches)
+    frame = pd.concat(batches) if batches else pd.DataFrame()
+    return [[None if pd.isna(value) else value for value in row] for row in frame.values.tolist()]
+
+
+def xlsx_file(sheet_rows, blank_styled_rows=0):
+    from openpyxl import Workbook
+    from openpyxl.styles import PatternFill
+
+    workbook = Workbook()
+    worksheet = workbook.active
+    for row in sheet_rows:
+        worksheet.append(row)
+    # Formatting-only rows past the data, as left behind by spreadsheet editors
+    fill = PatternFill(fill_type='solid', start_color='FFFF00')
+    for offset in range(blank_styled_rows):
+        for column in range(1, len(sheet_rows[0]) + 1):
+            worksheet.cell(row=len(sheet_rows) + 1 + offset, column=column).fill = fill
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+
+# ============= CSV =============
+
+def test_csv_comma_utf8():
+    sheet = ImportSheet(io.BytesIO('Study Title,Location\nA,Sydney\nB,Zürich\n'.encode('utf-8')))
+    assert sheet.format == 'csv'
+    assert sheet.columns == ['Study Title', 'Location']
+    assert rows(sheet) == [['A', 'Sydney'], ['B', 'Zürich']]
+
+
+def test_csv_utf8_bom_is_not_part_of_the_header():
+    sheet = ImportSheet(io.BytesIO('﻿Study,Climate\nA,Cfb\n'.encode('utf-8')))
+    assert sheet.columns == ['Study', 'Climate']
+
+
+@pytest.mark.parametrize('delimiter', [';', '\t', '|'])
+def test_csv_delimiter_is_sniffed(delimiter):
+    text = delimiter.join(['Study', 'Location', 'Scale']) + '\n' + delimiter.join(['A, 2020', 'Paris', 'Urban']) + '\n'
+    sheet = ImportSheet(io.BytesIO(text.encode('utf-8')))
+    assert sheet.columns == ['Study', 'Location', 'Scale']
+    assert rows(sheet) == [['A, 2020', 'Paris', 'Urban']]
+
+
+def test_csv_latin1_falls_back():
+    data = 'Study;Location\nÉtude;Besançon\nB;Malmö\n'.encode('latin-1')
+    sheet = ImportSheet(io.BytesIO(data))
+    assert sheet.columns == ['Study', 'Location']
+    assert rows(sheet) == [['Étude', 'Besançon'], ['B', 'Malmö']]
+
+
+def test_csv_projection_and_empty_cells():
+    sheet = ImportSheet(io.BytesIO(b'Study,Notes,Climate\nA,x,\nB,y,Cfa\nC,z,Dfb\n'))
+    assert rows(sheet, ['Study', 'Climate']) == [['A', None], ['B', 'Cfa'], ['C', 'Dfb']]
+    with pytest.raises(ValueError):
+        list(sheet.iter_batches(['Missing']))
+
+
+# ============= XLSX =============
+
+def test_xlsx_trailing_styled_rows_are_skipped():
+    sheet = ImportSheet(xlsx_file([
+        ['Study', 'Location', 'Sample size'],
+        ['A', 'Sydney', 120],
+        ['B', None, 4.5],
+    ], blank_styled_rows=5))
+    assert sheet.format == 'xlsx'
+    assert sheet.columns == ['Study', 'Location', 'Sample size']
+    assert rows(sheet) == [['A', 'Sydney', '120'], ['B', None, '4.5']]
+
+
+def test_xlsx_rows_empty_in_the_requested_columns_are_skipped():
+    sheet = ImportSheet(xlsx_file([
+        ['Study', 'Notes'],
+        ['A', 'x'],
+        [None, 'only notes'],
+        ['B', None],
+    ]))
+    batches = list(sheet.iter_batches(['Study'], batch_size=1))
+    assert [batch.index.tolist() for batch in batches] == [[0], [1]]
+    assert rows(sheet, ['Study']) == [['A'], ['B']]
+
+
+def test_xlsx_header_names_match_pandas():
+    sheet = ImportSheet(xlsx_file([['Study', None, 'Study'], ['A', 'b', 'c']]))
+    assert sheet.columns == ['Study', 'Unnamed: 1', 'Study.1']
+    assert len(sheet.preview) == 1
+
+
+# ============= FORMAT SNIFFING =============
+
+def test_legacy_xls_is_rejected():
+    data = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1' + b'\x00' * 504
+    with pytest.raises(ValueError, match='Legacy .xls'):
+        ImportSheet(io.BytesIO(data))
+
+
+def test_unknown_zip_is_rejected():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('readme.txt', 'not a spreadsheet')
+    with pytest.raises(ValueError, match='Unrecognised spreadsheet archive'):
+        sniff_format(buffer)
+
+
+def test_format_comes_from_content_and_rewinds():
+    buffer = xlsx_file([['Study'], ['A']])
+    buffer.seek(10)
+    assert sniff_format(buffer) == 'xlsx'
+    assert buffer.tell() == 0
+
+
+# ============= COLUMNS =============
+
+def test_study_and_metadata_columns():
+    columns = ['Notes', 'Paper title', 'Site', 'Climate zone', 'Building type', 'n']
+    assert detect_study_column(columns) == 'Paper title'
+    assert import_columns(columns) == ['Paper title', 'Site', 'Climate zone', 'Building type', 'n']
+    assert import_columns(columns, study_column='Notes')[0] == 'Notes'
+
+
+# ============= ODS =============
+
+def ods_file(frame):
+    buffer = io.BytesIO()
+    frame.to_excel(buffer, engine='odf', index=False)
+    buffer.seek(0)
+    return buffer
+
+
+def test_ods_is_read_as_text_batches():
+    pytest.importorskip('odf')
+    sheet = ImportSheet(ods_file(pd.DataFrame({
+        'Study': ['A', 'B', None, 'C'],
+        'Climate': ['Cfb', None, 'Dfa', 'Csa'],
+        'Sample size': [120, 4.5, None, 7],
+    })))
+    assert sheet.format == 'ods'
+    assert sheet.columns == ['Study', 'Climate', 'Sample size']
+    assert len(sheet.preview) == 4
+    assert rows(sheet, ['Study', 'Sample size'], batch_size=3) == [
+        ['A', '120'], ['B', '4.5'], [None, None], ['C', '7'],
+    ]
@@ -0,0 +1,38 @@
+# test_match_jobs.py
+import time
+
+from match_jobs import MatchJob
+from study_matcher import FuzzyStudyIndex, match_studies
+
+
+def records():
+    return [
+        {'id': number, 'paragraph': f'Author {number % 7} (2020). Urban form study {number % 7}. Journal.',
+         'study_key': f'study-{number % 7}', 'criteria': 'Density', 'energy_method': 'Simulation',
+         'direction': 'Increase', 'scale': None, 'climate': None, 'location': None}
+        for number in range(1, 41)
+    ]
+
+
+def entry_key(entry):
+    return (entry['excel_study'], entry['db_record_id'], entry['confidence'],
+            entry['match_percentage'], entry['match_position'])
+
+
+def test_sliced_corpus_matches_like_a_single_pass():
+    studies = [(f'Urban form study {n}', f'urban form study {n}') for n in range(7)]
+    studies += [('Urban form studdy 3 journal', 'urban form studdy 3 journal'), ('Unknown', 'unknown')]
+    index = FuzzyStudyIndex()
+    expected, expected_unmatched = match_studies(studies, index.index_records(records()), 'none', index)
+
+    job = MatchJob('test', studies, records, 'none', workers=2, chunk_size=2, slice_size=6).start()
+    deadline = time.monotonic() + 60
+    while not job.finished and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    assert job.status == 'done', job.error
+    assert sorted(map(entry_key, job.matched_records)) == sorted(map(entry_key, expected))
+    assert job.unmatched_studies == expected_unmatched
+    done, total, found = job.progress()
+    assert done == total
+    assert found == len(expected)
@@ -0,0 +1,27 @@
+# test_stats.py
+from stats import facet_studies, merge_study_counts
+
+
+def test_merged_values_count_each_study_once():
+    counts = merge_study_counts([('Density', ('a', 'b')), ('Density', ('b', 'c')), ('Height', ('a',))])
+    assert counts == {'Density': 3, 'Height': 1}
+
+
+def test_record_counts_are_summed():
+    assert merge_study_counts([('Urban', 4), ('Urban', 2), ('Block', 1)]) == {'Urban': 6, 'Block': 1}
+
+
+class FakeDatabase:
+    def __init__(self, study_keys):
+        self.study_keys = study_keys
+
+    def get_facet_study_keys(self, facet):
+        return self.study_keys
+
+    def get_counts_with_filters(self, facet):
+        return {'Urban': 5}
+
+
+def test_facet_studies_falls_back_to_record_counts():
+    assert facet_studies(FakeDatabase({'Urban': ('a',)}), 'scale') == {'Urban': ('a',)}
+    assert facet_studies(FakeDatabase(None), 'scale') == {'Urban': 5}
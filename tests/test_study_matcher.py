@@ -0,0 +1,181 @@
+# test_study_matcher.py
+import pytest
+
+from study_matcher import (AhoCorasick, FuzzyStudyIndex, fuzzy_tier, match_studies,
+                           token_set_similarity)
+
+TITLE = 'Urban form and residential energy use'
+
+
+def record(record_id, paragraph, study_key=None):
+    return {
+        'id': record_id, 'paragraph': paragraph, 'study_key': study_key,
+        'criteria': 'Density', 'energy_method': 'Simulation', 'direction': 'Increase',
+        'scale': None, 'climate': None, 'location': None,
+    }
+
+
+def tokens(text):
+    return text.lower().split()
+
+
+# ============= AHO-CORASICK =============
+
+def test_overlapping_patterns():
+    automaton = AhoCorasick(['he', 'she', 'his', 'hers'])
+    assert sorted(automaton.iter_matches('ushers')) == [(0, 2), (1, 1), (3, 2)]
+
+
+def test_pattern_inside_another():
+    automaton = AhoCorasick(['urban heat', 'heat', 'urban heat island'])
+    matches = list(automaton.iter_matches('the urban heat island effect'))
+    assert sorted(matches) == [(0, 4), (1, 10), (2, 4)]
+
+
+def test_repeated_occurrences_in_order_of_end():
+    automaton = AhoCorasick(['aa', 'a'])
+    assert list(automaton.iter_matches('aaa')) == [(1, 0), (0, 0), (1, 1), (0, 1), (1, 2)]
+
+
+def test_empty_pattern_never_matches():
+    automaton = AhoCorasick(['', 'x'])
+    assert list(automaton.iter_matches('xx')) == [(1, 0), (1, 1)]
+
+
+def test_no_match():
+    assert list(AhoCorasick(['cooling']).iter_matches('heating demand')) == []
+
+
+# ============= MATCH_STUDIES =============
+
+def test_match_is_case_insensitive_with_position():
+    records = [record(1, 'Smith (2020). Urban Form And Energy Use. Journal of Cities.')]
+    matched, unmatched = match_studies([('Urban form and energy use', 'urban form and energy use')], records)
+    assert unmatched == []
+    assert len(matched) == 1
+    assert matched[0]['db_record_id'] == 1
+    assert matched[0]['confidence'] == 'exact_match'
+    assert matched[0]['match_position'] == len('Smith (2020). ')
+    assert matched[0]['match_percentage'] == 100
+
+
+def test_position_is_in_whitespace_collapsed_text():
+    records = [record(1, 'Smith  (2020).\n Urban form and energy use.')]
+    matched, _ = match_studies([('Urban form', 'urban   form')], records)
+    assert matched[0]['match_position'] == len('smith (2020). ')
+
+
+def test_first_occurrence_per_paragraph():
+    records = [record(1, 'Density. A later mention of density.')]
+    matched, _ = match_studies([('Density', 'density')], records)
+    assert [entry['match_position'] for entry in matched] == [0]
+
+
+def test_repeated_titles_in_the_sheet():
+    records = [record(1, 'Compact cities and heat.'), record(2, 'Unrelated paragraph.')]
+    studies = [('Compact cities', 'compact cities'), ('COMPACT CITIES', 'compact cities')]
+    matched, unmatched = match_studies(studies, records)
+    assert unmatched == []
+    assert [(entry['excel_study'], entry['db_record_id']) for entry in matched] == [
+        ('Compact cities', 1), ('COMPACT CITIES', 1),
+    ]
+
+
+def test_overlapping_titles_both_match():
+    records = [record(1, 'Effects of urban heat island mitigation.')]
+    studies = [('Urban heat', 'urban heat'), ('Urban heat island mitigation', 'urban heat island mitigation')]
+    matched, _ = match_studies(studies, records)
+    assert [(entry['excel_study'], entry['match_position']) for entry in matched] == [
+        ('Urban heat', 11), ('Urban heat island mitigation', 11),
+    ]
+
+
+def test_hits_apply_to_every_record_of_a_study():
+    records = [
+        record(1, 'Study A. Building height.', study_key='a'),
+        record(2, 'Study A. Building height.', study_key='a'),
+        record(3, 'Study B. Building height.', study_key='b'),
+    ]
+    matched, _ = match_studies([('Study A', 'study a')], records)
+    assert [entry['db_record_id'] for entry in matched] == [1, 2]
+
+
+def test_unmatched_and_empty_studies():
+    records = [record(1, 'Street canyons.'), record(2, None)]
+    matched, unmatched = match_studies([('Missing', 'missing'), ('', '')], records, unmatched_reason='none')
+    assert matched == []
+    assert unmatched == [{'study_name': 'Missing', 'normalized_name': 'missing', 'reason': 'none'}]
+
+
+# ============= FUZZY TIERS =============
+
+@pytest.mark.parametrize('threshold, tier', [
+    (100, 'strong_match_90pct'), (90, 'strong_match_90pct'), (89, 'strong_match'), (80, 'strong_match'),
+    (79, 'good_match'), (70, 'good_match'), (69, 'partial_match'), (60, 'partial_match'),
+    (59, 'fuzzy_match'), (50, 'fuzzy_match'), (49, None), (0, None),
+])
+def test_fuzzy_tier_boundaries(threshold, tier):
+    assert fuzzy_tier(threshold) == tier
+
+
+@pytest.mark.parametrize('text, score, tier', [
+    ('Urban form and residential energy use', 100, 'strong_match_90pct'),
+    ('residential energy use and urban form in cities', 100, 'strong_match_90pct'),
+    ('Urban forms and residental energy use', 97, 'strong_match_90pct'),
+    ('urban form residential energy', 88, 'strong_match'),
+    ('urban form and energy use', 81, 'strong_match'),
+    ('urban form residential', 75, 'good_match'),
+    ('urban form energy', 63, 'partial_match'),
+    ('form energy use', 58, 'fuzzy_match'),
+    ('urban energy', 49, None),
+    ('building height', 19, None),
+])
+def test_token_set_similarity_tiers(text, score, tier):
+    assert token_set_similarity(tokens(TITLE), tokens(text)) == score
+    assert fuzzy_tier(score) == tier
+
+
+def test_token_set_similarity_ignores_order_and_duplicates():
+    assert token_set_similarity(tokens('a b c'), tokens('c b a a')) == 100
+    assert token_set_similarity(tokens('a b c'), []) == 0
+
+
+def fuzzy_records():
+    return [
+        record(1, 'Lee (2019). Urban forms and residental energy use. Energy Policy.', study_key='lee'),
+        record(2, 'Lee (2019). Urban forms and residental energy use. Energy Policy.', study_key='lee'),
+        record(3, 'Chen (2018). Street canyon cooling loads. Building and Environment.', study_key='chen'),
+        record(4, 'Kim (2021). Residential energy use and urban form in Seoul. Cities.', study_key='kim'),
+    ]
+
+
+def test_fuzzy_index_scores_paragraphs_best_first():
+    index = FuzzyStudyIndex()
+    records = fuzzy_records()
+    assert list(index.index_records(records)) == records
+    results = index.query(TITLE)
+    assert [([r['id'] for r in group], score, offset) for group, score, offset in results] == [
+        ([4], 100, len('Kim (2021). ')),
+        ([1, 2], 97, len('Lee (2019). ')),
+    ]
+
+
+def test_fuzzy_index_without_candidates():
+    index = FuzzyStudyIndex()
+    list(index.index_records(fuzzy_records()))
+    assert index.query('Thermal comfort of courtyard houses') == []
+    assert index.query('') == []
+
+
+def test_match_studies_falls_back_to_fuzzy_tiers():
+    index = FuzzyStudyIndex()
+    records = index.index_records(fuzzy_records())
+    studies = [(TITLE, TITLE.lower()), ('Street canyon cooling loads', 'street canyon cooling loads')]
+    matched, unmatched = match_studies(studies, records, fuzzy_index=index)
+    assert unmatched == []
+    assert [(e['excel_study'], e['db_record_id'], e['confidence'], e['match_percentage']) for e in matched] == [
+        (TITLE, 4, 'strong_match_90pct', 100),
+        (TITLE, 1, 'strong_match_90pct', 97),
+        (TITLE, 2, 'strong_match_90pct', 97),
+        ('Street canyon cooling loads', 3, 'exact_match', 100),
+    ]